@@ -1,2 +1,2 @@
 cd ../src
-python fixtures.py && python player_fpl_data.py && python player_understat_data.py && python model.py
+python pipeline.py
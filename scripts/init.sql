@@ -1,11 +1,13 @@
 DROP TABLE IF EXISTS player_gws;
 DROP TABLE IF EXISTS player_gws_predicted;
+DROP TABLE IF EXISTS player_gws_simulated;
 DROP TABLE IF EXISTS team_gws;
 DROP TABLE IF EXISTS manager_gws;
 DROP TABLE IF EXISTS players;
 DROP TABLE IF EXISTS managers;
 DROP TABLE IF EXISTS fixtures;
 DROP TABLE IF EXISTS teams;
+DROP TABLE IF EXISTS row_hashes;
 CREATE TABLE IF NOT EXISTS teams(
   fpl_id INT NOT NULL,
   fpl_name VARCHAR(255) PRIMARY KEY,
@@ -87,6 +89,17 @@ CREATE TABLE IF NOT EXISTS player_gws_predicted(
   FOREIGN KEY (fixture_id) REFERENCES fixtures(fpl_id),
   PRIMARY KEY (player_id, fixture_id)
 );
+CREATE TABLE IF NOT EXISTS player_gws_simulated(
+  player_id INT NOT NULL,
+  fixture_id INT NOT NULL,
+  draws INT NOT NULL,
+  mean_points FLOAT(6, 3),
+  std_points FLOAT(6, 3),
+  haul_prob FLOAT(6, 3),
+  p90_points FLOAT(6, 3),
+  FOREIGN KEY (fixture_id) REFERENCES fixtures(fpl_id),
+  PRIMARY KEY (player_id, fixture_id)
+);
 CREATE TABLE IF NOT EXISTS managers(
   id INT PRIMARY KEY,
   manager_name VARCHAR(255) NOT NULL
@@ -98,4 +111,12 @@ CREATE TABLE IF NOT EXISTS manager_gws(
   FOREIGN KEY (manager_id) REFERENCES managers(id),
   FOREIGN KEY (player_id) REFERENCES players(fpl_id),
   PRIMARY KEY (gameweek, manager_id, player_id)
+);
+-- hashes of the values last written to each row, see src/cdc.py --
+CREATE TABLE IF NOT EXISTS row_hashes(
+  table_name VARCHAR(64) NOT NULL,
+  col_set CHAR(16) NOT NULL,
+  row_key VARCHAR(255) NOT NULL,
+  row_hash CHAR(32) NOT NULL,
+  PRIMARY KEY (table_name, col_set, row_key)
 );
\ No newline at end of file
@@ -2,4 +2,6 @@ export FPLDBNAME='fplcoachdb2223'
 mysql -p'password' -u root $(FPLDBNAME) < init.sql
 source $(poetry env info --path)/bin/activate
 cd ../src
-python teams.py && python players.py && python fixtures.py && python player_fpl_data.py && python player_understat_data.py && python model.py
\ No newline at end of file
+# The database is empty, so nothing ingested before is still written.
+rm -f ../data/cache/watermarks.json
+python pipeline.py --force
\ No newline at end of file
@@ -0,0 +1,145 @@
+"""A module for backtesting the model over completed gameweeks.
+
+Replays the season gameweek by gameweek: the predictions for each gameweek
+only use averages of fixtures from earlier gameweeks, i.e. the data that was
+available at that gameweek's deadline. The data is loaded from the database
+once and cached, and the averages as of every deadline are computed in a
+single pass, so the whole replay costs about as much as one prediction run.
+"""
+import argparse
+import os
+import time
+from typing import Dict
+import numpy as np
+import pandas as pd
+from prettytable import PrettyTable
+from constants import (
+    BACKTEST_CACHE_FILE,
+    BACKTEST_RESULTS_FILE,
+    CACHE_DIR,
+    NPXG_ALPHA
+)
+from db import get_manager
+from model import predict_all, predicted_cols
+from preprocess import get_merged_gw_data, player_alphas
+from utils import get_group_deadline_emas
+
+positions = ["G", "D", "M", "F"]
+
+
+def load_backtest_data(refresh: bool = False) -> Dict[str, pd.DataFrame]:
+    """Loads the data needed for a backtest, from the cache if possible.
+
+    Args:
+        refresh: Whether to reload the data from the database even if it is
+          cached.
+
+    Returns:
+        A dictionary with two DataFrames: "players", the merged gameweek data,
+        and "teams", the xG of each team in each fixture, both ordered by
+        kickoff date.
+    """
+    if not refresh and os.path.exists(BACKTEST_CACHE_FILE):
+        return pd.read_pickle(BACKTEST_CACHE_FILE)
+    db = get_manager()
+    data = {
+        "players": get_merged_gw_data(db),
+        "teams": db.get_df("""SELECT fixture_id, team, gameweek, team_xG
+        FROM team_gws
+        WHERE gameweek IS NOT NULL
+        ORDER BY kickoff_date""")
+    }
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    pd.to_pickle(data, BACKTEST_CACHE_FILE)
+    return data
+
+
+def get_deadline_features(players: pd.DataFrame, teams: pd.DataFrame) -> pd.DataFrame:
+    """Computes the model features as they stood at each gameweek's deadline.
+
+    Args:
+        players: The merged gameweek data, ordered by kickoff date.
+        teams: The xG of each team in each fixture, ordered by kickoff date.
+
+    Returns:
+        A copy of players where avg_team_xG and the player averages only
+        include fixtures from gameweeks before each row's gameweek.
+    """
+    team_emas = get_group_deadline_emas(teams, "team", {"team_xG": NPXG_ALPHA})
+    team_emas = pd.concat([teams[["fixture_id", "team"]], team_emas], axis=1)
+    features = players.drop(columns=["avg_team_xG"]).merge(
+        team_emas, on=["fixture_id", "team"], how="left")
+    player_emas = get_group_deadline_emas(features, "player_name", player_alphas)
+    features[player_emas.columns] = player_emas
+    return features
+
+
+def backtest(data: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """Predicts every completed fixture using only data from before its
+    gameweek's deadline.
+
+    Args:
+        data: The players and teams data, as returned by load_backtest_data.
+
+    Returns:
+        The completed rows of the merged gameweek data that the model makes
+        predictions for, with the predicted columns filled in.
+    """
+    features = get_deadline_features(data["players"], data["teams"])
+    rows = features[(features["completed"] == 1)
+                    & (features["avg_minutes"] > 0)].copy()
+    rows[predicted_cols] = predict_all(rows)
+    return rows
+
+
+def get_error_curves(rows: pd.DataFrame) -> pd.DataFrame:
+    """Computes the error of xP against total points in each gameweek.
+
+    Args:
+        rows: Rows with total_points and xP, as returned by backtest.
+
+    Returns:
+        A DataFrame indexed by gameweek, with the number of rows, the mean
+        squared error and mean absolute error over all rows, and the mean
+        squared error for each position.
+    """
+    rows = rows[~rows["xP"].isna()].assign(
+        error=lambda df: df["xP"] - df["total_points"])
+    by_gw = rows.groupby("gameweek")["error"]
+    curves = pd.DataFrame({
+        "n": by_gw.size(),
+        "mse": by_gw.apply(lambda e: np.mean(e ** 2)),
+        "mae": by_gw.apply(lambda e: np.mean(np.abs(e)))
+    })
+    by_position = rows.groupby(["gameweek", "position"])["error"].apply(
+        lambda e: np.mean(e ** 2)).unstack()
+    for position in positions:
+        curves[f"mse_{position}"] = by_position.get(position)
+    curves.index = curves.index.astype(int)
+    return curves.round(2)
+
+
+def main():
+    """Runs a backtest and writes the error curves."""
+    parser = argparse.ArgumentParser(description="Backtest the model")
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="reload the data from the database rather than the cache."
+    )
+    args = parser.parse_args()
+    start = time.perf_counter()
+    rows = backtest(load_backtest_data(args.refresh))
+    curves = get_error_curves(rows)
+    curves.to_csv(BACKTEST_RESULTS_FILE)
+    table = PrettyTable()
+    table.field_names = ["gameweek"] + list(curves.columns)
+    for gameweek, row in curves.iterrows():
+        table.add_row([gameweek] + list(row))
+    print(table)
+    elapsed = time.perf_counter() - start
+    print(f"Backtested {curves.index.size} gameweeks in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 from datetime import datetime
 from os.path import join
 from constants import BACKUP_DIR
-from db import MySQLManager
+from db import get_manager
 from utils import to_json, get_current_gw
 
 
@@ -17,7 +17,7 @@ def main():
         "managers",
         "manager_gws"
     ]
-    db = MySQLManager()
+    db = get_manager()
     for table in tables:
         table_file = join(BACKUP_DIR, f"{table}.csv")
         db.get_df(f"SELECT * FROM {table}").to_csv(table_file, index=False)
@@ -0,0 +1,208 @@
+"""A module for writing only the rows whose values changed.
+
+Reruns of the ingestion scripts mostly rewrite rows that are already stored,
+such as the player_gws of past fixtures. ChangeWriter sits in front of a
+MySQLManager, and keeps a hash of the values last written to each row, keyed
+by the row's primary key. Rows whose hash is unchanged are skipped, and only
+new or changed rows are sent to MySQL.
+
+Hashes are stored in the row_hashes table, created by scripts/init.sql,
+once the rows they describe have been committed, so they never claim a
+write that did not happen. They are kept per set of columns written, since
+e.g. player_gws is inserted from FPL and updated from Understat.
+"""
+import hashlib
+import json
+import threading
+from typing import Any, Dict, List, NamedTuple, Optional, Set, Tuple
+from constants import DB_BATCH_SIZE
+from db import MySQLManager, get_manager
+from utils import prepare_param
+
+HASH_TABLE = "row_hashes"
+
+PRIMARY_KEYS = {
+    "fixtures": ["fpl_id"],
+    "managers": ["id"],
+    "manager_gws": ["gameweek", "manager_id", "player_id"],
+    "players": ["fpl_id"],
+    "player_gws": ["player_id", "fixture_id"],
+    "player_gws_predicted": ["player_id", "fixture_id"],
+    "player_gws_simulated": ["player_id", "fixture_id"],
+    "teams": ["fpl_name"],
+    "team_gws": ["fixture_id", "team"],
+}
+
+
+class WriteCounts(NamedTuple):
+    """The number of rows of a write that were inserted, updated, and
+    skipped because they were unchanged."""
+    inserted: int = 0
+    updated: int = 0
+    skipped: int = 0
+
+
+def get_row_key(row: Dict[str, Any], key_cols: List[str]) -> str:
+    """Returns a row's primary key as a string."""
+    return json.dumps([prepare_param(row[col]) for col in key_cols], default=str)
+
+
+def get_row_hash(row: Dict[str, Any], col_names: List[str]) -> str:
+    """Returns the MD5 hash of a row's values in the given columns."""
+    values = [prepare_param(row[col]) for col in col_names]
+    return hashlib.md5(json.dumps(values, default=str).encode()).hexdigest()
+
+
+def get_col_set(col_names: List[str]) -> str:
+    """Returns an identifier of a set of columns, regardless of order."""
+    return hashlib.md5(",".join(sorted(col_names)).encode()).hexdigest()[:16]
+
+
+class ChangeWriter:
+    """A wrapper of a MySQLManager whose writes skip unchanged rows.
+
+    Every other method is passed through to the manager. Unlike the
+    manager's insert_rows and update_rows, which return MySQL's rowcount,
+    the wrapped writes return WriteCounts.
+
+    Writes to the same table are serialized by a lock per table, so that
+    their hashes are saved in the order the rows were written, while writes
+    to different tables run concurrently. The shared lock only guards the
+    in-memory keys and hashes.
+    """
+
+    def __init__(self, db: MySQLManager):
+        self.db = db
+        self.lock = threading.Lock()
+        # table name -> the lock held while writing to the table
+        self.table_locks: Dict[str, threading.Lock] = {}
+        # table name -> the keys of the rows in the table
+        self.keys: Dict[str, Set[str]] = {}
+        # (table name, column set) -> row key -> row hash
+        self.hashes: Dict[Tuple[str, str], Dict[str, str]] = {}
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.db, name)
+
+    def table_lock(self, table_name: str) -> threading.Lock:
+        """Returns the lock held while writing to a table."""
+        with self.lock:
+            return self.table_locks.setdefault(table_name, threading.Lock())
+
+    def get_keys(self, table_name: str) -> Set[str]:
+        """Returns the keys of the rows in a table, loaded on first call."""
+        if table_name not in self.keys:
+            key_cols = PRIMARY_KEYS[table_name]
+            rows = self.db.exec_query(
+                f"SELECT {','.join(key_cols)} FROM {table_name}")
+            self.keys[table_name] = {
+                get_row_key(dict(zip(key_cols, row)), key_cols) for row in rows}
+        return self.keys[table_name]
+
+    def get_hashes(self, table_name: str, col_set: str) -> Dict[str, str]:
+        """Returns the hash of each row's columns in a column set, loaded on
+        first call."""
+        if (table_name, col_set) not in self.hashes:
+            rows = self.db.exec_query(
+                f"""SELECT row_key, row_hash FROM {HASH_TABLE}
+                WHERE table_name = '{table_name}' AND col_set = '{col_set}'""")
+            self.hashes[(table_name, col_set)] = dict(rows)
+        return self.hashes[(table_name, col_set)]
+
+    def diff(
+        self,
+        table_name: str,
+        rows: List[Dict[str, Any]],
+        col_names: List[str]
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, str]]:
+        """Returns the rows whose values differ from those last written, and
+        their new hashes by row key."""
+        hashes = self.get_hashes(table_name, get_col_set(col_names))
+        key_cols = PRIMARY_KEYS[table_name]
+        changed, new_hashes = [], {}
+        for row in rows:
+            row_key = get_row_key(row, key_cols)
+            row_hash = get_row_hash(row, col_names)
+            if hashes.get(row_key) != row_hash and new_hashes.get(row_key) != row_hash:
+                changed.append(row)
+                new_hashes[row_key] = row_hash
+        return changed, new_hashes
+
+    def save_hashes(self, table_name: str, col_names: List[str],
+                    new_hashes: Dict[str, str]) -> None:
+        """Stores the hashes of rows that have been written."""
+        col_set = get_col_set(col_names)
+        self.db.insert_rows(HASH_TABLE, [
+            {"table_name": table_name, "col_set": col_set,
+             "row_key": row_key, "row_hash": row_hash}
+            for row_key, row_hash in new_hashes.items()
+        ])
+        with self.lock:
+            self.hashes[(table_name, col_set)].update(new_hashes)
+
+    def insert_rows(self, table_name: str, rows: List[Dict[str, Any]],
+                    batch_size: int = DB_BATCH_SIZE) -> WriteCounts:
+        """Upserts the rows that are new or changed since they were last
+        written.
+
+        Returns:
+            A WriteCounts of the number of rows inserted, updated and skipped,
+            rather than MySQLManager.insert_rows' rowcount.
+        """
+        if rows == [] or table_name not in PRIMARY_KEYS:
+            self.db.insert_rows(table_name, rows, batch_size)
+            return WriteCounts(inserted=len(rows))
+        col_names = list(rows[0].keys())
+        with self.table_lock(table_name):
+            with self.lock:
+                keys = self.get_keys(table_name)
+                changed, new_hashes = self.diff(table_name, rows, col_names)
+                inserted = len(new_hashes.keys() - keys)
+            self.db.insert_rows(table_name, changed, batch_size)
+            self.save_hashes(table_name, col_names, new_hashes)
+            with self.lock:
+                keys.update(new_hashes)
+        return WriteCounts(inserted, len(changed) - inserted,
+                           len(rows) - len(changed))
+
+    def update_rows(self, table_name: str, key_cols: List[str],
+                    rows: List[Dict[str, Any]],
+                    batch_size: int = DB_BATCH_SIZE) -> WriteCounts:
+        """Updates the rows that changed since they were last written.
+
+        Rows that are not in the table are skipped, since the update would
+        ignore them, and are not hashed, so that they are written once they
+        are inserted.
+
+        Returns:
+            A WriteCounts of the number of rows updated and skipped, rather
+            than MySQLManager.update_rows' rowcount.
+        """
+        if rows == [] or table_name not in PRIMARY_KEYS:
+            self.db.update_rows(table_name, key_cols, rows, batch_size)
+            return WriteCounts(updated=len(rows))
+        col_names = list(rows[0].keys())
+        table_key_cols = PRIMARY_KEYS[table_name]
+        with self.table_lock(table_name):
+            with self.lock:
+                keys = self.get_keys(table_name)
+                present = [row for row in rows
+                           if get_row_key(row, table_key_cols) in keys]
+                changed, new_hashes = self.diff(table_name, present, col_names)
+            self.db.update_rows(table_name, key_cols, changed, batch_size)
+            self.save_hashes(table_name, col_names, new_hashes)
+        return WriteCounts(updated=len(changed), skipped=len(rows) - len(changed))
+
+
+_writer: Optional[ChangeWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> ChangeWriter:
+    """Returns the ChangeWriter shared by the whole process, in front of the
+    shared MySQLManager."""
+    global _writer  # pylint: disable=global-statement
+    with _writer_lock:
+        if _writer is None:
+            _writer = ChangeWriter(get_manager())
+    return _writer
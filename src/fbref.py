@@ -1,41 +1,66 @@
+import asyncio
+import atexit
+import io
+import threading
 import unidecode
+import aiohttp
 import fbrefscraper
-import pandas as pd
+import httpcache
 import requests
-from bs4 import BeautifulSoup
 import os
 import json
 import utils
-import random
-import time
-import urllib
+from constants import (
+    CACHE_DIR,
+    FBREF_CONCURRENCY,
+    FBREF_IDS_DB_FILE,
+    FBREF_IDS_FILE,
+    FBREF_PROGRESS_FILE,
+    FBREF_RETRIES,
+    FBREF_TIMEOUT,
+    JSON_DIR
+)
+from idstore import IdStore
+from ratelimit import parse_retry_after
 
 
-def get_id(player):
-    path = "../data/json/fpl_fbref_ids.json"
-    ids = {}
-    if os.path.exists(path):
-        ids = utils.from_json(path)
-        if player["id"] in ids:
-            return ids[player["id"]]
-    fbref_id = fbrefscraper.get_id(player)
-    ids[player["id"]] = fbref_id
-    utils.to_json(path, ids)
-    return fbref_id
+_id_store = None
+_id_store_lock = threading.Lock()
 
 
-def exponential_backoff(f, max_retries=5, backoff=1):
-    retries = 0
-    while True:
-        try:
-            return f()
-        except urllib.error.HTTPError:
-            if retries == max_retries:
-                print("Max retries reached")
-                raise
-            else:
-                time.sleep(backoff * 2 ** retries + random.uniform(0, 1))
-                retries += 1
+def get_id_store():
+    """Returns the store of fbref ids, which is opened on first use and
+    shared by the whole process."""
+    global _id_store  # pylint: disable=global-statement
+    with _id_store_lock:
+        if _id_store is None:
+            _id_store = IdStore(FBREF_IDS_DB_FILE, legacy_files=[
+                os.path.join(JSON_DIR, "fpl_fbref_ids.json"),
+                FBREF_IDS_FILE
+            ])
+            atexit.register(_id_store.close)
+        return _id_store
+
+
+def get_id(player):
+    """Returns a player's fbref id, or None if it is unknown.
+
+    Ids are looked up in the id store first. Players that fbref does not
+    list are stored with a None id, so they are not searched for again, but
+    players whose pages could not be fetched are not stored, so they are
+    searched for on the next call.
+    """
+    store = get_id_store()
+    fbref_id, ok = store.get(player["id"])
+    if ok:
+        return fbref_id
+    try:
+        fbref_id = fbrefscraper.get_id(player)
+    except fbrefscraper.PageNotFetchedError as e:
+        print(f"Could not fetch fbref page {e} for {fbrefscraper.string(player)}")
+        return None
+    store.put(player["id"], fbref_id)
+    return fbref_id
 
 
 def clean(x):
@@ -54,21 +79,125 @@ def clean(x):
 #         print(url)
 
 
-def get_season_stats(player_id, season):
+def parse_season_stats(html, season):
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+    df = pd.read_html(io.StringIO(html))[0]
+    seasons = df[df["Unnamed: 0_level_0"]["Season"] == season]["Per 90 Minutes"]
+    if len(seasons) == 0:
+        # the player did not play that season
+        return {"npxG": 0.0, "xA": 0.0}
+    stats = seasons.iloc[0]
+    return {
+        "npxG": clean(stats["npxG"]),
+        "xA": clean(stats["xA"])
+    }
+
+
+async def fetch_html(session, url):
+    """Fetches a page from fbref, waiting on the shared rate limiter before
+    each attempt and honouring the Retry-After header of 429 responses.
+
+    Returns:
+        The page's html, or None if it could not be fetched.
+    """
+    limiter = fbrefscraper.limiter
+    timeout = aiohttp.ClientTimeout(total=FBREF_TIMEOUT)
+    for attempt in range(FBREF_RETRIES + 1):
+        await limiter.acquire_async()
+        try:
+            async with session.get(url, timeout=timeout) as response:
+                if response.status == 429:
+                    retry_after = parse_retry_after(
+                        response.headers.get("Retry-After"), 60)
+                    print(f"Too many requests sent to {url}, "
+                          f"waiting {retry_after:.0f}s")
+                    limiter.pause(retry_after)
+                    continue
+                response.raise_for_status()
+                return await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Could not fetch {url} ({attempt + 1}/{FBREF_RETRIES + 1}): {e}")
+    return None
+
+
+async def fetch_season_stats(session, player_id, season):
+    """Fetches a player's per 90 npxG and xA in the given season.
+
+    Returns:
+        The player's stats, zeros if they did not play that season, or None
+        if they have no fbref id or their page could not be fetched or
+        parsed.
+    """
+    if player_id is None:
+        return None
     url = f"https://fbref.com/en/players/{player_id}/dom_lg/"
+    html = await fetch_html(session, url)
+    if html is None:
+        return None
     try:
-      df = exponential_backoff(lambda: pd.read_html(url)[0])
-      stats = df[df["Unnamed: 0_level_0"]["Season"] == season]["Per 90 Minutes"].iloc[0]
-      print(stats["npxG"])
-      print(stats["xA"])
-      return {
-        "npxG": stats["npxG"],
-        "xA": stats["xA"]
-      }
+        return parse_season_stats(html, season)
     except Exception as e:
         print(e)
         print(url)
-        return {
-        "npxG": 0.0,
-        "xA": 0.0
-      }
\ No newline at end of file
+        return None
+
+
+async def fetch_all_season_stats(player_ids, season, concurrency):
+    """Fetches the per 90 stats of the players that are not in
+    FBREF_PROGRESS_FILE yet, saving each player's stats as they arrive.
+
+    Returns:
+        A map from fbref id to the player's stats, which are None for players
+        without an fbref id or whose stats could not be fetched.
+    """
+    progress = {}
+    if os.path.exists(FBREF_PROGRESS_FILE):
+        progress = utils.from_json(FBREF_PROGRESS_FILE)
+    done = progress.setdefault(season, {})
+    remaining = list({player_id for player_id in player_ids
+                      if player_id is not None and player_id not in done})
+    if len(remaining) > 0:
+        print(f"Fetching {len(remaining)} players from fbref "
+              f"({len(done)} already fetched)")
+        os.makedirs(CACHE_DIR, exist_ok=True)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch_one(session, player_id):
+        async with semaphore:
+            return player_id, await fetch_season_stats(session, player_id, season)
+
+    async with aiohttp.ClientSession() as session:
+        tasks = [fetch_one(session, player_id) for player_id in remaining]
+        for i, task in enumerate(asyncio.as_completed(tasks)):
+            player_id, stats = await task
+            if stats is None:
+                continue
+            done[player_id] = stats
+            httpcache.write_atomic(
+                FBREF_PROGRESS_FILE, json.dumps(progress).encode())
+            print(f"Fetched {i + 1}/{len(remaining)} players from fbref")
+    return {player_id: done.get(player_id) for player_id in player_ids}
+
+
+def get_all_season_stats(player_ids, season, concurrency=FBREF_CONCURRENCY):
+    """Fetches the per 90 stats of many players in the given season.
+
+    Stats are fetched by concurrent workers that share fbref's rate limit,
+    and each player's stats are saved to FBREF_PROGRESS_FILE as soon as they
+    are fetched, so an interrupted run resumes where it left off.
+
+    Args:
+        player_ids: The fbref ids of the players.
+        season: The season, e.g. "2021-2022".
+        concurrency: The maximum number of requests in flight at once.
+
+    Returns:
+        A map from fbref id to the player's stats, which are None for players
+        without an fbref id or whose stats could not be fetched, so that
+        they are seeded again.
+    """
+    return asyncio.run(fetch_all_season_stats(player_ids, season, concurrency))
+
+
+def get_season_stats(player_id, season):
+    return get_all_season_stats([player_id], season)[player_id]
@@ -0,0 +1,204 @@
+"""A module for indexing the fbref pages cached in data/html.
+
+Prefix pages (e.g. aa.html) list every player whose surname starts with the
+prefix, and squad pages (e.g. squad-1-2021-2022.html) list a team's players
+in a season. Each page is parsed once with lxml into a list of
+(normalized name, fbref id, positions) entries, and the index is saved to
+FBREF_INDEX_FILE. It is only rebuilt for pages whose mtime changed.
+
+Run this module to rebuild the index.
+"""
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+import lxml.html
+import unidecode
+from constants import FBREF_INDEX_FILE, HTML_CACHE_DIR
+import httpcache
+
+POSITION_PATTERN = re.compile(r"\b(GK|DF|MF|FW)\b")
+# fbref serves every page as UTF-8.
+HTML_PARSER = lxml.html.HTMLParser(encoding="utf-8")
+
+# A list of [normalized name, fbref id, positions] entries in page order,
+# where positions is a comma separated string such as "DF,MF".
+Entries = List[List[str]]
+
+
+def normalize(name: str) -> str:
+    """Returns a name without accents, in lower case, and with hyphens
+    replaced by spaces."""
+    return unidecode.unidecode(name).lower().replace("-", " ")
+
+
+def get_positions(text: str) -> str:
+    """Returns the positions mentioned in text, e.g. "DF,MF"."""
+    return ",".join(POSITION_PATTERN.findall(text))
+
+
+def parse_prefix_page(html: bytes) -> Entries:
+    """Returns the players listed on a prefix page whose names are in bold,
+    i.e. the players who are still active."""
+    root = lxml.html.fromstring(html, parser=HTML_PARSER)
+    entries = []
+    for p in root.iterfind(".//p"):
+        strong = p.find(".//strong")
+        link = p.find(".//a")
+        if strong is None or link is None:
+            continue
+        href = link.get("href", "").split("/")
+        if len(href) < 4:
+            continue
+        name = strong.text_content()
+        tail = p.text_content().replace(name, "", 1)
+        entries.append([normalize(name), href[3], get_positions(tail)])
+    return entries
+
+
+def parse_squad_page(html: bytes) -> Entries:
+    """Returns the players listed in the first table of a squad page."""
+    root = lxml.html.fromstring(html, parser=HTML_PARSER)
+    tbody = root.find(".//tbody")
+    if tbody is None:
+        return []
+    entries = []
+    for th in tbody.iterfind(".//th[@data-append-csv]"):
+        link = th.find(".//a")
+        if link is None:
+            continue
+        position = th.getparent().find("td[@data-stat='position']")
+        positions = "" if position is None else position.text_content()
+        entries.append([normalize(link.text_content()),
+                        th.get("data-append-csv"), get_positions(positions)])
+    return entries
+
+
+def parse_page(file_name: str, html: bytes) -> Entries:
+    """Returns the players listed on a squad or prefix page."""
+    if file_name.startswith("squad-"):
+        return parse_squad_page(html)
+    return parse_prefix_page(html)
+
+
+class FbrefIndex:
+    """An index from normalized player name to fbref id, for each cached
+    fbref page.
+
+    The index is shared by the threads that resolve fbref ids, so every
+    read and update of pages and lookups holds the lock. It is reentrant,
+    so that lookups can refresh the page they read.
+    """
+
+    def __init__(self, index_file: str = FBREF_INDEX_FILE,
+                 html_dir: str = HTML_CACHE_DIR):
+        self.index_file = index_file
+        self.html_dir = html_dir
+        self.lock = threading.RLock()
+        # page name, without extension -> {"mtime": ..., "entries": ...}
+        self.pages: Dict[str, dict] = {}
+        # page name -> normalized name -> (entry position, fbref id)
+        self.lookups: Dict[str, Dict[str, Tuple[int, str]]] = {}
+        if os.path.exists(index_file):
+            with open(index_file, encoding="utf-8") as json_file:
+                self.pages = json.load(json_file)
+
+    def page_file(self, page: str) -> str:
+        """Returns the path of a cached page."""
+        return os.path.join(self.html_dir, f"{page}.html")
+
+    def is_stale(self, page: str) -> bool:
+        """Returns whether a page was cached, changed or removed since it was
+        last indexed."""
+        page_file = self.page_file(page)
+        if not os.path.exists(page_file):
+            return page in self.pages
+        return (page not in self.pages
+                or self.pages[page]["mtime"] != os.path.getmtime(page_file))
+
+    def update_page(self, page: str) -> None:
+        """Re-parses a page, or drops it from the index if it was removed."""
+        page_file = self.page_file(page)
+        self.lookups.pop(page, None)
+        if not os.path.exists(page_file):
+            self.pages.pop(page, None)
+            return
+        mtime = os.path.getmtime(page_file)
+        with open(page_file, "rb") as html_file:
+            entries = parse_page(page, html_file.read())
+        self.pages[page] = {"mtime": mtime, "entries": entries}
+
+    def save(self) -> None:
+        """Writes the index to index_file."""
+        os.makedirs(os.path.dirname(self.index_file), exist_ok=True)
+        httpcache.write_atomic(
+            self.index_file, json.dumps(self.pages).encode())
+
+    def refresh(self, pages: Optional[Iterable[str]] = None) -> int:
+        """Re-parses the given pages, or every cached page, whose mtime
+        changed since they were last indexed, and saves the index if any
+        were.
+
+        Returns:
+            The number of pages that were re-parsed.
+        """
+        with self.lock:
+            if pages is None:
+                pages = {os.path.splitext(file_name)[0]
+                         for file_name in os.listdir(self.html_dir)
+                         if file_name.endswith(".html")}
+                pages.update(self.pages)
+            stale = [page for page in pages if self.is_stale(page)]
+            for page in stale:
+                self.update_page(page)
+            if len(stale) > 0:
+                self.save()
+            return len(stale)
+
+    def entries(self, page: str) -> Entries:
+        """Returns the players listed on a page, re-parsing it first if it
+        changed."""
+        with self.lock:
+            self.refresh([page])
+            return self.pages.get(page, {}).get("entries", [])
+
+    def lookup(self, page: str, names: Iterable[str]) -> Optional[str]:
+        """Returns the fbref id of the first player on the page whose name
+        matches any of the given names, or None if none match."""
+        with self.lock:
+            if page not in self.lookups or self.is_stale(page):
+                lookup = {}
+                for i, (name, fbref_id, _) in enumerate(self.entries(page)):
+                    lookup.setdefault(name, (i, fbref_id))
+                self.lookups[page] = lookup
+            lookup = self.lookups[page]
+        hits = [lookup[name] for name in map(normalize, names) if name in lookup]
+        return min(hits)[1] if len(hits) > 0 else None
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_index() -> FbrefIndex:
+    """Returns the index shared by the whole process, which is loaded from
+    disk on first call."""
+    global _index  # pylint: disable=global-statement
+    with _index_lock:
+        if _index is None:
+            _index = FbrefIndex()
+    return _index
+
+
+def main():
+    """Rebuilds the index of every cached page."""
+    start = time.perf_counter()
+    num_pages = get_index().refresh()
+    elapsed = time.perf_counter() - start
+    print(f"Indexed {num_pages} fbref pages in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,55 +1,83 @@
-import urllib.request
-from bs4 import BeautifulSoup
-import requests
-import pandas as pd
-import json
 import os
-import time
+import threading
+import requests
 import unidecode
-from difflib import SequenceMatcher
+from constants import (
+    FBREF_REQUESTS_PER_MINUTE,
+    FBREF_RETRIES,
+    FBREF_TIMEOUT,
+    HTML_CACHE_DIR
+)
+from httpcache import write_atomic
+from ratelimit import TokenBucket, parse_retry_after
+import fbrefindex
 
-HTML_CACHE_DIR = "../data/html"
+# Shared by every request to fbref, synchronous or not, so that together they
+# stay within fbref's crawl rate.
+limiter = TokenBucket(FBREF_REQUESTS_PER_MINUTE / 60)
 
+# page name -> lock held while the page is checked and fetched, so that
+# threads resolving players on the same page fetch it only once
+_page_locks = {}
+_page_locks_lock = threading.Lock()
 
-def clean(name):
-    return unidecode.unidecode(name).lower().replace("-", " ")
 
+class PageNotFetchedError(Exception):
+    """Raised when an fbref page that is needed to find a player could not
+    be fetched, so whether the player is on it is unknown."""
 
-def matches(name, names):
-    for candidate_name in names:
-        if clean(name) == clean(candidate_name):
-            return True
-    return False
 
-
-def check_cache(name):
-    cache_file = os.path.join(HTML_CACHE_DIR, f"{name}.html")
-    if not os.path.exists(cache_file):
-        return None, False
-    with open(cache_file, "rb") as f:
-        return f.read(), True
+def page_lock(name):
+    with _page_locks_lock:
+        return _page_locks.setdefault(name, threading.Lock())
 
 
 def write_cache(name, html):
     cache_file = os.path.join(HTML_CACHE_DIR, f"{name}.html")
-    with open(cache_file, "wb") as f:
-        f.write(html)
-
-
-def fetch(url, cache_file, cache):
-    if cache:
-        html, ok = check_cache(cache_file)
-        if ok:
-            return html, True
-    response = requests.get(url)
-    if response.status_code == 429:
-        print(f"Too many requests sent to {url}")
+    write_atomic(cache_file, html)
+
+
+def download(url, cache_file):
+    """Fetches a page into the html cache, retrying failed requests and
+    honouring the Retry-After header of 429 responses.
+
+    Returns:
+        The page's html and True, or None and False if it could not be
+        fetched.
+    """
+    for attempt in range(FBREF_RETRIES + 1):
+        limiter.acquire()
+        try:
+            response = requests.get(url, timeout=FBREF_TIMEOUT)
+        except requests.RequestException as e:
+            print(f"Could not fetch {url} ({attempt + 1}/{FBREF_RETRIES + 1}): {e}")
+            continue
+        if response.status_code != 429:
+            break
+        retry_after = parse_retry_after(
+            response.headers.get("Retry-After"), 60)
+        print(f"Too many requests sent to {url}, waiting {retry_after:.0f}s")
+        limiter.pause(retry_after)
+    else:
+        return None, False
+    if not response.ok:
+        print(f"Could not fetch {url}: {response.status_code}")
         return None, False
     html = response.content
     write_cache(cache_file, html)
     return html, True
 
 
+def ensure_cached(url, name):
+    """Fetches the page at url into the html cache, unless it is cached
+    already. Returns whether the page is cached."""
+    with page_lock(name):
+        if os.path.exists(os.path.join(HTML_CACHE_DIR, f"{name}.html")):
+            return True
+        _, ok = download(url, name)
+        return ok
+
+
 def candidate_names(player):
     return [
         player["web_name"],
@@ -58,33 +86,20 @@ def candidate_names(player):
     ]
 
 
-def extract_id(p):
-    try:
-        return p.find("a")["href"].split("/")[3]
-    except:
-        return None
-
-
 def string(player):
     return f"{player['web_name']} ({player['id']})"
 
 
 def search(prefix, player):
-    html, ok = fetch(
-        f"https://fbref.com/en/players/{prefix}/", prefix, cache=True)
-    if not ok:
-        return None
-    bs = BeautifulSoup(html, 'html.parser')
-    for p in bs.find_all("p"):
-        name = p.find("strong")
-        if name == None:
-            continue
-        names = candidate_names(player)
-        if matches(name.text, names):
-            fbref_id = extract_id(p)
-            if fbref_id is not None:
-                return fbref_id
-    return None
+    """Returns the fbref id of the player on the index page of a name
+    prefix, or None if they are not on it.
+
+    Raises:
+        PageNotFetchedError: If the page could not be fetched.
+    """
+    if not ensure_cached(f"https://fbref.com/en/players/{prefix}/", prefix):
+        raise PageNotFetchedError(prefix)
+    return fbrefindex.get_index().lookup(prefix, candidate_names(player))
 
 
 def get_prefix(s):
@@ -92,15 +107,32 @@ def get_prefix(s):
 
 
 def get_id_from_index(player):
+    """Searches the index pages of the prefixes of a player's names for
+    their fbref id.
+
+    Returns:
+        The player's fbref id, or None if they are on none of the pages.
+
+    Raises:
+        PageNotFetchedError: If the player was not found and one of the
+          pages could not be fetched.
+    """
     prefixes = [
         get_prefix(player['web_name'].split(" ")[-1]),
         get_prefix(player['second_name']),
         get_prefix(player['second_name'].split(" ")[-1])
     ]
+    not_fetched = None
     for prefix in prefixes:
-        fbref_id = search(prefix, player)
+        try:
+            fbref_id = search(prefix, player)
+        except PageNotFetchedError as e:
+            not_fetched = e
+            continue
         if fbref_id is not None:
             return fbref_id
+    if not_fetched is not None:
+        raise not_fetched
     print(f"not found: {string(player)}")
     return None
 
@@ -129,22 +161,25 @@ team_ids = {
 }
 
 
-def get_players(team_id, season):
-    squad = {}
+def get_squad_page(team_id, season):
+    """Returns the name of a team's cached squad page in a season, fetching
+    it first if needed.
+
+    Raises:
+        PageNotFetchedError: If the page could not be fetched.
+    """
     team_fbref_id = team_ids[team_id]
     url = f"https://fbref.com/en/squads/{team_fbref_id}/{season}/"
-    html, ok = fetch(url, f"squad-{team_id}-{season}", True)
-    if not ok:
-        exit(1)
-    bs = BeautifulSoup(html, 'html.parser')
-    table = bs.find("tbody").find_all("th")
-    for row in table:
-        try:
-            fbref_id, name = row["data-append-csv"], row.find("a").text
-            squad[fbref_id] = name
-        except:
-            continue
-    return squad
+    page = f"squad-{team_id}-{season}"
+    if not ensure_cached(url, page):
+        raise PageNotFetchedError(page)
+    return page
+
+
+def get_players(team_id, season):
+    page = get_squad_page(team_id, season)
+    return {fbref_id: name
+            for name, fbref_id, _ in fbrefindex.get_index().entries(page)}
 
 
 hardcoded_conversions = {
@@ -185,13 +220,28 @@ hardcoded_conversions = {
 
 
 def get_id(player):
+    """Returns a player's fbref id, looking them up on their team's squad
+    page and then on the index pages of their names' prefixes.
+
+    Returns:
+        The player's fbref id, or None if they are on none of the pages.
+
+    Raises:
+        PageNotFetchedError: If the player was not found and one of the
+          pages could not be fetched.
+    """
     if player["id"] in hardcoded_conversions:
         return hardcoded_conversions[player["id"]]
-    squad_players = get_players(player["team"], "2021-2022")
-    names = candidate_names(player)
-    for fbref_id, name in squad_players.items():
-        if matches(name, names):
-            return fbref_id
+    try:
+        page = get_squad_page(player["team"], "2021-2022")
+    except PageNotFetchedError as e:
+        fbref_id = get_id_from_index(player)
+        if fbref_id is None:
+            raise e
+        return fbref_id
+    fbref_id = fbrefindex.get_index().lookup(page, candidate_names(player))
+    if fbref_id is not None:
+        return fbref_id
     return get_id_from_index(player)
 
 
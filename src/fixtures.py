@@ -1,24 +1,69 @@
 """A module for loading fixture data from FPL. """
-from typing import Any, Dict
+from __future__ import annotations
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 import asyncio
+import io
+import os
 import sys
+import threading
 import aiohttp
-import pandas as pd
-import requests
 from understat import Understat
-from constants import FPL_FIXTURES_URL, FTE_MATCHES_URL, START_YEAR
+from constants import (
+    CACHE_DIR,
+    FPL_FIXTURES_URL,
+    FTE_FILE,
+    FTE_MATCHES_URL,
+    FTE_TTL,
+    START_YEAR
+)
+import fplapi
+from httpcache import fetch_cached
+import metrics
 from teams import create_team_map
 from utils import parse_date, Row, Rows
-from db import MySQLManager
+from cdc import get_writer
+from db import get_manager
 
-id_to_name = create_team_map("fpl_id", "fpl_name")
-ustat_to_fpl = create_team_map("understat_name", "fpl_name")
-fpl_to_fte = create_team_map("fpl_name", "fte_name")
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+@lru_cache(maxsize=None)
+def get_team_map(key_col: str, val_col: str) -> Dict[Any, str]:
+    """Returns create_team_map(key_col, val_col), built on first call."""
+    return create_team_map(key_col, val_col)
+
+
+_fte_index: Optional[Dict[Tuple[str, str], Row]] = None
+_fte_index_lock = threading.Lock()
+
+
+class FixtureNotFoundError(Exception):
+    """Raised when fixtures are missing from the FiveThirtyEight dataset.
+
+    Attributes:
+        fixtures: The (home team, away team) pairs that were not found, named
+          as on FPL.
+    """
+
+    def __init__(self, fixtures: List[Tuple[str, str]]):
+        self.fixtures = fixtures
+        names = ", ".join(f"{home} vs. {away}" for home, away in fixtures)
+        super().__init__(
+            f"{len(fixtures)} fixture(s) not found in FiveThirtyEight dataset: {names}")
 
 
 def get_fte_df() -> pd.DataFrame:
-    """Returns data from FiveThirtyEight's SPI csv as a pandas DataFrame."""
-    fte_df = pd.read_csv(FTE_MATCHES_URL)
+    """Returns data from FiveThirtyEight's SPI csv as a pandas DataFrame.
+
+    The csv is cached on disk, and revalidated once it is older than FTE_TTL
+    seconds.
+    """
+    import pandas as pd  # pylint: disable=import-outside-toplevel
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    body = fetch_cached(FTE_MATCHES_URL, FTE_FILE, FTE_TTL)
+    fte_df = pd.read_csv(io.BytesIO(body))
     fte_df = fte_df[(fte_df["league"] == "Barclays Premier League")
                     & (fte_df["season"] == START_YEAR)]
     cols = ["date", "team1", "team2", "proj_score1",
@@ -26,7 +71,21 @@ def get_fte_df() -> pd.DataFrame:
     return fte_df[cols]
 
 
-df_fte = get_fte_df()
+def get_fte_index() -> Dict[Tuple[str, str], Row]:
+    """Returns a map from a home and away team, named as on FiveThirtyEight,
+    to the stats of their match.
+
+    The SPI data is only loaded on first call.
+    """
+    global _fte_index  # pylint: disable=global-statement
+    with _fte_index_lock:
+        if _fte_index is None:
+            records = get_fte_df().to_dict("records")
+            # Keeps the first match of a pair, like the mask scan it replaces.
+            _fte_index = {}
+            for record in records:
+                _fte_index.setdefault((record["team1"], record["team2"]), record)
+        return _fte_index
 
 
 def find_col(fixture: Row, col: str, home: bool) -> Any:
@@ -83,6 +142,7 @@ def update_fixtures(fixture_ids: Dict[str, Dict[str, int]], fixtures: Rows) -> N
           their understat ID.
         fixtures: The list of fixtures to be added to fixture_ids.
     """
+    ustat_to_fpl = get_team_map("understat_name", "fpl_name")
     for fixture in fixtures:
         home_team = ustat_to_fpl[fixture["h"]["title"]]
         away_team = ustat_to_fpl[fixture["a"]["title"]]
@@ -99,8 +159,10 @@ async def get_understat_fixtures() -> Dict[str, Dict[str, int]]:
     fixture_ids = {}
     async with aiohttp.ClientSession() as session:
         understat = Understat(session)
+        metrics.record_http_call()
         old_fixtures = await understat.get_league_results("epl", START_YEAR)
         update_fixtures(fixture_ids, old_fixtures)
+        metrics.record_http_call()
         upcoming_fixtures = await understat.get_league_fixtures("epl", START_YEAR)
         update_fixtures(fixture_ids, upcoming_fixtures)
     return fixture_ids
@@ -108,39 +170,47 @@ async def get_understat_fixtures() -> Dict[str, Dict[str, int]]:
 
 def fixture_id_map() -> Dict[int, int]:
     """Returns a map from understat fixture ids to FPL fixture ids."""
-    db = MySQLManager()
+    db = get_manager()
     ids = db.exec_query("SELECT understat_id, fpl_id FROM fixtures")
     return dict(ids)
 
 
-def get_match_stats(home_team: str, away_team: str) -> pd.DataFrame:
-    """Returns a single row of a pandas DataFrame with match stats.
+def get_match_stats(home_team: str, away_team: str) -> Row:
+    """Returns the match stats of a fixture from FiveThirtyEight's dataset.
 
-    Requires:
-        The fixture must be from the current Premier League season.
+    Raises:
+        FixtureNotFoundError: If the fixture is not in the current Premier
+          League season.
     """
-    try:
-        home = fpl_to_fte[home_team]
-        away = fpl_to_fte[away_team]
-        cols = (df_fte["team1"] == home) & (df_fte["team2"] == away)
-        return df_fte[cols].iloc[0]
-    except IndexError:
-        print(
-            f"Error: fixture {home_team} vs. {away_team} not found in FiveThirtyEight dataset"
-        )
-        sys.exit(1)
+    fpl_to_fte = get_team_map("fpl_name", "fte_name")
+    key = (fpl_to_fte[home_team], fpl_to_fte[away_team])
+    stats = get_fte_index().get(key)
+    if stats is None:
+        raise FixtureNotFoundError([(home_team, away_team)])
+    return stats
 
 
 def get_fixtures() -> Rows:
-    """Returns all of the rows to be inserted into the fixtures table."""
-    fpl_fixtures = requests.get(FPL_FIXTURES_URL).json()
+    """Returns all of the rows to be inserted into the fixtures table.
+
+    Raises:
+        FixtureNotFoundError: If any fixtures are missing from the
+          FiveThirtyEight dataset, listing all of them.
+    """
+    fpl_fixtures = fplapi.get(FPL_FIXTURES_URL)
     rows = []
+    missing = []
     understat_fixtures = asyncio.run(get_understat_fixtures())
+    id_to_name = get_team_map("fpl_id", "fpl_name")
     for fixture in fpl_fixtures:
         home_team = id_to_name[fixture["team_h"]]
         away_team = id_to_name[fixture["team_a"]]
         date = parse_date(fixture["kickoff_time"])
-        stats = get_match_stats(home_team, away_team)
+        try:
+            stats = get_match_stats(home_team, away_team)
+        except FixtureNotFoundError as e:
+            missing.extend(e.fixtures)
+            continue
         row = {
             "fpl_id": fixture["id"],
             "understat_id": int(understat_fixtures[home_team][away_team]),
@@ -157,17 +227,33 @@ def get_fixtures() -> Rows:
             "away_proj_score": stats["proj_score2"]
         }
         rows.append(row)
+    if len(missing) > 0:
+        raise FixtureNotFoundError(missing)
     return rows
 
 
-def main():
-    """Retrieves fixture data from FPL API."""
-    db = MySQLManager()
+def write_fixtures() -> None:
+    """Writes the fixtures and team gameweeks of the current season.
+
+    Raises:
+        FixtureNotFoundError: If any fixtures are missing from the
+          FiveThirtyEight dataset.
+    """
+    db = get_writer()
     fixture_rows = get_fixtures()
     db.insert_rows("fixtures", fixture_rows)
     team_gws = get_team_gws(fixture_rows)
     db.insert_rows("team_gws", team_gws)
 
 
+def main():
+    """Retrieves fixture data from FPL API."""
+    try:
+        write_fixtures()
+    except FixtureNotFoundError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+
 if __name__ == "__main__":
     main()
@@ -1,10 +1,100 @@
-from constants import FPL_BASE_URL
+"""A client for the FPL API.
+
+The bootstrap-static endpoint, which holds the gameweeks (events), teams and
+players (elements) of the current season, is only downloaded once per
+process, and is cached on disk for BOOTSTRAP_TTL seconds so that other
+processes can reuse it.
+"""
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, TypedDict
 import requests
+from constants import (
+    BOOTSTRAP_FILE,
+    BOOTSTRAP_TTL,
+    CACHE_DIR,
+    FPL_BASE_URL,
+    HTTP_TIMEOUT
+)
+from httpcache import fetch_cached
+import metrics
+
+
+class Event(TypedDict):
+    """A gameweek, as listed in bootstrap-static."""
+    id: int
+    name: str
+    deadline_time: str
+    finished: bool
+    data_checked: bool
+    is_current: bool
+    is_next: bool
+
+
+class Team(TypedDict):
+    """A team, as listed in bootstrap-static."""
+    id: int
+    name: str
+    short_name: str
+
+
+class Element(TypedDict):
+    """A player, as listed in bootstrap-static."""
+    id: int
+    first_name: str
+    second_name: str
+    web_name: str
+    team: int
+    element_type: int
+
+
+_bootstrap: Optional[Dict[str, Any]] = None
+_bootstrap_loaded_at = 0.0
+_bootstrap_lock = threading.Lock()
 
 
 def get(url):
-    return requests.get(url).json()
+    """Returns the json response of a GET request to url."""
+    metrics.record_http_call()
+    return requests.get(url, timeout=HTTP_TIMEOUT).json()
+
+
+def get_bootstrap(refresh: bool = False) -> Dict[str, Any]:
+    """Returns the bootstrap-static json.
+
+    Args:
+        refresh: Whether to revalidate the cached response even if it is
+          younger than BOOTSTRAP_TTL.
+    """
+    global _bootstrap, _bootstrap_loaded_at  # pylint: disable=global-statement
+    with _bootstrap_lock:
+        age = time.monotonic() - _bootstrap_loaded_at
+        if _bootstrap is None or refresh or age >= BOOTSTRAP_TTL:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            ttl = 0 if refresh else BOOTSTRAP_TTL
+            _bootstrap = json.loads(
+                fetch_cached(FPL_BASE_URL, BOOTSTRAP_FILE, ttl))
+            _bootstrap_loaded_at = time.monotonic()
+        return _bootstrap
+
+
+def get_events() -> List[Event]:
+    """Returns every gameweek of the current season."""
+    return get_bootstrap()["events"]
+
+
+def get_teams() -> List[Team]:
+    """Returns every team in the current season."""
+    return get_bootstrap()["teams"]
+
+
+def get_elements() -> List[Element]:
+    """Returns every player in the current season."""
+    return get_bootstrap()["elements"]
 
 
-def get_players():
-    return get(FPL_BASE_URL)["elements"]
+def get_players() -> List[Element]:
+    """Returns every player in the current season."""
+    return get_elements()
@@ -0,0 +1,80 @@
+"""A module for caching HTTP responses on disk."""
+import json
+import os
+import threading
+import time
+from typing import Optional
+import requests
+from constants import HTTP_TIMEOUT
+import metrics
+
+
+def read_metadata(cache_file: str) -> Optional[dict]:
+    """Returns the metadata stored alongside cache_file, or None if either
+    the cached response or its metadata are missing."""
+    meta_file = cache_file + ".meta.json"
+    if not (os.path.exists(cache_file) and os.path.exists(meta_file)):
+        return None
+    with open(meta_file, encoding="utf-8") as json_file:
+        return json.load(json_file)
+
+
+def write_atomic(path: str, content: bytes) -> None:
+    """Writes content to path, so that readers never see a partial file.
+    Concurrent writers, whether threads or processes, each write their own
+    temporary file, and the last one to finish wins."""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb") as tmp_file:
+        tmp_file.write(content)
+    os.replace(tmp_path, path)
+
+
+def fetch_cached(url: str, cache_file: str, ttl: float,
+                 timeout: float = HTTP_TIMEOUT) -> bytes:
+    """Returns the body of a GET request, cached on disk.
+
+    A cached response younger than ttl seconds is returned without any
+    request. An older one is revalidated with the ETag and Last-Modified
+    headers of the response it came from, and is reused if the server
+    replies 304 Not Modified.
+
+    Args:
+        url: The url to fetch.
+        cache_file: The path to cache the response body in. Its metadata is
+          stored in cache_file + ".meta.json".
+        ttl: The number of seconds a cached response is fresh for.
+        timeout: The number of seconds to wait for the server.
+
+    Returns:
+        The response body.
+    """
+    metadata = read_metadata(cache_file)
+    if metadata is not None and metadata["url"] == url:
+        if time.time() - metadata["fetched_at"] < ttl:
+            with open(cache_file, "rb") as body_file:
+                return body_file.read()
+        headers = {}
+        if metadata.get("etag"):
+            headers["If-None-Match"] = metadata["etag"]
+        if metadata.get("last_modified"):
+            headers["If-Modified-Since"] = metadata["last_modified"]
+    else:
+        metadata = None
+        headers = {}
+    metrics.record_http_call()
+    response = requests.get(url, headers=headers, timeout=timeout)
+    response.raise_for_status()
+    if response.status_code == 304 and metadata is not None:
+        with open(cache_file, "rb") as body_file:
+            body = body_file.read()
+    else:
+        body = response.content
+        write_atomic(cache_file, body)
+        metadata = {
+            "url": url,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified")
+        }
+    metadata["fetched_at"] = time.time()
+    write_atomic(cache_file + ".meta.json", json.dumps(metadata).encode())
+    return body
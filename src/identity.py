@@ -0,0 +1,257 @@
+"""A module for resolving a player's identity across FPL, Understat and fbref.
+
+Names are matched fuzzily through an index of character trigrams and name
+tokens, so that spelling variants, accents and missing middle names still
+resolve. Matches are constrained by team and position, and each source id is
+assigned to at most one FPL player, highest scoring match first.
+"""
+import re
+from typing import Any, Dict, FrozenSet, Iterable, List, NamedTuple, Optional
+import unidecode
+from constants import IDENTITY_GLOBAL_MIN_SCORE, IDENTITY_MIN_SCORE
+from fbrefindex import FbrefIndex
+
+# The order of the lines of a team, from back to front. Outfield positions
+# one line apart are compatible, since sources often disagree on them.
+POSITION_LINES = {"G": 0, "D": 1, "M": 2, "F": 3}
+# The number of rarest trigrams of a name used to find candidates.
+NUM_SEED_TRIGRAMS = 6
+
+
+class Candidate(NamedTuple):
+    """A player listed by a source, identified by the source's id.
+
+    Empty teams or positions mean they are unknown, and do not constrain
+    matches.
+    """
+    id: Any
+    name: str
+    teams: FrozenSet[str] = frozenset()
+    positions: FrozenSet[str] = frozenset()
+
+
+class Match(NamedTuple):
+    """A candidate matched to a query, and the score of the match."""
+    id: Any
+    name: str
+    score: float
+
+
+def normalize(name: str) -> str:
+    """Lowercases a name and strips accents and punctuation."""
+    name = unidecode.unidecode(name.replace("&#039;", "'")).lower()
+    return " ".join(re.sub(r"[^a-z0-9 ]", " ", name.replace("'", "")).split())
+
+
+def get_trigrams(name: str) -> FrozenSet[str]:
+    """Returns the trigrams of a normalized name, padded so that its first
+    letters count the most."""
+    padded = f"  {name} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def compatible_positions(a: FrozenSet[str], b: FrozenSet[str]) -> bool:
+    """Returns whether any pair of positions are at most one line apart,
+    where goalkeepers are only compatible with goalkeepers."""
+    if len(a) == 0 or len(b) == 0:
+        return True
+    for x in a:
+        for y in b:
+            if x == y or ("G" not in (x, y)
+                          and abs(POSITION_LINES[x] - POSITION_LINES[y]) <= 1):
+                return True
+    return False
+
+
+class NameIndex:
+    """A fuzzy index over the names of a source's players.
+
+    The similarity of two names is the greater of the Dice coefficients of
+    their character trigrams and of their tokens, so it is 1 for identical
+    names.
+    """
+
+    def __init__(
+        self,
+        candidates: Iterable[Candidate],
+        min_score: float = IDENTITY_MIN_SCORE,
+        min_tokens: int = 1
+    ):
+        """
+        Args:
+            candidates: The source's players.
+            min_score: The minimum score of a match.
+            min_tokens: The minimum number of tokens in a name searched for.
+              Single names like "Jesus" only identify a player within a team,
+              so they should not be searched for in large, unconstrained
+              indexes.
+        """
+        self.candidates = list(candidates)
+        self.min_score = min_score
+        self.min_tokens = min_tokens
+        self.names = [normalize(c.name) for c in self.candidates]
+        self.trigrams = [get_trigrams(name) for name in self.names]
+        self.tokens = [frozenset(name.split()) for name in self.names]
+        self.trigram_index: Dict[str, List[int]] = {}
+        self.token_index: Dict[str, List[int]] = {}
+        for i, (trigrams, tokens) in enumerate(zip(self.trigrams, self.tokens)):
+            for trigram in trigrams:
+                self.trigram_index.setdefault(trigram, []).append(i)
+            for token in tokens:
+                self.token_index.setdefault(token, []).append(i)
+
+    def get_candidates(self, trigrams: FrozenSet[str],
+                       tokens: FrozenSet[str]) -> set:
+        """Returns the candidates sharing a token or one of the rarest
+        trigrams with a name. A name similar to a candidate shares most of its
+        trigrams, so it almost always shares one of the rarest few."""
+        seeds = sorted(trigrams, key=lambda t: len(self.trigram_index.get(t, ())))
+        found = set()
+        for trigram in seeds[:NUM_SEED_TRIGRAMS]:
+            found.update(self.trigram_index.get(trigram, ()))
+        for token in tokens:
+            found.update(self.token_index.get(token, ()))
+        return found
+
+    def search(
+        self,
+        names: Iterable[str],
+        teams: FrozenSet[str] = frozenset(),
+        positions: FrozenSet[str] = frozenset(),
+        limit: int = 5
+    ) -> List[Match]:
+        """Ranks the candidates matching any of a player's names.
+
+        Args:
+            names: The names the player is known by.
+            teams: The player's teams. Candidates on none of them are
+              excluded, unless either side's teams are unknown.
+            positions: The player's positions. Candidates in incompatible
+              positions are excluded.
+            limit: The maximum number of matches to return.
+
+        Returns:
+            The best matches, highest score first. Ties are broken by the
+            total score over all of the player's names.
+        """
+        scores: Dict[int, float] = {}
+        totals: Dict[int, float] = {}
+        for name in set(map(normalize, names)):
+            trigrams = get_trigrams(name)
+            tokens = frozenset(name.split())
+            if len(tokens) < self.min_tokens:
+                continue
+            for i in self.get_candidates(trigrams, tokens):
+                candidate = self.candidates[i]
+                if len(teams) > 0 and len(candidate.teams) > 0 \
+                        and teams.isdisjoint(candidate.teams):
+                    continue
+                if not compatible_positions(positions, candidate.positions):
+                    continue
+                trigram_score = 2 * len(trigrams & self.trigrams[i]) / (
+                    len(trigrams) + len(self.trigrams[i]))
+                token_score = 2 * len(tokens & self.tokens[i]) / (
+                    len(tokens) + len(self.tokens[i]))
+                score = max(trigram_score, token_score)
+                scores[i] = max(scores.get(i, 0), score)
+                totals[i] = totals.get(i, 0) + score
+        ranked = sorted(scores, key=lambda i: (-scores[i], -totals[i]))[:limit]
+        return [Match(self.candidates[i].id, self.candidates[i].name, scores[i])
+                for i in ranked]
+
+
+def resolve(
+    players: List[dict],
+    indexes: List[NameIndex],
+    overrides: Optional[Dict[int, Any]] = None
+) -> Dict[int, Match]:
+    """Resolves players against a source, assigning each source id to at
+    most one player.
+
+    Args:
+        players: Dictionaries with the fpl_id, names, teams and positions of
+          the players to resolve.
+        indexes: Indexes of the source's players, in order of preference. A
+          player is only looked up in an index if they were not matched in
+          the previous ones.
+        overrides: A map from FPL id to source id, for players whose id is
+          known. They are matched with a score of 1.
+
+    Returns:
+        A map from FPL id to the player's match, for the resolved players.
+    """
+    overrides = overrides or {}
+    resolved = {fpl_id: Match(source_id, None, 1.0)
+                for fpl_id, source_id in overrides.items()}
+    taken = set(overrides.values())
+    remaining = [player for player in players if player["fpl_id"] not in resolved]
+    for index in indexes:
+        pairs = []
+        for player in remaining:
+            for match in index.search(player["names"], player["teams"],
+                                      player["positions"]):
+                if match.score >= index.min_score:
+                    pairs.append((match.score, player["fpl_id"], match))
+        pairs.sort(key=lambda pair: (-pair[0], pair[1]))
+        for _, fpl_id, match in pairs:
+            if fpl_id in resolved or match.id in taken:
+                continue
+            resolved[fpl_id] = match
+            taken.add(match.id)
+        remaining = [player for player in remaining
+                     if player["fpl_id"] not in resolved]
+    return resolved
+
+
+def get_understat_index(ustat_players: List[dict],
+                        team_names: Dict[str, str]) -> NameIndex:
+    """Indexes Understat's league players.
+
+    Args:
+        ustat_players: The players, as returned by Understat.
+        team_names: A map from Understat team name to FPL team name.
+    """
+    candidates = []
+    for player in ustat_players:
+        teams = frozenset(team_names.get(team, team)
+                          for team in player["team_title"].split(","))
+        positions = frozenset("G" if position == "GK" else position
+                              for position in player["position"].split()
+                              if position in ("GK", "D", "M", "F"))
+        candidates.append(Candidate(
+            int(player["id"]), player["player_name"], teams, positions))
+    return NameIndex(candidates)
+
+
+def get_fbref_indexes(index: FbrefIndex,
+                      team_names: Dict[int, str]) -> List[NameIndex]:
+    """Indexes the players on cached fbref pages.
+
+    Args:
+        index: The index of cached fbref pages.
+        team_names: A map from FPL team id to FPL team name.
+
+    Returns:
+        An index of the players on squad pages, constrained by team, followed
+        by a stricter index of every active player on prefix pages.
+    """
+    squad_candidates = []
+    prefix_candidates = []
+    for page, data in index.pages.items():
+        is_squad = page.startswith("squad-")
+        teams = frozenset()
+        if is_squad:
+            teams = frozenset([team_names.get(int(page.split("-")[1]))])
+        for name, fbref_id, positions in data["entries"]:
+            positions = frozenset(
+                "G" if position == "GK" else position[0]
+                for position in positions.split(",") if position)
+            candidate = Candidate(fbref_id, name, teams, positions)
+            if is_squad:
+                squad_candidates.append(candidate)
+            else:
+                prefix_candidates.append(candidate)
+    return [
+        NameIndex(squad_candidates),
+        NameIndex(prefix_candidates, IDENTITY_GLOBAL_MIN_SCORE, min_tokens=2)
+    ]
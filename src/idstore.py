@@ -0,0 +1,91 @@
+"""A module for storing the map from FPL player ids to fbref ids."""
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, Iterable, Optional, Tuple
+
+SCHEMA_VERSION = 1
+
+
+class IdStore:
+    """An SQLite-backed map from FPL player id to fbref id.
+
+    Lookups are served by the primary key index, and new ids are appended
+    with INSERT OR IGNORE, so the first id found for a player is kept. The
+    database is opened in WAL mode, so that concurrent seeders, whether
+    threads or processes, can read while another one writes.
+
+    A player that fbref does not list is stored with a None fbref id, so that
+    they are not searched for again.
+    """
+
+    def __init__(self, path: str, legacy_files: Iterable[str] = ()):
+        """
+        Args:
+            path: The path of the SQLite database, created if missing.
+            legacy_files: JSON files holding a map from FPL id to fbref id,
+              imported the first time the database is created.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                """CREATE TABLE IF NOT EXISTS fpl_fbref_ids (
+                    fpl_id INTEGER PRIMARY KEY,
+                    fbref_id TEXT
+                )""")
+        self.import_legacy(legacy_files)
+
+    def import_legacy(self, legacy_files: Iterable[str]) -> None:
+        """Imports the legacy JSON files, unless the store has been
+        initialized before."""
+        with self.lock, self.conn:
+            # Takes the write lock up front, so that only one process imports.
+            self.conn.execute("BEGIN IMMEDIATE")
+            version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+            if version >= SCHEMA_VERSION:
+                return
+            for legacy_file in legacy_files:
+                if not os.path.exists(legacy_file):
+                    continue
+                with open(legacy_file, encoding="utf-8") as json_file:
+                    ids = json.load(json_file)
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO fpl_fbref_ids VALUES (?, ?)",
+                    [(int(fpl_id), fbref_id) for fpl_id, fbref_id in ids.items()])
+                print(f"Imported {len(ids)} fbref ids from {legacy_file}")
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def get(self, fpl_id: int) -> Tuple[Optional[str], bool]:
+        """Returns the player's fbref id, and whether the player is stored at
+        all."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT fbref_id FROM fpl_fbref_ids WHERE fpl_id = ?",
+                (int(fpl_id),)
+            ).fetchone()
+        if row is None:
+            return None, False
+        return row[0], True
+
+    def put(self, fpl_id: int, fbref_id: Optional[str]) -> None:
+        """Stores the player's fbref id, unless one is stored already."""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO fpl_fbref_ids VALUES (?, ?)",
+                (int(fpl_id), fbref_id))
+
+    def items(self) -> Dict[int, Optional[str]]:
+        """Returns every stored fbref id by FPL id."""
+        with self.lock:
+            return dict(self.conn.execute("SELECT * FROM fpl_fbref_ids"))
+
+    def close(self) -> None:
+        """Closes the connection to the database."""
+        with self.lock:
+            self.conn.close()
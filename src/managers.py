@@ -1,5 +1,5 @@
 """Loads a FPL manager's complete team history."""
-from typing import List
+from typing import List, Optional
 import requests
 from constants import (
     FPL_MANAGER_HISTORY_URL,
@@ -7,8 +7,8 @@ from constants import (
     FPL_TRANSFERS_URL,
     TEAM_HISTORY_FILE
 )
-from db import MySQLManager
-from players import create_player_map
+from cdc import get_writer
+from players import get_registry
 from utils import to_json
 
 
@@ -20,6 +20,12 @@ def find_player_index(players: List[dict], player_id: int) -> int:
     return -1
 
 
+def get_player_name(player_id: int) -> Optional[str]:
+    """Returns a player's FPL name, or None if they are not in the registry."""
+    player = get_registry().get(player_id)
+    return None if player is None else player["fpl_name"]
+
+
 def get_freehit_weeks(manager_id: int) -> List[int]:
     """Returns a list of gameweeks that this manager played the Free Hit chip. """
     fh_weeks = []
@@ -31,9 +37,6 @@ def get_freehit_weeks(manager_id: int) -> List[int]:
     return fh_weeks
 
 
-player_idx = create_player_map("fpl_id", None)
-
-
 def get_gw1_team(manager_id: int) -> List[List[dict]]:
     """Gets manager's team in gameweek 1.
 
@@ -51,7 +54,7 @@ def get_gw1_team(manager_id: int) -> List[List[dict]]:
         player_id = player["element"]
         team[0].append({
             "id": player_id,
-            "name": player_idx[player_id]["fpl_name"]
+            "name": get_player_name(player_id)
         })
     return team
 
@@ -88,7 +91,7 @@ def get_team_history(manager_id: int) -> List[List[dict]]:
         player_to_swap = find_player_index(team[gameweek - 1], out_player_id)
         team[gameweek - 1][player_to_swap] = {
             "id": in_player_id,
-            "name": player_idx[in_player_id]["fpl_name"]
+            "name": get_player_name(in_player_id)
         }
     # Copy team over until last gameweek
     while gameweek <= 38:
@@ -100,7 +103,7 @@ def get_team_history(manager_id: int) -> List[List[dict]]:
 def main(manager_id: int, manager_name: str):
     """Adds a manager's complete team history to the database."""
     team_history = get_team_history(manager_id)
-    db = MySQLManager()
+    db = get_writer()
     db.insert_rows(
         "managers", [{"id": manager_id, "manager_name": manager_name}])
     rows = []
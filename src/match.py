@@ -1,59 +1,213 @@
-class Data:
-    # map from fpl player id to:
-    # completed: [...]
-    # upcoming: [...]
-    # match_data = {}
-    # metadata = {}
+"""A module for maintaining each player's match history.
+
+Each player's state holds their completed matches, their upcoming fixtures
+and the EMAs of their stats after their last completed match. The state is
+updated incrementally: only gameweeks after the last_gw_updated watermark
+are fetched, and only once FPL has finalized them, so that completed matches
+never change once appended. EMAs continue from their stored values, and are
+only recomputed from the full history when the alphas in constants.py
+differ from the ema_params they were computed with.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import fplapi
+from constants import (
+    BONUS_ALPHA,
+    FPL_FIXTURES_URL,
+    FPL_GAMEWEEK_URL,
+    GW_FETCH_CONCURRENCY,
+    MINUTES_ALPHA,
+    NPXG_ALPHA,
+    XA_ALPHA
+)
+from utils import update_ema
+
+ema_alphas = {
+    "npxG": NPXG_ALPHA,
+    "xA": XA_ALPHA,
+    "bonus": BONUS_ALPHA,
+    "minutes": MINUTES_ALPHA
+}
+
+point_stats = [
+    "minutes", "goals_scored", "assists", "clean_sheets", "goals_conceded",
+    "bonus", "saves"
+]
+
+
+def new_metadata():
+    return {"last_gw_updated": 0, "ema_params": dict(ema_alphas)}
+
+
+def get_finalized_gws():
+    """Returns the gameweeks that are finished and whose data has been
+    checked by FPL, so will not change again."""
+    return {event["id"] for event in fplapi.get_events()
+            if event["finished"] and event["data_checked"]}
+
+
+def get_matches(element, gw):
+    """Returns a player's completed matches in a gameweek.
+
+    Args:
+        element: The player's entry in the gameweek's live data from FPL.
+        gw: The gameweek.
+
+    Returns:
+        A compact record of each of the player's fixtures in the gameweek.
+        FPL only reports expected goals and assists per gameweek, which are
+        used as npxG and xA when the player played a single fixture, and are
+        otherwise missing.
+    """
+    fixtures = element["explain"]
+    matches = []
+    for fixture in fixtures:
+        stats = {stat["identifier"]: stat["value"] for stat in fixture["stats"]}
+        match = {"gw": gw, "fixture_id": fixture["fixture"]}
+        match.update({stat: stats.get(stat, 0) for stat in point_stats})
+        match["total_points"] = sum(stat["points"] for stat in fixture["stats"])
+        played = match["minutes"] > 0 and len(fixtures) == 1
+        for stat, fpl_stat in (("npxG", "expected_goals"), ("xA", "expected_assists")):
+            value = element["stats"].get(fpl_stat) if played else None
+            match[stat] = None if value is None else float(value)
+        matches.append(match)
+    return matches
+
 
-    # alpha value for EMA
-    # alphas = {}
+def compute_emas(matches, seed_stats=None, emas=None):
+    """Returns the EMAs of each stat in ema_alphas after the given matches.
 
-    # fields = []
+    Args:
+        matches: The matches, in order.
+        seed_stats: Stats to start the averages from, such as the player's
+          per 90 stats from the previous season.
+        emas: EMAs to continue from, which take precedence over seed_stats.
+    """
+    seed_stats = seed_stats or {}
+    if emas is None:
+        emas = {stat: seed_stats.get(stat) for stat in ema_alphas}
+    emas = dict(emas)
+    for match in matches:
+        for stat, alpha in ema_alphas.items():
+            emas[stat] = update_ema(emas.get(stat), match.get(stat), alpha)
+    return emas
+
+
+def get_upcoming_fixtures():
+    """Returns a map from FPL team id to the team's unfinished fixtures."""
+    upcoming = {}
+    for fixture in fplapi.get(FPL_FIXTURES_URL):
+        if fixture["finished"] or fixture["event"] is None:
+            continue
+        for team, opponent, home in ((fixture["team_h"], fixture["team_a"], True),
+                                     (fixture["team_a"], fixture["team_h"], False)):
+            upcoming.setdefault(team, []).append({
+                "gw": fixture["event"],
+                "fixture_id": fixture["id"],
+                "opponent_id": opponent,
+                "home": home
+            })
+    return upcoming
+
+
+class Data:
 
     def __init__(self, state):
-        # state data is fetched from database
-        pass
-
-    def fetch_new(self):
-        # fetches match data up to a given gameweek.
-
-        # check if EMA from table metadata differs from EMA in constants.py, and if so,
-        # recompute before adding any additional entries
-
-        # also record last gw update in table metadata
-
-        # metadata: {
-        #   last_gw_updated: 23
-        #   ema_params: {...}
-        # }
-        # players: {
-        #   1: {
-        #     name: ...
-        #     ...
-        #     completed: {}
-        #     upcoming: {gw: 1, ..., }
-
-        #   }
-        # }
-
-        # call fixtures.py to get new upcoming fixtures for each team in a map
-        # from team id to [{fixture_id, }, ...]
-
-        # how to find last gameweek updated? - store in metadata
-
-        # call fpl API for each gameweek from last_updated + 1 to gameweek
-        # for gw in range(metadata.last_updated + 1, gameweek + 1):
-        # data = fplapi(...)
-        # if elements is empty, return error?
-        # for player in data["elements"]:
-          # - populate stats from FPL
-          # - call fbref.get_match_stats(fpl_player_id, fpl_fixture_id)
-          # if this fails, probably return error
-          # - merge dictionaries
-          # - compute EMA
-          # match_data[player["id"]]["completed"].append(data)
-          # match_data[player["id"]]["upcoming"] = get_upcoming(player["team_id"])
-        # 
-
-        # return map
-        pass
+        """
+        Args:
+            state: The stored state, a dictionary with the following keys:
+                metadata: The last_gw_updated watermark and the ema_params the
+                  stored EMAs were computed with, or None if nothing is stored.
+                players: A map from FPL id to the player's stored state, with
+                  keys fpl_id, completed, upcoming and emas.
+                seed_stats: A map from FPL id to the player's seed stats.
+        """
+        self.metadata = state.get("metadata") or new_metadata()
+        self.players = state.get("players", {})
+        self.seed_stats = state.get("seed_stats", {})
+        # FPL id -> the changes to the player's state
+        self.updates = {}
+
+    def get_player(self, fpl_id):
+        """Returns a player's state, which starts from their seed stats if
+        nothing is stored for them."""
+        if fpl_id not in self.players:
+            self.players[fpl_id] = {
+                "fpl_id": fpl_id,
+                "completed": [],
+                "upcoming": [],
+                "emas": compute_emas([], self.seed_stats.get(fpl_id))
+            }
+            update = self.get_update(fpl_id)
+            update["emas"] = self.players[fpl_id]["emas"]
+            update["upcoming"] = []
+        return self.players[fpl_id]
+
+    def get_update(self, fpl_id):
+        """Returns the pending changes to a player's state, which are new
+        completed matches, and the emas and upcoming fixtures if they
+        changed."""
+        if fpl_id not in self.updates:
+            self.updates[fpl_id] = {"fpl_id": fpl_id, "completed": []}
+        return self.updates[fpl_id]
+
+    def recompute_emas(self):
+        """Recomputes every player's EMAs from their full history, with the
+        current alphas."""
+        for fpl_id, player in self.players.items():
+            emas = compute_emas(player["completed"], self.seed_stats.get(fpl_id))
+            if emas != player["emas"]:
+                player["emas"] = emas
+                self.get_update(fpl_id)["emas"] = emas
+        self.metadata["ema_params"] = dict(ema_alphas)
+
+    def append_gameweek(self, gw, elements):
+        """Appends the completed matches of a gameweek to every player's
+        history, skipping matches that are already stored."""
+        for element in elements:
+            player = self.get_player(element["id"])
+            stored = {match["fixture_id"] for match in player["completed"]}
+            matches = [match for match in get_matches(element, gw)
+                       if match["fixture_id"] not in stored]
+            if len(matches) == 0:
+                continue
+            update = self.get_update(element["id"])
+            player["completed"].extend(matches)
+            update["completed"].extend(matches)
+            player["emas"] = compute_emas(matches, emas=player["emas"])
+            update["emas"] = player["emas"]
+
+    def update_upcoming(self):
+        """Sets every current player's upcoming fixtures to their team's."""
+        upcoming = get_upcoming_fixtures()
+        for element in fplapi.get_elements():
+            fixtures = upcoming.get(element["team"], [])
+            player = self.get_player(element["id"])
+            if player["upcoming"] != fixtures:
+                player["upcoming"] = fixtures
+                self.get_update(element["id"])["upcoming"] = fixtures
+
+    def fetch_new(self, gameweek=None):
+        """Fetches the gameweeks after the last one updated, up to the last
+        finalized gameweek or the given gameweek, whichever is first.
+
+        Returns:
+            A tuple of the changes to each player whose state changed, and the
+            metadata to store once they are written.
+        """
+        if self.metadata["ema_params"] != ema_alphas:
+            self.recompute_emas()
+        finalized = get_finalized_gws()
+        gws = []
+        gw = self.metadata["last_gw_updated"] + 1
+        while gw in finalized and (gameweek is None or gw <= gameweek):
+            gws.append(gw)
+            gw += 1
+        urls = [FPL_GAMEWEEK_URL.format(gw) for gw in gws]
+        with ThreadPoolExecutor(GW_FETCH_CONCURRENCY) as executor:
+            for gw, data in zip(gws, executor.map(fplapi.get, urls)):
+                if len(data["elements"]) == 0:
+                    raise ValueError(f"Gameweek {gw} has no live data")
+                self.append_gameweek(gw, data["elements"])
+                self.metadata["last_gw_updated"] = gw
+        self.update_upcoming()
+        return list(self.updates.values()), self.metadata
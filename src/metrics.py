@@ -0,0 +1,51 @@
+"""A module for counting the work done by a pipeline stage.
+
+Counters are held in a context variable, so that stages running concurrently
+each count their own rows and HTTP calls, including from the coroutines they
+start. Outside of a stage, recording is a no-op.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+import threading
+from typing import Iterator, Optional
+
+
+class StageMetrics:
+    """The rows written and HTTP calls made by a stage."""
+
+    def __init__(self):
+        self.rows_written = 0
+        self.http_calls = 0
+        self.lock = threading.Lock()
+
+    def add(self, rows_written: int = 0, http_calls: int = 0) -> None:
+        with self.lock:
+            self.rows_written += rows_written
+            self.http_calls += http_calls
+
+
+_current: ContextVar[Optional[StageMetrics]] = ContextVar(
+    "stage_metrics", default=None)
+
+
+@contextmanager
+def collect() -> Iterator[StageMetrics]:
+    """Counts the rows written and HTTP calls made within the block."""
+    stage_metrics = StageMetrics()
+    token = _current.set(stage_metrics)
+    try:
+        yield stage_metrics
+    finally:
+        _current.reset(token)
+
+
+def record_rows(num_rows: int) -> None:
+    stage_metrics = _current.get()
+    if stage_metrics is not None:
+        stage_metrics.add(rows_written=num_rows)
+
+
+def record_http_call() -> None:
+    stage_metrics = _current.get()
+    if stage_metrics is not None:
+        stage_metrics.add(http_calls=1)
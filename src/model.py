@@ -1,5 +1,6 @@
 """A statistics-based model for predicting FPL points."""
-from typing import Callable
+from functools import lru_cache
+from typing import Callable, Dict, Optional
 import numpy as np
 import pandas as pd
 from scipy.stats import poisson
@@ -12,12 +13,12 @@ from constants import (
     BONUS_ALPHA,
     MINUTES_ALPHA
 )
-from db import MySQLManager
+from cdc import get_writer
 from preprocess import preprocess
 from utils import from_json, to_json, get_current_gw
 from datetime import datetime
 
-params_json = from_json(MODEL_PARAMS_FILE)
+
 predicted_cols = [
     "goal_xP", "assist_xP", "cs_xP", "bonus_xP", "concede_xP", "xP"
 ]
@@ -31,6 +32,13 @@ stat_cols = [
 ]
 
 
+@lru_cache(maxsize=None)
+def get_model_params() -> dict:
+    """Returns the model parameters, read from MODEL_PARAMS_FILE on first
+    call."""
+    return from_json(MODEL_PARAMS_FILE)
+
+
 def expected(pmf: Callable[[int], float], value: int, max_value: int) -> float:
     """Expected value for a discrete random variable.
 
@@ -64,7 +72,7 @@ def predict(row: pd.Series) -> np.ndarray:
           played.
     """
     xp = []
-    stat_values = params_json[row["position"]]["stat_values"]
+    stat_values = get_model_params()[row["position"]]["stat_values"]
     attack_multiplier = row["proj_score"] / row["avg_team_xG"]
 
     def goal_pmf(x):
@@ -94,17 +102,110 @@ def predict(row: pd.Series) -> np.ndarray:
     return np.round(xp, 3)
 
 
-def calculate_points(row: pd.Series) -> pd.Series:
-    """Returns inner product of the stat columns and their point values."""
-    point_values = params_json[row["position"]]["stat_values"]
-    return row[stat_cols] * point_values
+def get_stat_values(positions: pd.Series) -> np.ndarray:
+    """Returns an array with the stat_values of each position, one per row."""
+    return np.array(
+        [get_model_params()[position]["stat_values"] for position in positions],
+        dtype=float
+    ).reshape(len(positions), len(stat_cols))
 
 
-def evaluate(rows: pd.Series) -> None:
-    """Calculates evaluation metrics for a single gameweek row."""
-    known_point_totals = rows[rows["gameweek"] < get_current_gw()].copy()
-    known_point_totals[point_cols] = known_point_totals.apply(
-        calculate_points, axis=1, result_type="expand")
+def expected_all(rates: np.ndarray, value: np.ndarray, max_value: int,
+                 scale: int = 1) -> np.ndarray:
+    """Vectorized version of expected for Poisson random variables.
+
+    Args:
+        rates: An array of Poisson rates, one per row.
+        value: The point value of the random variable for each row.
+        max_value: The maximum possible value that the random variable can
+          take.
+        scale: The pmf of x is evaluated at scale * x, for example 2 for
+          goals conceded, where every 2 goals is worth one point.
+
+    Returns:
+        An array with the expected value of the random variable for each row.
+        The terms are summed in the same order as expected, so the results
+        are identical.
+    """
+    xp = np.zeros(len(rates))
+    for x in range(1, max_value + 1):
+        xp += x * poisson.pmf(scale * x, rates)
+    return value * xp
+
+
+def get_poisson_rates(rows: pd.DataFrame) -> Dict[str, np.ndarray]:
+    """Returns the Poisson rates used by the model, one per row.
+
+    Returns:
+        A dictionary with arrays of rates for "goals", "assists" and "bonus"
+        scored by the player, and "conceded" by the player's team.
+    """
+    attack_multiplier = (rows["proj_score"] / rows["avg_team_xG"]).to_numpy(float)
+    return {
+        "goals": attack_multiplier * rows["avg_npxG"].to_numpy(float),
+        "assists": attack_multiplier * rows["avg_xA"].to_numpy(float),
+        "bonus": rows["avg_bonus"].to_numpy(float),
+        "conceded": rows["opponent_proj_score"].to_numpy(float)
+    }
+
+
+def get_mins_multiplier(rows: pd.DataFrame) -> np.ndarray:
+    """Returns the multiplier based on how many minutes each player has
+    recently played, as min(1, round(avg_minutes / 60, 1))."""
+    # np.round disagrees with round on some halfway cases, e.g. 0.35
+    mins_multiplier = np.array(
+        [round(minutes / 60, 1) for minutes in rows["avg_minutes"]], dtype=float)
+    # same as min(1, ...), which keeps 1 when the multiplier is nan
+    return np.where(mins_multiplier < 1, mins_multiplier, 1)
+
+
+def predict_all(rows: pd.DataFrame) -> np.ndarray:
+    """Make predictions on many gameweek rows at once.
+
+    Equivalent to applying predict to every row, but computed with array
+    operations over the whole frame.
+
+    Args:
+        rows: A pandas DataFrame containing player data, one row per player
+          and fixture.
+
+    Returns:
+        A numpy array with one row per row of rows, and one column for each of
+        predicted_cols, in the same order as predict.
+    """
+    stat_values = get_stat_values(rows["position"])
+    rates = get_poisson_rates(rows)
+    cs_rates = poisson.pmf(0, rates["conceded"])
+    xp = np.column_stack([
+        expected_all(rates["goals"], stat_values[:, 0], 4),
+        expected_all(rates["assists"], stat_values[:, 1], 4),
+        stat_values[:, 2] * cs_rates,
+        expected_all(rates["bonus"], stat_values[:, 3], 3),
+        expected_all(rates["conceded"], stat_values[:, 4], 4, scale=2),
+    ])
+    # Add 2 for base minute points
+    total_xp = get_mins_multiplier(rows) * (np.sum(xp, axis=1) + 2)
+    return np.round(np.column_stack([xp, total_xp]), 3)
+
+
+def get_mse(rows: pd.DataFrame, current_gw: int, decimals: int = 1) -> np.ndarray:
+    """Calculates the mean squared error of each predicted column.
+
+    Args:
+        rows: Gameweek rows with the stat columns and predicted columns.
+        current_gw: The current gameweek. Only rows from earlier gameweeks
+          are evaluated.
+        decimals: The number of decimal places to round to.
+
+    Returns:
+        A numpy array with the MSE of each of predicted_cols against the
+        corresponding actual points.
+    """
+    known_point_totals = rows[rows["gameweek"] < current_gw].copy()
+    known_point_totals[point_cols] = (
+        known_point_totals[stat_cols].to_numpy(float)
+        * get_stat_values(known_point_totals["position"])
+    )
     all_point_cols = point_cols + ["total_points"]
     known_point_totals["concede_points"] = - \
         known_point_totals["goals_conceded"] // 2
@@ -113,17 +214,26 @@ def evaluate(rows: pd.Series) -> None:
     predicted_points = known_point_totals[predicted_cols].to_numpy()
     diff_sq = np.power(actual_points - predicted_points, 2)
     n = len(known_point_totals)
-    mse = np.round(np.sum(diff_sq, axis=0) / n, 1)
+    return np.round(np.sum(diff_sq, axis=0) / n, decimals)
+
+
+def evaluate(rows: pd.Series, current_gw: Optional[int] = None) -> None:
+    """Calculates evaluation metrics for a single gameweek row."""
+    if current_gw is None:
+        current_gw = get_current_gw()
+    mse = get_mse(rows, current_gw)
     print("MSE: ", mse)
     return mse.tolist()
 
-if __name__ == "__main__":
+def main():
+    """Predicts the points of every player in every gameweek, and writes the
+    predictions to the database."""
     preprocess()
     df = pd.read_csv(GW_HISTORY_FILE)
     position = "M"
     rows_to_predict = (df["avg_minutes"] > 0)
     gws = df[rows_to_predict].copy()
-    gws[predicted_cols] = gws.apply(predict, axis=1, result_type="expand")
+    gws[predicted_cols] = predict_all(gws)
     gws_zero_mins = df[df["avg_minutes"] == 0].copy()
     gws_zero_mins[predicted_cols] = 0
     mse = evaluate(gws)
@@ -140,13 +250,14 @@ if __name__ == "__main__":
     })
     to_json(RUNS_FILE, runs)
     all_gw_data = pd.concat([gws, gws_zero_mins])
-    db = MySQLManager()
-    for _, entry in all_gw_data.iterrows():
-        db.update_row(
-            "player_gws_predicted",
-            {
-                "player_id": entry["player_id"],
-                "fixture_id": entry["fixture_id"]
-            },
-            {col: entry[col] for col in predicted_cols}
-        )
+    db = get_writer()
+    key_cols = ["player_id", "fixture_id"]
+    db.update_rows(
+        "player_gws_predicted",
+        key_cols,
+        all_gw_data[key_cols + predicted_cols].to_dict("records")
+    )
+
+
+if __name__ == "__main__":
+    main()
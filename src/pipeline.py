@@ -0,0 +1,353 @@
+"""A module for running the data pipeline as a graph of stages.
+
+A stage starts as soon as every stage it depends on has finished, so
+independent stages run concurrently. A stage is skipped if its inputs, and
+those of every stage it depends on, are unchanged since it last succeeded.
+The status, wall time, rows written and HTTP calls of every stage are
+appended to PIPELINE_LOG_FILE, one JSON object per line.
+
+Run this module to update the database, e.g.
+    python pipeline.py
+    python pipeline.py --force --stages understat_fetch understat_write
+"""
+# pylint: disable=import-outside-toplevel
+import argparse
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime
+import hashlib
+import json
+import os
+import time
+import uuid
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple
+from prettytable import PrettyTable
+from constants import (
+    FTE_TTL,
+    ID_CONVERSIONS_FILE,
+    MODEL_PARAMS_FILE,
+    PIPELINE_LOG_FILE,
+    PIPELINE_STATE_FILE,
+    PIPELINE_WORKERS,
+    UNDERSTAT_TTL
+)
+import fplapi
+from httpcache import write_atomic
+import metrics
+
+SUCCEEDED = "succeeded"
+SKIPPED = "skipped"
+FAILED = "failed"
+BLOCKED = "blocked"
+
+
+class Stage(NamedTuple):
+    """A step of the pipeline.
+
+    inputs returns a JSON serializable fingerprint of the data the stage
+    reads, other than the outputs of its dependencies, or None if the data
+    cannot be fingerprinted, in which case the stage always runs.
+    """
+    name: str
+    run: Callable[[], None]
+    deps: Tuple[str, ...] = ()
+    inputs: Callable[[], Any] = lambda: ()
+
+
+class StageResult(NamedTuple):
+    """The outcome of a stage in a run of the pipeline, along with the
+    metrics collected while it ran."""
+    stage: str
+    status: str
+    seconds: float = 0.0
+    rows_written: int = 0
+    http_calls: int = 0
+    error: Optional[str] = None
+
+
+def hash_file(path: str) -> Optional[str]:
+    """Returns the SHA-256 hash of a file, or None if it does not exist."""
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def get_team_inputs() -> Any:
+    """Returns the id and name of every team on FPL."""
+    return [[team["id"], team["name"]] for team in fplapi.get_teams()]
+
+
+def get_player_inputs() -> Any:
+    """Returns the FPL fields that player rows are built from, and a hash of
+    the manual id conversions."""
+    elements = [[element["id"], element["first_name"], element["second_name"],
+                 element["team"], element["element_type"]]
+                for element in fplapi.get_elements()]
+    return [elements, hash_file(ID_CONVERSIONS_FILE)]
+
+
+def get_gameweek_inputs() -> Any:
+    """Returns the status of every gameweek, or None while a gameweek is in
+    progress, since its data changes without its status changing."""
+    events = fplapi.get_events()
+    if any(event["is_current"] and not event["data_checked"] for event in events):
+        return None
+    return [[event["id"], event["deadline_time"], event["finished"],
+             event["data_checked"]] for event in events]
+
+
+def get_expiring_inputs(ttl: float) -> Callable[[], Any]:
+    """Returns the inputs of a stage whose data changes between gameweeks,
+    such as FiveThirtyEight's projected scores, FPL's kickoff times and
+    Understat's late xG. They are the gameweek inputs, along with the
+    current ttl second period, so that the stage reruns at least once every
+    ttl seconds."""
+    def get_inputs() -> Any:
+        gameweeks = get_gameweek_inputs()
+        if gameweeks is None:
+            return None
+        return [gameweeks, int(time.time() // ttl)]
+    return get_inputs
+
+
+def get_model_inputs() -> Any:
+    """Returns a hash of the model's parameters, and the EMA alphas that its
+    averages are computed with."""
+    from preprocess import player_alphas, team_alphas
+    return [hash_file(MODEL_PARAMS_FILE), player_alphas, team_alphas]
+
+
+def run_teams() -> None:
+    """Writes the teams."""
+    import teams
+    teams.main()
+
+
+def run_players() -> None:
+    """Writes the players, matched to their Understat ids."""
+    import players
+    players.fetch_players()
+
+
+def run_fixtures() -> None:
+    """Writes the fixtures, with FiveThirtyEight's projected scores."""
+    import fixtures
+    fixtures.write_fixtures()
+
+
+def run_player_fpl_data() -> None:
+    """Writes the players' gameweek data from FPL."""
+    import player_fpl_data
+    player_fpl_data.main()
+
+
+def run_understat_fetch() -> None:
+    """Fetches the players' match data from Understat."""
+    import player_understat_data
+    player_understat_data.fetch_match_data()
+
+
+def run_understat_write() -> None:
+    """Writes the fetched Understat data to the players' gameweeks."""
+    import player_understat_data
+    player_understat_data.write_match_data()
+
+
+def run_model() -> None:
+    """Predicts every player's points, and writes the predictions."""
+    import model
+    model.main()
+
+
+# Understat is fetched separately from being written, so that the slowest
+# fetch overlaps with the FPL gameweek ingestion. Its rows can only be
+# written once the FPL rows they update exist.
+STAGES = [
+    Stage("teams", run_teams, (), get_team_inputs),
+    Stage("players", run_players, ("teams",), get_player_inputs),
+    Stage("fixtures", run_fixtures, ("teams",), get_expiring_inputs(FTE_TTL)),
+    Stage("player_fpl_data", run_player_fpl_data,
+          ("players", "fixtures"), get_gameweek_inputs),
+    Stage("understat_fetch", run_understat_fetch,
+          ("players", "fixtures"), get_expiring_inputs(UNDERSTAT_TTL)),
+    Stage("understat_write", run_understat_write,
+          ("understat_fetch", "player_fpl_data")),
+    Stage("model", run_model, ("understat_write",), get_model_inputs),
+]
+
+
+def get_keys(stages: List[Stage]) -> Dict[str, Optional[str]]:
+    """Returns a hash of the inputs of each stage and of all of the stages
+    it depends on, or None if any of them cannot be fingerprinted.
+
+    Stages must be listed after the stages they depend on. Dependencies that
+    are not listed are ignored.
+    """
+    keys: Dict[str, Optional[str]] = {}
+    for stage in stages:
+        inputs = stage.inputs()
+        dep_keys = [keys[dep] for dep in stage.deps if dep in keys]
+        if inputs is None or None in dep_keys:
+            keys[stage.name] = None
+            continue
+        fingerprint = json.dumps([stage.name, inputs, dep_keys])
+        keys[stage.name] = hashlib.sha256(fingerprint.encode()).hexdigest()
+    return keys
+
+
+def run_stage(stage: Stage) -> StageResult:
+    """Runs a stage, counting the rows it writes and the HTTP calls it
+    makes."""
+    start = time.perf_counter()
+    with metrics.collect() as stage_metrics:
+        try:
+            stage.run()
+            status, error = SUCCEEDED, None
+        except Exception as e:  # pylint: disable=broad-except
+            status, error = FAILED, f"{type(e).__name__}: {e}"
+    return StageResult(stage.name, status, time.perf_counter() - start,
+                       stage_metrics.rows_written, stage_metrics.http_calls,
+                       error)
+
+
+def load_state(state_file: str) -> Dict[str, str]:
+    """Returns the key of each stage's last successful run."""
+    if not os.path.exists(state_file):
+        return {}
+    with open(state_file, encoding="utf-8") as json_file:
+        return json.load(json_file)
+
+
+def get_dep_statuses(
+    stage: Stage,
+    results: Dict[str, StageResult],
+    keys: Dict[str, Optional[str]]
+) -> Optional[Set[str]]:
+    """Returns the statuses of a stage's dependencies that are being run,
+    or None if any of them has not finished yet."""
+    statuses = {results[dep].status if dep in results else None
+                for dep in stage.deps if dep in keys}
+    return None if None in statuses else statuses
+
+
+def save_result(
+    result: StageResult,
+    keys: Dict[str, Optional[str]],
+    state: Dict[str, str],
+    state_file: str
+) -> None:
+    """Reports a finished stage, and saves its key if it succeeded."""
+    print(f"Stage {result.stage} {result.status} in {result.seconds:.1f}s")
+    if result.status != SUCCEEDED:
+        return
+    if keys[result.stage] is None:
+        state.pop(result.stage, None)
+    else:
+        state[result.stage] = keys[result.stage]
+    os.makedirs(os.path.dirname(state_file), exist_ok=True)
+    write_atomic(state_file, json.dumps(state).encode())
+
+
+def run_pipeline(
+    stages: List[Stage],
+    force: bool = False,
+    workers: int = PIPELINE_WORKERS,
+    state_file: str = PIPELINE_STATE_FILE
+) -> List[StageResult]:
+    """Runs the stages, each one once all of its dependencies have succeeded
+    or been skipped.
+
+    Args:
+        stages: The stages to run, each listed after its dependencies.
+          Dependencies that are not listed are assumed to be up to date.
+        force: Whether to run every stage, even if its inputs are unchanged.
+        workers: The maximum number of stages to run at once.
+        state_file: The file holding the key of each stage's last successful
+          run. A stage's key is saved as soon as it succeeds, so an
+          interrupted run resumes where it left off.
+
+    Returns:
+        The result of every stage, in the order they finished. The
+        dependents of a failed stage are blocked rather than run.
+    """
+    keys = get_keys(stages)
+    state = load_state(state_file)
+    pending = list(stages)
+    results: Dict[str, StageResult] = {}
+    running: Dict[Future, Stage] = {}
+    with ThreadPoolExecutor(workers) as executor:
+        while len(pending) > 0 or len(running) > 0:
+            num_pending = len(pending)
+            for stage in list(pending):
+                statuses = get_dep_statuses(stage, results, keys)
+                if statuses is None:
+                    continue
+                pending.remove(stage)
+                if statuses & {FAILED, BLOCKED}:
+                    results[stage.name] = StageResult(stage.name, BLOCKED)
+                elif (not force and keys[stage.name] is not None
+                      and state.get(stage.name) == keys[stage.name]):
+                    results[stage.name] = StageResult(stage.name, SKIPPED)
+                else:
+                    running[executor.submit(run_stage, stage)] = stage
+            if len(running) == 0:
+                if len(pending) == num_pending:
+                    raise ValueError("Stages depend on each other in a cycle")
+                # Skipped or blocked stages may have readied others.
+                continue
+            for future in wait(running, return_when=FIRST_COMPLETED).done:
+                running.pop(future)
+                result = future.result()
+                results[result.stage] = result
+                save_result(result, keys, state, state_file)
+    return list(results.values())
+
+
+def write_log(results: List[StageResult], log_file: str = PIPELINE_LOG_FILE) -> None:
+    """Appends the results of a run to the run log."""
+    run_id = uuid.uuid4().hex
+    date = datetime.now().strftime("%m/%d/%Y %H:%M:%S")
+    os.makedirs(os.path.dirname(log_file), exist_ok=True)
+    with open(log_file, "a", encoding="utf-8") as f:
+        for result in results:
+            f.write(json.dumps(
+                {"run_id": run_id, "date": date, **result._asdict()}) + "\n")
+
+
+def main():
+    """Runs the pipeline and prints a summary of each stage."""
+    parser = argparse.ArgumentParser(description="Update the database")
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="run every stage, even if its inputs are unchanged."
+    )
+    parser.add_argument(
+        "--stages",
+        nargs="+",
+        choices=[stage.name for stage in STAGES],
+        help="only run these stages, assuming the others are up to date."
+    )
+    args = parser.parse_args()
+    stages = [stage for stage in STAGES
+              if args.stages is None or stage.name in args.stages]
+    start = time.perf_counter()
+    results = run_pipeline(stages, args.force)
+    write_log(results)
+    table = PrettyTable()
+    table.field_names = ["stage", "status", "seconds", "rows", "http calls"]
+    for result in results:
+        table.add_row([result.stage, result.status, f"{result.seconds:.1f}",
+                       result.rows_written, result.http_calls])
+    print(table)
+    for result in results:
+        if result.error is not None:
+            print(f"{result.stage}: {result.error}")
+    elapsed = time.perf_counter() - start
+    print(f"Ran the pipeline in {elapsed:.1f}s")
+    if any(result.status in (FAILED, BLOCKED) for result in results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
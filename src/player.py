@@ -1,15 +1,16 @@
+from concurrent.futures import ThreadPoolExecutor
 import fbref
 import fplapi
 import utils
 import document
-from constants import LAST_SEASON
+from constants import FBREF_CONCURRENCY, LAST_SEASON, MONGO_BATCH_SIZE
 
 class Data:
 
     def __init__(self, current_players):
         self.current_players = current_players
 
-    def init_player(self, player):
+    def init_player(self, player, fbref_id, seed_stats):
         player_doc = document.Document(player)
         player_doc.retain_keys([
             "id",
@@ -24,27 +25,51 @@ class Data:
             "team": "team_id",
             "element_type": "position"
         })
-        fbref_id = fbref.get_id(player)
         player_doc.put("fbref_id", fbref_id)
-        print(player["web_name"])
-        seed_stats = fbref.get_season_stats(fbref_id, LAST_SEASON)
         player_doc.put("seed_stats", seed_stats)
         return player_doc.json()
 
-    def fetch_new(self):
+    def get_unseeded_players(self):
+        """Returns the players that are not stored yet, or whose fbref id or
+        seed stats could not be found before."""
         current_ids = {player["fpl_id"] for player in self.current_players}
         stats = {player["fpl_id"]: player["seed_stats"]
                  for player in self.current_players}
-        new_players = []
-        for player in fplapi.get_players():
-            if player["id"] not in current_ids or stats[player["id"]] is None:
-                new_players.append(self.init_player(player))
-        return new_players
+        return [player for player in fplapi.get_players()
+                if player["id"] not in current_ids
+                or stats[player["id"]] is None]
+
+    def seed_players(self, players, workers=FBREF_CONCURRENCY):
+        """Returns the players along with their fbref ids and seed stats.
+
+        fbref ids are resolved by a pool of workers, and seed stats are
+        fetched by as many concurrent requests. Both share fbref's rate
+        limit, and are saved as they are found, so that an interrupted run
+        resumes where it left off.
+        """
+        with ThreadPoolExecutor(workers) as executor:
+            fbref_ids = list(executor.map(fbref.get_id, players))
+        seed_stats = fbref.get_all_season_stats(fbref_ids, LAST_SEASON, workers)
+        return [(player, fbref_id, seed_stats[fbref_id])
+                for player, fbref_id in zip(players, fbref_ids)]
+
+    def get_new_players(self):
+        """Returns the unseeded players along with their fbref ids and seed
+        stats."""
+        return self.seed_players(self.get_unseeded_players())
+
+    def fetch_batches(self, batch_size=MONGO_BATCH_SIZE, workers=FBREF_CONCURRENCY):
+        """Seeds the unseeded players batch by batch, yielding the documents
+        of each batch as soon as it is seeded."""
+        players = self.get_unseeded_players()
+        for i in range(0, len(players), batch_size):
+            batch = self.seed_players(players[i:i + batch_size], workers)
+            yield [self.init_player(*new_player) for new_player in batch]
+
+    def fetch_new(self):
+        return [self.init_player(*new_player)
+                for new_player in self.get_new_players()]
 
     def fetch_one(self):
-        current_ids = {player["fpl_id"] for player in self.current_players}
-        stats = {player["fpl_id"]: player["seed_stats"]
-                 for player in self.current_players}
-        for player in fplapi.get_players():
-            if player["id"] not in current_ids or stats[player["id"]] is None:
-                yield self.init_player(player)
+        for new_player in self.get_new_players():
+            yield self.init_player(*new_player)
@@ -1,18 +1,42 @@
 """A module for loading player gameweek data from FPL. """
-from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+import asyncio
+import contextvars
+import hashlib
+import json
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Set, Tuple, Union
 from functools import partial
-import requests
-from constants import FPL_GAMEWEEK_URL
+import aiohttp
+from constants import FPL_GAMEWEEK_URL, GW_FETCH_CONCURRENCY
+from cdc import get_writer
 from db import MySQLManager
-from players import create_player_map, fetch_players
+from fplapi import get_events
+import metrics
+from players import get_registry
 from utils import get_current_gw, get_gw_range, mapl, subset_dict, Rows
+from watermarks import Watermarks
+
+
+class GwWatermarks(NamedTuple):
+    """The watermarks of the FPL gameweeks, and how they are used and
+    updated by an ingestion.
+
+    Attributes:
+        watermarks: The watermarks, which are set as gameweeks are written.
+        finalized_gws: The gameweeks whose data will not change again, whose
+          watermarks are marked as finalized.
+        conditional: Whether to skip gameweeks that are unchanged since
+          their watermarks were set.
+    """
+    watermarks: Watermarks
+    finalized_gws: Set[int]
+    conditional: bool = True
+
 
 desired_stats = {
     "minutes", "goals_scored", "assists", "clean_sheets", "goals_conceded",
     "bonus", "saves"
 }
-get_name = create_player_map("fpl_id", "fpl_name")
-get_team = create_player_map("fpl_id", "team_name")
 
 
 def get_stat_map(stats: List[dict]) -> Callable[[str], int]:
@@ -41,7 +65,7 @@ def get_match_data(
     }
 
 
-def get_remaining_fixture_ids(db: MySQLManager()) -> Dict[str, List[int]]:
+def get_remaining_fixture_ids(db: MySQLManager) -> Dict[str, List[int]]:
     """Gets a dictionary of each team's remaining fixtures for the current
     season.
 
@@ -72,11 +96,16 @@ def get_player_gw_data(player: dict, remaining_fixtures: Dict[str, List[int]]) -
 
     Returns:
         A tuple of rows, the first of which is static player info and the second
-        is the player's gameweek history.
+        is the player's gameweek history. Both are empty if the player is not
+        in the registry.
     """
     gw_data = []
     player_id = player["id"]
-    team = get_team[player_id]
+    registered = get_registry().get(player_id)
+    if registered is None:
+        print(f"Skipping unknown player {player_id}")
+        return [], []
+    team = registered["team_name"]
     matches = player["explain"]
     for match in matches:
         fixture_id = match["fixture"]
@@ -97,29 +126,181 @@ def get_player_gw_data(player: dict, remaining_fixtures: Dict[str, List[int]]) -
     return basic_info, gw_data
 
 
-def write_gw_data(db: MySQLManager, gws: Optional[Union[int, Tuple[int]]] = None) -> None:
+def write_gw_rows(
+    db: MySQLManager,
+    players: List[dict],
+    remaining_fixtures: Dict[str, List[int]]
+) -> None:
+    """Writes the match data of every player in a single gameweek.
+
+    Args:
+        db: The database to write to.
+        players: The "elements" of a gameweek's live data from FPL.
+        remaining_fixtures: Upcoming fixtures to add blank entries.
+    """
+    gw_info, gw_data = [], []
+    for player in players:
+        info, player_gw_data = get_player_gw_data(player, remaining_fixtures)
+        gw_info.extend(info)
+        gw_data.extend(player_gw_data)
+    # write the whole gameweek at once so that insert_rows can batch it
+    db.insert_rows("player_gws", gw_data)
+    db.insert_rows("player_gws_predicted", gw_info)
+
+
+async def fetch_gw_data(
+    session: aiohttp.ClientSession,
+    semaphore: asyncio.Semaphore,
+    queue: asyncio.Queue,
+    gw: int,
+    watermark: Optional[Dict[str, Any]] = None
+) -> None:
+    """Fetches a gameweek's live data from FPL and puts it on queue.
+
+    Puts a tuple of the gameweek, its players, and the ETag and hash of the
+    response. If a watermark is given, the request is conditional on its
+    ETag, and the players are None if the data is unchanged since the
+    watermark was set.
+    """
+    headers = {}
+    if watermark is not None and watermark.get("etag"):
+        headers["If-None-Match"] = watermark["etag"]
+    async with semaphore:
+        metrics.record_http_call()
+        async with session.get(FPL_GAMEWEEK_URL.format(gw),
+                               headers=headers) as response:
+            response.raise_for_status()
+            not_modified = response.status == 304
+            body = await response.read()
+            etag = response.headers.get("ETag")
+    if not_modified:
+        await queue.put((gw, None, watermark["etag"], watermark["hash"]))
+        return
+    digest = hashlib.sha256(body).hexdigest()
+    players = None
+    if watermark is None or watermark["hash"] != digest:
+        players = json.loads(body)["elements"]
+    await queue.put((gw, players, etag, digest))
+
+
+async def write_gw_queue(
+    db: MySQLManager,
+    queue: asyncio.Queue,
+    remaining_fixtures: Dict[str, List[int]],
+    num_gws: int,
+    gw_watermarks: GwWatermarks
+) -> int:
+    """Writes num_gws gameweeks from queue to the database, and sets their
+    watermarks once written.
+
+    Writes run in a worker thread, so that fetching continues meanwhile. The
+    thread runs in a copy of the current context, so that its rows are
+    counted towards the current pipeline stage.
+
+    Returns:
+        The number of gameweeks that were unchanged, and so not written.
+    """
+    loop = asyncio.get_running_loop()
+    num_unchanged = 0
+    for _ in range(num_gws):
+        gw, players, etag, digest = await queue.get()
+        if players is None:
+            num_unchanged += 1
+        else:
+            context = contextvars.copy_context()
+            await loop.run_in_executor(
+                None, context.run, write_gw_rows, db, players, remaining_fixtures)
+        gw_watermarks.watermarks.set(
+            gw, gw in gw_watermarks.finalized_gws, etag, digest)
+    return num_unchanged
+
+
+async def ingest_gw_data(
+    db: MySQLManager,
+    gws: range,
+    remaining_fixtures: Dict[str, List[int]],
+    concurrency: int,
+    gw_watermarks: GwWatermarks
+) -> int:
+    """Fetches the specified gameweeks concurrently and writes each one as
+    soon as it arrives.
+
+    Args:
+        db: The database to write to.
+        gws: The gameweeks to fetch.
+        remaining_fixtures: Upcoming fixtures to add blank entries.
+        concurrency: The maximum number of requests in flight. At most this
+          many fetched gameweeks wait to be written at any time.
+        gw_watermarks: The watermarks of the gameweeks, which are updated as
+          gameweeks are written.
+
+    Returns:
+        The number of gameweeks that were unchanged, and so not written.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    queue = asyncio.Queue(maxsize=concurrency)
+    watermarks = gw_watermarks.watermarks
+    async with aiohttp.ClientSession() as session:
+        num_unchanged, *_ = await asyncio.gather(
+            write_gw_queue(db, queue, remaining_fixtures, len(gws),
+                           gw_watermarks),
+            *[fetch_gw_data(session, semaphore, queue, gw,
+                            watermarks.get(gw) if gw_watermarks.conditional
+                            else None)
+              for gw in gws]
+        )
+    return num_unchanged
+
+
+def get_finalized_gws() -> Set[int]:
+    """Returns the gameweeks that are finished and whose data has been
+    checked by FPL, so will not change again."""
+    return {event["id"] for event in get_events()
+            if event["finished"] and event["data_checked"]}
+
+
+def write_gw_data(
+    db: MySQLManager,
+    gws: Optional[Union[int, Tuple[int]]] = None,
+    concurrency: int = GW_FETCH_CONCURRENCY
+) -> None:
     """Writes all player match data from the specified gws.
 
     Args:
         gws: An int representing a single gameweek to get data from, or a tuple
           (start, end), indicating to get data from the gameweek [start] to
-          [end], inclusive. If gws is None, then all gameweek data since
-          gameweek 1 will be written.
+          [end], inclusive. These gameweeks are always refetched and
+          rewritten. If gws is None, then only the gameweeks after the last
+          finalized one are fetched, and only those that changed since they
+          were last written are written.
+        concurrency: The maximum number of gameweeks to fetch at once.
     """
+    start_time = time.perf_counter()
+    watermarks = Watermarks("fpl_gameweeks")
+    if gws is None:
+        start, end = watermarks.last_finalized() + 1, min(get_current_gw(), 38)
+    else:
+        start, end = get_gw_range(gws)
+    gw_range = range(start, end + 1)
+    if len(gw_range) == 0:
+        print("All gameweeks are finalized and written")
+        return
     remaining_fixtures = get_remaining_fixture_ids(db)
-    start, end = get_gw_range(gws)
-    for gw in range(start, end + 1):
-        gw_url = FPL_GAMEWEEK_URL.format(gw)
-        gw_data = requests.get(gw_url).json()["elements"]
-        for player in gw_data:
-            info, gw_data = get_player_gw_data(player, remaining_fixtures)
-            db.insert_rows("player_gws", gw_data)
-            db.insert_rows("player_gws_predicted", info)
+    try:
+        gw_watermarks = GwWatermarks(
+            watermarks, get_finalized_gws(), conditional=gws is None)
+        num_unchanged = asyncio.run(ingest_gw_data(
+            db, gw_range, remaining_fixtures, concurrency, gw_watermarks))
+    finally:
+        watermarks.save()
+    elapsed = time.perf_counter() - start_time
+    print(f"Fetched {len(gw_range)} gameweeks and wrote "
+          f"{len(gw_range) - num_unchanged} in {elapsed:.1f}s")
 
 
 def main():
     """Updates player FPL data for all gameweeks."""
-    db = MySQLManager()
+    db = get_writer()
     write_gw_data(db)
 
 
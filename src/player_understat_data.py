@@ -1,25 +1,46 @@
 """A module for loading player match data from Understat. """
 import asyncio
-from typing import Any, Dict
+import os
+import time
+from typing import Any, Dict, List, Optional, Tuple
 import aiohttp
 from understat import Understat
-from constants import START_YEAR
-from db import MySQLManager
+from constants import (
+    CACHE_DIR,
+    START_YEAR,
+    UNDERSTAT_CONCURRENCY,
+    UNDERSTAT_PLAYER_FILE,
+    UNDERSTAT_RETRIES,
+    UNDERSTAT_TIMEOUT
+)
+from cdc import get_writer
 from fixtures import fixture_id_map
+import metrics
 from players import get_player_list
-from utils import cast_float_safe
+from utils import cast_float_safe, from_json, to_json
 
-fixture_id_map = fixture_id_map()
 MatchData = Dict[int, Dict[str, Dict[str, Any]]]
 
 
-def update_player_match_stats(match_data: MatchData, player_id: int, match: dict) -> None:
-    """Updates match_data with given player's stats."""
+def update_player_match_stats(
+    match_data: MatchData,
+    fixture_ids: Dict[int, int],
+    player_id: int,
+    match: dict
+) -> None:
+    """Updates match_data with given player's stats.
+
+    Args:
+        match_data: The match data to update.
+        fixture_ids: A map from Understat fixture ids to FPL fixture ids.
+        player_id: The FPL id of the player.
+        match: The player's Understat data for a single match.
+    """
     ustat_id = int(match["id"])
-    if ustat_id not in fixture_id_map:
+    if ustat_id not in fixture_ids:
         # not a premier league game
         return
-    fixture_id = fixture_id_map[ustat_id]
+    fixture_id = fixture_ids[ustat_id]
     if fixture_id not in match_data:
         match_data[fixture_id] = {}
     if player_id not in match_data[fixture_id]:
@@ -29,46 +50,114 @@ def update_player_match_stats(match_data: MatchData, player_id: int, match: dict
         }
 
 
-async def get_player_understat_data() -> MatchData:
-    """Fetch all player's match data from the current season."""
-    players = get_player_list()
-    match_data = {}
-    async with aiohttp.ClientSession() as session:
-        understat = Understat(session)
-        for player in players:
-            player_ustat_id = player["understat_id"]
-            if player_ustat_id is None:
-                continue
-            player_name = player["fpl_name"]
+async def fetch_player_matches(
+    understat: Understat,
+    semaphore: asyncio.Semaphore,
+    player: dict
+) -> Tuple[dict, List[dict]]:
+    """Fetches a player's matches from the current season.
+
+    Each attempt times out after UNDERSTAT_TIMEOUT seconds, and failed
+    attempts are retried up to UNDERSTAT_RETRIES times with exponential
+    backoff.
+
+    Returns:
+        A tuple of the player and their matches. The matches are empty if
+        they could not be fetched.
+    """
+    player_name = player["fpl_name"]
+    async with semaphore:
+        for attempt in range(UNDERSTAT_RETRIES + 1):
             try:
-                matches = await understat.get_player_matches(
-                    player_ustat_id, season=START_YEAR
+                metrics.record_http_call()
+                matches = await asyncio.wait_for(
+                    understat.get_player_matches(
+                        player["understat_id"], season=START_YEAR),
+                    UNDERSTAT_TIMEOUT
                 )
+                return player, matches
             except UnboundLocalError:
-                print(
-                    f"Could not fetch player data for {player_name} from Understat.")
-                continue
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt == UNDERSTAT_RETRIES:
+                    break
+                await asyncio.sleep(2 ** attempt)
+    print(f"Could not fetch player data for {player_name} from Understat.")
+    return player, []
+
+
+async def get_player_understat_data(concurrency: int = UNDERSTAT_CONCURRENCY) -> MatchData:
+    """Fetch all player's match data from the current season.
+
+    Args:
+        concurrency: The maximum number of players to fetch at once.
+    """
+    players = [player for player in get_player_list()
+               if player["understat_id"] is not None]
+    fixture_ids = fixture_id_map()
+    match_data = {}
+    start = time.perf_counter()
+    semaphore = asyncio.Semaphore(concurrency)
+    async with aiohttp.ClientSession() as session:
+        understat = Understat(session)
+        tasks = [fetch_player_matches(understat, semaphore, player)
+                 for player in players]
+        for i, task in enumerate(asyncio.as_completed(tasks)):
+            player, matches = await task
             for match in matches:
-                update_player_match_stats(match_data, player["fpl_id"], match)
-        return match_data
+                update_player_match_stats(
+                    match_data, fixture_ids, player["fpl_id"], match)
+            if (i + 1) % 100 == 0:
+                print(f"Fetched {i + 1}/{len(players)} players")
+    elapsed = time.perf_counter() - start
+    print(f"Fetched {len(players)} players from Understat in {elapsed:.1f}s")
+    return match_data
 
 
-def main():
-    """Updates database with Understat data from each match. """
-    db = MySQLManager()
-    fixtures = db.get_fixtures()
+def fetch_match_data() -> MatchData:
+    """Fetches every player's match data, and saves it to
+    UNDERSTAT_PLAYER_FILE so that it can be written separately."""
     match_data = asyncio.run(get_player_understat_data())
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    to_json(UNDERSTAT_PLAYER_FILE, match_data)
+    return match_data
+
+
+def write_match_data(match_data: Optional[MatchData] = None) -> None:
+    """Updates database with Understat data from each match.
+
+    Args:
+        match_data: The match data to write. Defaults to the data last saved
+          by fetch_match_data.
+    """
+    if match_data is None:
+        # JSON object keys are strings, so convert the ids back to ints.
+        match_data = {
+            int(fixture_id): {int(player_id): stats
+                              for player_id, stats in players.items()}
+            for fixture_id, players in from_json(UNDERSTAT_PLAYER_FILE).items()
+        }
+    db = get_writer()
+    fixtures = db.get_fixtures()
+    rows = []
     for fixture in fixtures:
         fixture_id = fixture[0]
         if not fixture_id in match_data:
             # Understat does not have data for this fixture yet
             continue
         for player_id, stats in match_data[fixture_id].items():
-            db.update_row(
-                "player_gws",
-                {"fixture_id": fixture_id, "player_id": player_id},
-                stats
-            )
+            rows.append({
+                "fixture_id": fixture_id,
+                "player_id": player_id,
+                **stats
+            })
+    db.update_rows("player_gws", ["fixture_id", "player_id"], rows)
+
+
+def main():
+    """Fetches Understat data from each match and writes it to the
+    database."""
+    write_match_data(fetch_match_data())
 
 
 if __name__ == "__main__":
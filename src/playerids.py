@@ -0,0 +1,94 @@
+"""A module for reconciling each FPL player's Understat and fbref IDs into a
+single table, written to PLAYER_IDS_FILE."""
+import asyncio
+import time
+from typing import Dict, List
+import fbref
+import fbrefscraper
+from constants import PLAYER_IDS_FILE
+from fbrefindex import get_index
+from identity import Match, get_fbref_indexes, resolve
+from players import (
+    get_fpl_player_list,
+    get_identities,
+    get_ustat_players,
+    resolve_ustat_players
+)
+from teams import get_fpl_teams
+from utils import to_json
+
+
+def resolve_fbref_players(fpl_player_list: List[dict]) -> Dict[int, Match]:
+    """Matches FPL players to the players on cached fbref pages.
+
+    Players whose fbref ID is already stored, or hard-coded, are matched to
+    that ID instead.
+
+    Returns:
+        A dictionary mapping the matched players' FPL ID to their match, whose
+        id is the player's fbref ID.
+    """
+    overrides = {fpl_id: fbref_id
+                 for fpl_id, fbref_id in fbref.get_id_store().items().items()
+                 if fbref_id is not None}
+    overrides.update(fbrefscraper.hardcoded_conversions)
+    team_names = {team["fpl_id"]: team["fpl_name"] for team in get_fpl_teams()}
+    index = get_index()
+    index.refresh()
+    return resolve(
+        get_identities(fpl_player_list),
+        get_fbref_indexes(index, team_names),
+        overrides=overrides
+    )
+
+
+def make_row(player: dict, understat_match: Match, fbref_match: Match) -> dict:
+    """Creates a row of the reconciled table.
+
+    Returns:
+        A dictionary with the player's FPL ID, name, team and position, along
+        with their Understat and fbref IDs and the score of each match. IDs
+        and scores are None for unmatched players.
+    """
+    return {
+        "fpl_id": player["fpl_id"],
+        "fpl_name": player["name"],
+        "team_name": player["team_name"],
+        "position": player["position"],
+        "understat_id": understat_match and understat_match.id,
+        "understat_score": understat_match and round(understat_match.score, 3),
+        "fbref_id": fbref_match and fbref_match.id,
+        "fbref_score": fbref_match and round(fbref_match.score, 3)
+    }
+
+
+def reconcile(fpl_player_list: List[dict], ustat_players: List[dict]) -> List[dict]:
+    """Resolves every FPL player's Understat and fbref IDs.
+
+    Returns:
+        A list of rows, as specified in make_row.
+    """
+    understat_matches = resolve_ustat_players(fpl_player_list, ustat_players)
+    fbref_matches = resolve_fbref_players(fpl_player_list)
+    return [make_row(player, understat_matches.get(player["fpl_id"]),
+                     fbref_matches.get(player["fpl_id"]))
+            for player in fpl_player_list]
+
+
+def main():
+    """Resolves the Understat and fbref IDs of every FPL player and writes
+    them to PLAYER_IDS_FILE."""
+    fpl_player_list = get_fpl_player_list()
+    ustat_players = asyncio.run(get_ustat_players())
+    start = time.perf_counter()
+    rows = reconcile(fpl_player_list, ustat_players)
+    elapsed = time.perf_counter() - start
+    to_json(PLAYER_IDS_FILE, rows)
+    num_understat = sum(row["understat_id"] is not None for row in rows)
+    num_fbref = sum(row["fbref_id"] is not None for row in rows)
+    print(f"Resolved {num_understat}/{len(rows)} Understat IDs and "
+          f"{num_fbref}/{len(rows)} fbref IDs in {elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
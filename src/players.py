@@ -1,15 +1,19 @@
 """A module for loading static player data from FPL and Understat. """
 import asyncio
 import os
-from typing import Optional
+import threading
+import time
+from typing import Dict, List, Optional, Set
 import aiohttp
-import requests
 import unidecode
 from understat import Understat
 
-from constants import START_YEAR, FPL_BASE_URL, ID_CONVERSIONS_FILE, PLAYERS_FILE
-from teams import create_team_map
-from db import MySQLManager
+from constants import START_YEAR, ID_CONVERSIONS_FILE, PLAYERS_FILE, PLAYERS_TTL
+from fplapi import get_elements
+from identity import get_understat_index, normalize, resolve
+from teams import create_team_map, get_fpl_teams
+from cdc import get_writer
+import metrics
 from utils import cast_int_safe, from_json, mapl, to_json
 
 
@@ -25,7 +29,7 @@ def get_position(element_type: int) -> str:
 
 def get_fpl_player_list():
     """Retrieves a list of all FPL players in current season."""
-    players_json = requests.get(FPL_BASE_URL).json()["elements"]
+    players_json = get_elements()
     player_list = []
     get_team = create_team_map("fpl_id", "fpl_name")
     for player in players_json:
@@ -69,18 +73,47 @@ def clean_name(name):
 
 
 async def get_ustat_players():
-    """Retrieves list of players from Understat."""
+    """Retrieves list of players from Understat, with cleaned names."""
     async with aiohttp.ClientSession() as session:
         understat = Understat(session)
+        metrics.record_http_call()
         ustat_players = await understat.get_league_players(
             "epl",
             START_YEAR
         )
-        ustat_player_map = {}
         for player in ustat_players:
-            player_name = clean_name(player["player_name"])
-            ustat_player_map[player_name] = player["id"]
-        return ustat_player_map
+            player["player_name"] = clean_name(player["player_name"])
+        return ustat_players
+
+
+def get_identities(fpl_player_list):
+    """Returns the names, teams and positions of FPL players, to be resolved
+    against other sources."""
+    return [{
+        "fpl_id": player["fpl_id"],
+        "names": player["candidate_names"],
+        "teams": frozenset([player["team_name"]]),
+        "positions": frozenset([player["position"]])
+    } for player in fpl_player_list]
+
+
+def resolve_ustat_players(fpl_player_list, ustat_players):
+    """Matches FPL players to Understat players by name, team and position.
+
+    Players in "data/id_conversions.json" are matched to their hard-coded
+    Understat ID instead.
+
+    Returns:
+        A dictionary mapping the matched players' FPL ID to their match, whose
+        id is the player's Understat ID.
+    """
+    team_names = {team["understat_name"]: team["fpl_name"]
+                  for team in get_fpl_teams()}
+    return resolve(
+        get_identities(fpl_player_list),
+        [get_understat_index(ustat_players, team_names)],
+        overrides=hardcoded_conversions()
+    )
 
 
 def make_player_json(player, ustat_id):
@@ -117,26 +150,116 @@ def get_player_list(cache=True):
     if cache:
         return from_json(PLAYERS_FILE)
     fpl_player_list = get_fpl_player_list()
-    ustat_player_map = asyncio.run(get_ustat_players())
-    hardcoded_ids = hardcoded_conversions()
+    ustat_players = asyncio.run(get_ustat_players())
+    ustat_matches = resolve_ustat_players(fpl_player_list, ustat_players)
     players = []
     for player in fpl_player_list:
-        fpl_id = player["fpl_id"]
-        if fpl_id in hardcoded_ids:
-            players.append(
-                make_player_json(player, hardcoded_ids[fpl_id])
-            )
-            continue
-        ustat_id = None
-        for name in player["candidate_names"]:
-            if name in ustat_player_map:
-                ustat_id = ustat_player_map[name]
-                break
-        players.append(make_player_json(player, ustat_id))
+        match = ustat_matches.get(player["fpl_id"])
+        players.append(make_player_json(player, match and match.id))
     to_json(PLAYERS_FILE, players)
     return players
 
 
+class PlayerRegistry:
+    """The players of the current season, loaded once and indexed by FPL ID,
+    Understat ID and normalized name.
+
+    Players are loaded from PLAYERS_FILE if it was written less than ttl
+    seconds ago, and otherwise from the FPL and Understat APIs. They are
+    reloaded when refresh is called, once they are older than ttl, or when
+    a lookup by FPL ID misses, since players can be added during the season.
+    """
+
+    def __init__(self, ttl: float = PLAYERS_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.loaded_at = 0.0
+        self._players: Optional[List[dict]] = None
+        self.by_fpl_id: Dict[int, dict] = {}
+        self.by_understat_id: Dict[int, dict] = {}
+        self.by_name: Dict[str, List[dict]] = {}
+        # FPL IDs still missing after a refresh, which do not trigger another
+        self.missing: Set[int] = set()
+
+    def load(self, refresh: bool) -> None:
+        """Loads the players and indexes them. Must be called with the lock
+        held.
+
+        Args:
+            refresh: Whether to fetch the players from the APIs even if
+              PLAYERS_FILE is younger than the ttl.
+        """
+        cache = (not refresh and os.path.exists(PLAYERS_FILE)
+                 and time.time() - os.path.getmtime(PLAYERS_FILE) < self.ttl)
+        self._players = get_player_list(cache=cache)
+        self.loaded_at = time.monotonic()
+        self.by_fpl_id = {player["fpl_id"]: player for player in self._players}
+        self.by_understat_id = {player["understat_id"]: player
+                                for player in self._players
+                                if player["understat_id"] is not None}
+        self.by_name = {}
+        self.missing = set()
+        for player in self._players:
+            self.by_name.setdefault(
+                normalize(player["fpl_name"]), []).append(player)
+
+    def players(self) -> List[dict]:
+        """Returns every player, loading them first if needed."""
+        with self.lock:
+            expired = time.monotonic() - self.loaded_at >= self.ttl
+            if self._players is None or expired:
+                self.load(refresh=False)
+            return self._players
+
+    def refresh(self) -> None:
+        """Reloads the players from the FPL and Understat APIs."""
+        with self.lock:
+            self.load(refresh=True)
+
+    def get(self, fpl_id: int) -> Optional[dict]:
+        """Returns the player with the given FPL ID, refreshing the players
+        once if they are not found.
+
+        Returns:
+            None if the player is still not found after refreshing.
+        """
+        self.players()
+        if fpl_id in self.by_fpl_id:
+            return self.by_fpl_id[fpl_id]
+        with self.lock:
+            # another thread may have refreshed while this one waited
+            if fpl_id not in self.by_fpl_id and fpl_id not in self.missing:
+                self.load(refresh=True)
+            if fpl_id not in self.by_fpl_id:
+                self.missing.add(fpl_id)
+            return self.by_fpl_id.get(fpl_id)
+
+    def get_by_understat_id(self, understat_id: int) -> Optional[dict]:
+        """Returns the player with the given Understat ID, or None if there
+        is none."""
+        self.players()
+        return self.by_understat_id.get(understat_id)
+
+    def find(self, name: str) -> List[dict]:
+        """Returns the players with the given name, ignoring case, accents
+        and punctuation."""
+        self.players()
+        return self.by_name.get(normalize(name), [])
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> PlayerRegistry:
+    """Returns the player registry shared by the whole process."""
+    global _registry  # pylint: disable=global-statement
+    with _registry_lock:
+        if _registry is None:
+            _registry = PlayerRegistry()
+    return _registry
+
+
 def create_player_map(key_col: str, val_col: Optional[str]):
     """Returns a dictionary from key_col to val_col.
 
@@ -146,14 +269,15 @@ def create_player_map(key_col: str, val_col: Optional[str]):
           'position', None]. If val_col is None, the keys are mapped to the
           entire player json.
     """
+    players = get_registry().players()
     if val_col is None:
-        return {player[key_col]: player for player in get_player_list(cache=False)}
-    return {player[key_col]: player[val_col] for player in get_player_list(cache=False)}
+        return {player[key_col]: player for player in players}
+    return {player[key_col]: player[val_col] for player in players}
 
 
 def fetch_players(cache=False):
     """Fetches list of FPL players"""
-    db = MySQLManager()
+    db = get_writer()
     player_rows = get_player_list(cache=cache)
     db.insert_rows("players", player_rows)
 
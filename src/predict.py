@@ -2,20 +2,22 @@
 import argparse
 from prettytable import PrettyTable
 from constants import OPTIONS_FILE, MY_TEAM_SCRIPT, PREDICT_SCRIPT
-from db import MySQLManager
+from db import get_manager
 from utils import from_json, get_current_gw, prepare_string
 
-current_gw = get_current_gw()
-
 
 def parse_args():
     """Parses command line arguments, specified in the options file."""
     parser = argparse.ArgumentParser(description="Get FPL point projections")
     options = from_json(OPTIONS_FILE)
-    options["--gws"]["default"] = current_gw + 1
     for option, info in options.items():
         parser.add_argument(option, **info)
-    return parser.parse_args()
+    args = parser.parse_args()
+    # The next gameweek is only looked up once it is needed, so that --help
+    # does not wait on the FPL API.
+    if args.gws is None:
+        args.gws = get_current_gw() + 1
+    return args
 
 
 def optional(name, val, cmp="="):
@@ -25,7 +27,8 @@ def optional(name, val, cmp="="):
 
 def query_database(args):
     """Constructs a query based on cli arguments and returns results."""
-    db = MySQLManager()
+    db = get_manager()
+    current_gw = get_current_gw()
     try:
         start_gw, end_gw = [int(gw) for gw in args.gws.split("-")]
     except (ValueError, AttributeError):
@@ -52,7 +55,7 @@ def query_database(args):
     where_clause = " AND ".join(filters)
     if args.my_team:
         with open(MY_TEAM_SCRIPT, encoding="utf-8") as sql_script:
-            team_query = sql_script.read().format(get_current_gw())
+            team_query = sql_script.read().format(current_gw)
             team_players = db.exec_query(team_query)
             where_clause += " AND ("
             where_clause += " OR ".join([optional("player_name", player[0])
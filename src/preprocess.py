@@ -1,66 +1,257 @@
 """A module for preprocessing gameweek data to be fed into model."""
+import argparse
+import os
+import time
+from typing import Any, Dict, Optional
+import numpy as np
+import pandas as pd
 from constants import (
+    CACHE_DIR,
+    EMA_STATE_FILE,
     GW_HISTORY_FILE,
     MERGE_SCRIPT,
     NPXG_ALPHA,
     XA_ALPHA,
     BONUS_ALPHA,
-    MINUTES_ALPHA
+    MINUTES_ALPHA,
+    TEAM_XGA_ALPHA
 )
+from cdc import get_writer
 from db import MySQLManager
-from teams import get_fpl_teams
-from utils import get_ema
+from utils import from_json, get_group_ema_states, get_group_emas, to_json
 
+player_alphas = {
+    "npxG": NPXG_ALPHA,
+    "xA": XA_ALPHA,
+    "bonus": BONUS_ALPHA,
+    "minutes": MINUTES_ALPHA
+}
 
-def compute_emas(data, stats, alpha):
-    """Computes an EMA for each of the specified stats."""
+team_alphas = {
+    "team_xG": NPXG_ALPHA,
+    "team_xGA": TEAM_XGA_ALPHA
+}
+
+# type synonym for the persisted EMA state
+EmaState = Dict[str, Any]
+
+
+def new_ema_state() -> EmaState:
+    """Returns an EMA state from which every average is recomputed.
+
+    The state is a dictionary with the following keys:
+        alphas: The EMA parameters the averages were computed with.
+        last_gw_updated: The last gameweek whose rows have been folded into
+          the averages. 0 if none have.
+        emas: A dictionary mapping each stat to a dictionary from each player
+          (or team) name to its EMA after last_gw_updated.
+    """
+    return {
+        "alphas": {**player_alphas, **team_alphas},
+        "last_gw_updated": 0,
+        "emas": {}
+    }
+
+
+def load_ema_state() -> EmaState:
+    """Loads the EMA state from the last run.
+
+    Returns:
+        The stored state, or a new state if there is none or if the alphas in
+        constants.py have changed since it was stored.
+    """
+    if not os.path.exists(EMA_STATE_FILE):
+        return new_ema_state()
+    state = from_json(EMA_STATE_FILE)
+    if state["alphas"] != new_ema_state()["alphas"]:
+        print("EMA parameters changed, recomputing all averages")
+        return new_ema_state()
+    return state
+
+
+def update_ema_state(
+    state: EmaState,
+    data: pd.DataFrame,
+    group_col: str,
+    alphas: Dict[str, float],
+    last_gw: int
+) -> None:
+    """Folds the rows of data up to last_gw into the EMAs in state.
+
+    Args:
+        state: The EMA state to update.
+        data: Rows after state["last_gw_updated"], ordered by kickoff date.
+        group_col: The column to group averages by.
+        alphas: A dictionary mapping each stat to its EMA parameter.
+        last_gw: The last gameweek whose fixtures have all been completed.
+    """
+    seeds = {stat: state["emas"].get(stat, {}) for stat in alphas}
+    completed = data[data["gameweek"] <= last_gw]
+    state["emas"].update(
+        get_group_ema_states(completed, group_col, alphas, seeds))
+
+
+def get_last_completed_gw(db: MySQLManager) -> int:
+    """Returns the last gameweek such that it and every gameweek before it
+    have been completed. 0 if there is no such gameweek."""
+    fixtures = db.get_df(
+        "SELECT gameweek, completed FROM fixtures WHERE gameweek IS NOT NULL")
+    incomplete = fixtures.loc[fixtures["completed"] != 1, "gameweek"]
+    if len(incomplete) > 0:
+        return int(incomplete.min()) - 1
+    return int(fixtures["gameweek"].max()) if len(fixtures) > 0 else 0
+
+
+def compute_emas(data, alphas):
+    """Computes a per-player EMA for each of the specified stats.
+
+    Args:
+        data: The merged gameweek data, ordered by kickoff date.
+        alphas: A dictionary mapping each stat to its EMA parameter.
+
+    Returns:
+        A copy of data with an avg_{stat} column for each stat in alphas.
+    """
     dfc = data.copy()
-    for stat in stats:
-        avg_stat = f"avg_{stat}"
-        for player in data["player_name"].unique():
-            is_player = data["player_name"] == player
-            row = data[is_player]
-            dfc.loc[is_player, avg_stat] = get_ema(row[stat], alpha)
+    emas = get_group_emas(data, "player_name", alphas)
+    dfc[emas.columns] = emas
     return dfc
 
 
-def compute_team_xg_averages(db: MySQLManager) -> None:
+def get_previous_averages(
+    data: pd.DataFrame,
+    last_gw: int
+) -> Optional[pd.DataFrame]:
+    """Gets the player averages of rows up to last_gw from the last run.
+
+    Args:
+        data: The merged gameweek data.
+        last_gw: The last gameweek folded into the stored EMA state.
+
+    Returns:
+        The avg_{stat} columns for the rows of data with gameweek <= last_gw,
+        read from the gameweek history file. None if the file is missing or
+        does not contain all of those rows.
+    """
+    if not os.path.exists(GW_HISTORY_FILE):
+        return None
+    keys = ["player_id", "fixture_id"]
+    avg_cols = [f"avg_{stat}" for stat in player_alphas]
+    history = pd.read_csv(GW_HISTORY_FILE)
+    if any(col not in history.columns for col in avg_cols):
+        return None
+    head = data.loc[data["gameweek"] <= last_gw, keys]
+    head = head.reset_index().merge(
+        history[keys + avg_cols], on=keys, how="left", indicator=True)
+    if (head["_merge"] != "both").any():
+        return None
+    return head.set_index("index")[avg_cols]
+
+
+def update_player_emas(data: pd.DataFrame, state: EmaState, last_gw: int) -> pd.DataFrame:
+    """Computes the player averages, recomputing only rows after the state.
+
+    Rows up to state["last_gw_updated"] keep their averages from the last
+    run, and the remaining rows continue from the stored EMAs. If the last
+    run's averages are unavailable, every row is recomputed.
+
+    Args:
+        data: The merged gameweek data, ordered by kickoff date.
+        state: The EMA state, which is updated to include gameweeks up to
+          last_gw.
+        last_gw: The last gameweek whose fixtures have all been completed.
+
+    Returns:
+        A copy of data with an avg_{stat} column for each player stat.
+    """
+    dfc = data.copy()
+    for stat in player_alphas:
+        dfc[f"avg_{stat}"] = np.nan
+    prev_gw = state["last_gw_updated"]
+    prev_avgs = get_previous_averages(data, prev_gw) if prev_gw > 0 else None
+    if prev_avgs is None:
+        prev_gw = 0
+        for stat in player_alphas:
+            state["emas"].pop(stat, None)
+    else:
+        dfc.loc[prev_avgs.index, prev_avgs.columns] = prev_avgs
+    is_new = ~(data["gameweek"] <= prev_gw)
+    new_rows = data[is_new]
+    seeds = {stat: state["emas"].get(stat, {}) for stat in player_alphas}
+    emas = get_group_emas(new_rows, "player_name", player_alphas, seeds)
+    dfc.loc[is_new, emas.columns] = emas
+    update_ema_state(state, new_rows, "player_name", player_alphas, last_gw)
+    print(f"Computed player averages for {len(new_rows)} of {len(data)} rows")
+    return dfc
+
+
+def compute_team_xg_averages(db: MySQLManager, state: EmaState, last_gw: int) -> int:
     """Averages team xG data and writes to the team_gws table.
 
-    Averages are calculated with an exponential moving average (EMA)."""
-    teams = get_fpl_teams()
-    for team in teams:
-        team_name = team["fpl_name"]
-        query = """SELECT * FROM team_gws
-        WHERE gameweek IS NOT NULL
-        ORDER BY kickoff_date"""
-        df = db.get_df(query)
-        team_rows = df[df["team"] == team_name].reset_index()
-        team_xg = get_ema(team_rows["team_xG"], NPXG_ALPHA)
-        team_xga = get_ema(team_rows["team_xGA"])
-        for i, team_row in team_rows.iterrows():
-            db.update_row(
-                "team_gws",
-                {"fixture_id": team_row["fixture_id"], "team": team_name},
-                {"avg_team_xG": team_xg[i], "avg_team_xGA": team_xga[i]}
-            )
-
-
-def preprocess():
-    """Preprocess data and write to gameweek history file.
+    Averages are calculated with an exponential moving average (EMA) over
+    each team's fixtures, ordered by kickoff date. Only fixtures after
+    state["last_gw_updated"] are read, continuing from the stored EMAs, and
+    their averages are written back in bulk.
+
+    Args:
+        db: The database to read and write team_gws from.
+        state: The EMA state, which is updated to include gameweeks up to
+          last_gw.
+        last_gw: The last gameweek whose fixtures have all been completed.
+
+    Returns:
+        The number of team_gws rows written.
+    """
+    start = time.perf_counter()
+    query = f"""SELECT fixture_id, team, gameweek, team_xG, team_xGA
+    FROM team_gws
+    WHERE gameweek > {state["last_gw_updated"]}
+    ORDER BY kickoff_date"""
+    df = db.get_df(query)
+    seeds = {stat: state["emas"].get(stat, {}) for stat in team_alphas}
+    emas = get_group_emas(df, "team", team_alphas, seeds)
+    rows = df[["fixture_id", "team"]].join(emas).to_dict("records")
+    db.update_rows("team_gws", ["fixture_id", "team"], rows)
+    update_ema_state(state, df, "team", team_alphas, last_gw)
+    elapsed = time.perf_counter() - start
+    print(f"Wrote {len(rows)} team_gws averages in {elapsed:.2f}s")
+    return len(rows)
+
 
-    Joins the player_gws table with team_gws table and computes stat averages."""
-    db = MySQLManager()
-    compute_team_xg_averages(db)
+def get_merged_gw_data(db: MySQLManager) -> pd.DataFrame:
+    """Returns the player_gws table joined with team_gws, ordered by kickoff
+    date, without any averages of the player stats."""
     with open(MERGE_SCRIPT, encoding="utf-8") as sql_file:
         query = sql_file.read()
-    gw_df = db.get_df(query)
-    gw_df = compute_emas(gw_df, ["npxG"], NPXG_ALPHA)
-    gw_df = compute_emas(gw_df, ["xA"], XA_ALPHA)
-    gw_df = compute_emas(gw_df, ["bonus"], BONUS_ALPHA)
-    gw_df = compute_emas(gw_df, ["minutes"], MINUTES_ALPHA)
+    return db.get_df(query)
+
+
+def preprocess(full: bool = False):
+    """Preprocess data and write to gameweek history file.
+
+    Joins the player_gws table with team_gws table and computes stat averages.
+    Unless full is set, only gameweeks after the last completed gameweek of
+    the previous run are recomputed; the EMA state needed to do so is stored
+    in the EMA state file."""
+    db = get_writer()
+    state = new_ema_state() if full else load_ema_state()
+    last_gw = get_last_completed_gw(db)
+    if last_gw < state["last_gw_updated"]:
+        state = new_ema_state()
+    compute_team_xg_averages(db, state, last_gw)
+    gw_df = get_merged_gw_data(db)
+    gw_df = update_player_emas(gw_df, state, last_gw)
     gw_df.to_csv(GW_HISTORY_FILE, index=False)
+    state["last_gw_updated"] = last_gw
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    to_json(EMA_STATE_FILE, state)
 
 
 if __name__ == "__main__":
-    preprocess()
+    arg_parser = argparse.ArgumentParser(description="Preprocess gameweek data")
+    arg_parser.add_argument(
+        "--full",
+        action="store_true",
+        help="recompute every average rather than only new gameweeks."
+    )
+    preprocess(arg_parser.parse_args().full)
@@ -0,0 +1,77 @@
+"""A module for rate limiting requests to external sites."""
+import asyncio
+from email.utils import parsedate_to_datetime
+import threading
+import time
+from typing import Optional
+
+
+class TokenBucket:
+    """A token bucket rate limiter that can be shared by threads and
+    coroutines alike.
+
+    Tokens are reserved rather than waited for under the lock, so each caller
+    is told how long to wait for its turn and sleeps outside of it.
+    """
+
+    def __init__(self, rate: float, capacity: float = 1):
+        """
+        Args:
+            rate: The number of tokens added per second.
+            capacity: The maximum number of tokens the bucket can hold, i.e.
+              the largest burst of requests allowed.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self) -> None:
+        """Adds the tokens accrued since the last refill, up to capacity.
+        Must be called with the lock held."""
+        now = time.monotonic()
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        """Takes a token from the bucket, and returns the number of seconds
+        to wait before it can be used."""
+        with self.lock:
+            self.refill()
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def pause(self, seconds: float) -> None:
+        """Stops handing out usable tokens for the next given seconds, e.g.
+        after the server responds with a Retry-After header."""
+        with self.lock:
+            self.refill()
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    def acquire(self) -> None:
+        """Blocks until a token is available."""
+        time.sleep(self.reserve())
+
+    async def acquire_async(self) -> None:
+        """Waits until a token is available, without blocking the event
+        loop."""
+        await asyncio.sleep(self.reserve())
+
+
+def parse_retry_after(value: Optional[str], default: float) -> float:
+    """Returns the number of seconds to wait given a Retry-After header,
+    which is either a number of seconds or an HTTP date."""
+    if value is None:
+        return default
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
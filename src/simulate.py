@@ -0,0 +1,166 @@
+"""A module for simulating the distribution of FPL points.
+
+Samples goals, assists, bonus points and goals conceded for every player and
+fixture from the same Poisson rates that the model uses for its point
+predictions, and summarizes the simulated points of each player in each
+fixture.
+"""
+import argparse
+import time
+from typing import Dict
+import numpy as np
+import pandas as pd
+from constants import (
+    GW_HISTORY_FILE,
+    HAUL_POINTS,
+    SIMULATION_CHUNK_SIZE,
+    SIMULATION_DRAWS
+)
+from cdc import get_writer
+from model import get_mins_multiplier, get_poisson_rates, get_stat_values
+from utils import get_current_gw
+
+simulated_cols = ["mean_points", "std_points", "haul_prob", "p90_points"]
+
+
+def simulate_points(
+    rates: Dict[str, np.ndarray],
+    stat_values: np.ndarray,
+    mins_multiplier: np.ndarray,
+    draws: int,
+    rng: np.random.Generator
+) -> np.ndarray:
+    """Simulates the points of a set of players.
+
+    Each stat is capped at the same maximum value that the model sums its
+    expected value up to. Goals conceded lose a point for every two goals,
+    whereas the model's expected value only counts even numbers of goals,
+    so the mean for goalkeepers and defenders can be slightly below their xP.
+
+    Args:
+        rates: The Poisson rates of each row, as returned by
+          model.get_poisson_rates.
+        stat_values: The point value of each stat for each row.
+        mins_multiplier: The minutes multiplier of each row.
+        draws: The number of draws per row.
+        rng: The random number generator to sample from.
+
+    Returns:
+        An array with shape (rows, draws) of simulated points.
+    """
+    size = (len(mins_multiplier), draws)
+
+    def sample(rate):
+        return rng.poisson(rate[:, np.newaxis], size)
+
+    goals = np.minimum(sample(rates["goals"]), 4)
+    assists = np.minimum(sample(rates["assists"]), 4)
+    bonus = np.minimum(sample(rates["bonus"]), 3)
+    conceded = sample(rates["conceded"])
+    points = (
+        stat_values[:, [0]] * goals
+        + stat_values[:, [1]] * assists
+        + stat_values[:, [2]] * (conceded == 0)
+        + stat_values[:, [3]] * bonus
+        + stat_values[:, [4]] * np.minimum(conceded // 2, 4)
+    )
+    # Add 2 for base minute points
+    return mins_multiplier[:, np.newaxis] * (points + 2)
+
+
+def simulate(rows: pd.DataFrame, draws: int, seed: int) -> pd.DataFrame:
+    """Simulates the points distribution of every row.
+
+    Rows are simulated in chunks of about SIMULATION_CHUNK_SIZE draws, so
+    memory use does not grow with the number of rows.
+
+    Args:
+        rows: Gameweek rows with the model's features. Rows whose rates are
+          not all finite are skipped.
+        draws: The number of draws per row.
+        seed: The seed of the random number generator.
+
+    Returns:
+        A DataFrame with the player_id and fixture_id of each simulated row,
+        and its mean, standard deviation, probability of scoring at least
+        HAUL_POINTS, and 90th percentile of simulated points.
+    """
+    rates = get_poisson_rates(rows)
+    is_valid = np.all([np.isfinite(rate) & (rate >= 0)
+                       for rate in rates.values()], axis=0)
+    rows = rows[is_valid]
+    rates = {stat: rate[is_valid] for stat, rate in rates.items()}
+    stat_values = get_stat_values(rows["position"])
+    mins_multiplier = get_mins_multiplier(rows)
+    rng = np.random.default_rng(seed)
+    chunk = max(1, SIMULATION_CHUNK_SIZE // draws)
+    summaries = []
+    for i in range(0, len(rows), chunk):
+        points = simulate_points(
+            {stat: rate[i:i + chunk] for stat, rate in rates.items()},
+            stat_values[i:i + chunk],
+            mins_multiplier[i:i + chunk],
+            draws,
+            rng
+        )
+        summaries.append(np.column_stack([
+            points.mean(axis=1),
+            points.std(axis=1),
+            (points >= HAUL_POINTS).mean(axis=1),
+            np.percentile(points, 90, axis=1)
+        ]))
+    summary = np.concatenate(summaries) if summaries else np.empty((0, 4))
+    results = rows[["player_id", "fixture_id"]].reset_index(drop=True)
+    results[simulated_cols] = np.round(summary, 3)
+    results["draws"] = draws
+    return results
+
+
+def parse_args():
+    """Parses command line arguments."""
+    parser = argparse.ArgumentParser(description="Simulate FPL points")
+    parser.add_argument(
+        "--gws",
+        default=None,
+        help="gw(s) to simulate, either a single integer or a range such as "
+        "1-38. Defaults to the next gameweek."
+    )
+    parser.add_argument(
+        "--draws",
+        type=int,
+        default=SIMULATION_DRAWS,
+        help="number of draws per player and fixture."
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="seed of the random number generator."
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Simulates points for the specified gameweeks and writes the results."""
+    args = parse_args()
+    if args.gws is None:
+        start_gw = end_gw = get_current_gw() + 1
+    else:
+        try:
+            start_gw, end_gw = [int(gw) for gw in args.gws.split("-")]
+        except ValueError:
+            start_gw = end_gw = int(args.gws)
+    df = pd.read_csv(GW_HISTORY_FILE)
+    rows = df[(df["gameweek"] >= start_gw) & (df["gameweek"] <= end_gw)
+              & (df["avg_minutes"] > 0)]
+    start = time.perf_counter()
+    results = simulate(rows, args.draws, args.seed)
+    elapsed = time.perf_counter() - start
+    print(f"Simulated {len(results)} rows with {args.draws} draws "
+          f"in {elapsed:.1f}s")
+    get_writer().insert_rows(
+        "player_gws_simulated", results.to_dict("records"))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""A module for tuning the EMA parameters of the model.
+
+Evaluates the model over a grid of alpha combinations for the npxG, xA,
+bonus and minutes averages. The merged gameweek data is loaded once, the
+averages for every alpha are computed together, and the combinations are
+predicted and evaluated in parallel. Team xG averages are left as they are
+stored in the team_gws table.
+"""
+import argparse
+import itertools
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+import numpy as np
+import pandas as pd
+from prettytable import PrettyTable
+from constants import SWEEP_RESULTS_FILE
+from db import get_manager
+from model import get_mse, predict_all, predicted_cols
+from preprocess import get_merged_gw_data, player_alphas
+from utils import get_current_gw, get_group_emas
+
+# type synonym for one alpha per stat, in the order of player_alphas
+Alphas = Tuple[float, ...]
+
+# feature frame shared by each worker process, set by init_worker
+features = None
+
+
+def alpha_col(stat: str, alpha: float) -> str:
+    """Returns the name of the copy of stat to be averaged with alpha."""
+    return f"{stat}@{alpha}"
+
+
+def compute_sweep_features(gw_df: pd.DataFrame, combos: List[Alphas]) -> pd.DataFrame:
+    """Computes the averages needed by every alpha combination at once.
+
+    Args:
+        gw_df: The merged gameweek data, ordered by kickoff date.
+        combos: The alpha combinations to be evaluated.
+
+    Returns:
+        A copy of gw_df with a column avg_{alpha_col(stat, alpha)} for every
+        stat and every alpha used for that stat in combos.
+    """
+    stat_cols = {}
+    alphas = {}
+    for i, stat in enumerate(player_alphas):
+        for alpha in sorted({combo[i] for combo in combos}):
+            stat_cols[alpha_col(stat, alpha)] = gw_df[stat]
+            alphas[alpha_col(stat, alpha)] = alpha
+    stats = pd.DataFrame(stat_cols, index=gw_df.index)
+    stats["player_name"] = gw_df["player_name"]
+    emas = get_group_emas(stats, "player_name", alphas)
+    return pd.concat([gw_df, emas], axis=1)
+
+
+def init_worker(shared_features: pd.DataFrame) -> None:
+    """Stores the feature frame in a worker process."""
+    global features  # pylint: disable=global-statement
+    features = shared_features
+
+
+def evaluate_alphas(combo: Alphas, current_gw: int) -> np.ndarray:
+    """Predicts and evaluates the model for a single alpha combination.
+
+    Returns:
+        The MSE of each of predicted_cols, as computed by model.get_mse.
+    """
+    rows = features.assign(**{
+        f"avg_{stat}": features["avg_" + alpha_col(stat, alpha)]
+        for stat, alpha in zip(player_alphas, combo)
+    })
+    rows = rows[rows["avg_minutes"] > 0].copy()
+    rows[predicted_cols] = predict_all(rows)
+    return get_mse(rows, current_gw, decimals=4)
+
+
+def get_combos(values: List[float], samples: int, seed: int) -> List[Alphas]:
+    """Returns the alpha combinations to evaluate.
+
+    Args:
+        values: The candidate values for each alpha.
+        samples: The number of combinations to sample at random from the full
+          grid. If 0, or at least the size of the grid, the full grid is used.
+        seed: The seed used to sample combinations.
+    """
+    grid = list(itertools.product(values, repeat=len(player_alphas)))
+    if 0 < samples < len(grid):
+        return random.Random(seed).sample(grid, samples)
+    return grid
+
+
+def sweep(combos: List[Alphas], workers: int) -> pd.DataFrame:
+    """Evaluates the model for every alpha combination.
+
+    Args:
+        combos: The alpha combinations to evaluate.
+        workers: The number of worker processes.
+
+    Returns:
+        A DataFrame with one row per combination, with a column for each
+        alpha and the MSE of each predicted column, sorted by the MSE of xP.
+    """
+    start = time.perf_counter()
+    gw_df = get_merged_gw_data(get_manager())
+    sweep_features = compute_sweep_features(gw_df, combos)
+    current_gw = get_current_gw()
+    with ProcessPoolExecutor(workers, initializer=init_worker,
+                             initargs=(sweep_features,)) as executor:
+        mses = list(executor.map(
+            evaluate_alphas, combos, itertools.repeat(current_gw),
+            chunksize=max(1, len(combos) // (4 * workers))))
+    alpha_names = [f"{stat}_alpha" for stat in player_alphas]
+    results = pd.concat([
+        pd.DataFrame(combos, columns=alpha_names),
+        pd.DataFrame(mses, columns=[f"{col}_mse" for col in predicted_cols])
+    ], axis=1)
+    results = results.sort_values("xP_mse", kind="stable").reset_index(drop=True)
+    elapsed = time.perf_counter() - start
+    print(f"Evaluated {len(combos)} alpha combinations in {elapsed:.1f}s")
+    return results
+
+
+def parse_args():
+    """Parses command line arguments."""
+    parser = argparse.ArgumentParser(description="Tune the model's EMA alphas")
+    parser.add_argument(
+        "--values",
+        default="0.05,0.1,0.15,0.2,0.25,0.3,0.35,0.4,0.45,0.5",
+        help="comma-separated candidate values for each alpha."
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=200,
+        help="number of combinations to sample from the grid, 0 for all."
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="number of worker processes."
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="seed for sampling combinations."
+    )
+    return parser.parse_args()
+
+
+def main():
+    """Runs an alpha sweep and writes the ranked results."""
+    args = parse_args()
+    values = [float(value) for value in args.values.split(",")]
+    combos = get_combos(values, args.samples, args.seed)
+    results = sweep(combos, args.workers)
+    results.to_csv(SWEEP_RESULTS_FILE, index=False)
+    table = PrettyTable()
+    table.field_names = ["rank"] + list(results.columns)
+    for rank, row in enumerate(results.head(10).itertuples(index=False)):
+        table.add_row([rank + 1] + list(row))
+    print(table)
+
+
+if __name__ == "__main__":
+    main()
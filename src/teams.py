@@ -1,10 +1,10 @@
 """A module for loading static team data from FPL, Understat, and
 FiveThirtyEight. """
 import os
-import requests
-from constants import FPL_BASE_URL, TEAMS_FILE
+from constants import TEAMS_FILE
+from fplapi import get_teams
 from utils import from_json, to_json
-from db import MySQLManager
+from cdc import get_writer
 
 understat_names = {
     "Man City": "Manchester City",
@@ -60,7 +60,7 @@ def get_fpl_teams(cache=True):
     """
     if cache and os.path.exists(TEAMS_FILE):
         return from_json(TEAMS_FILE)
-    teams_json = requests.get(FPL_BASE_URL).json()["teams"]
+    teams_json = get_teams()
     teams = [make_team_json(team) for team in teams_json]
     to_json(TEAMS_FILE, teams)
     return teams
@@ -74,7 +74,12 @@ def create_team_map(key_col: str, val_col: str):
     return {team[key_col]: team[val_col] for team in get_fpl_teams()}
 
 
-if __name__ == "__main__":
-    db = MySQLManager()
+def main():
+    """Writes the current Premier League teams to the database."""
+    db = get_writer()
     team_rows = get_fpl_teams()
     db.insert_rows("teams", team_rows)
+
+
+if __name__ == "__main__":
+    main()
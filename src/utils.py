@@ -1,13 +1,19 @@
-"""A module for utility functions."""
+"""A module for utility functions.
+
+pandas, numpy and dateutil are only imported by the functions that use them,
+so that importing this module stays cheap.
+"""
+# pylint: disable=import-outside-toplevel
+from __future__ import annotations
 import json
 import math
 from datetime import datetime
-from typing import Any, Callable, Dict, List, Optional, Tuple, Union
-import pandas as pd
-import requests
-from dateutil import parser
-import numpy as np
-from constants import FPL_BASE_URL
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple, Union
+from fplapi import get_events
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
 
 # type synonyms for database rows
 Row = Dict[str, Any]
@@ -32,6 +38,7 @@ def parse_date(str_opt: Optional[str]) -> Optional[str]:
     Returns:
       None if s is None, otherwise a string in the form YYYY-MM-DD.""
     """
+    from dateutil import parser
     if str_opt is None:
         return None
     return parser.parse(str_opt).strftime("%Y-%m-%d")
@@ -58,7 +65,7 @@ def get_current_gw() -> int:
     Returns:
       39 if no such gameweek exists
     """
-    gws = requests.get(FPL_BASE_URL).json()["events"]
+    gws = get_events()
     now = datetime.utcnow()
     for gw in gws:
         gw_deadline = datetime.strptime(
@@ -91,6 +98,7 @@ def get_ema(col: pd.Series, alpha: float = 0.3) -> np.array:
         before gameweek i, we only know the match stats and the average from
         gameweek i-1.
     """
+    import numpy as np
     ema = col.ewm(alpha=alpha, ignore_na=True, adjust=False).mean()
     ema = ema.to_numpy()
     ema = np.roll(ema, 1)
@@ -99,7 +107,185 @@ def get_ema(col: pd.Series, alpha: float = 0.3) -> np.array:
     return ema
 
 
-def map_list(f: Callable[[Any], Any], lst: List[Any]) -> List[Any]:
+def update_ema(ema: Optional[float], val: Optional[float], alpha: float) -> Optional[float]:
+    """Returns an unrounded EMA after a new data point, with the semantics of
+    get_ema: a missing data point leaves the average as it is, and the first
+    data point starts it."""
+    if val is None:
+        return ema
+    if ema is None:
+        return float(val)
+    return alpha * val + (1 - alpha) * ema
+
+
+def _get_group_ewms(
+    data: pd.DataFrame,
+    group_col: str,
+    alphas: Dict[str, float],
+    seeds: Optional[Dict[str, Dict[Any, float]]] = None
+) -> pd.DataFrame:
+    """Computes unshifted EMAs of several columns within each group.
+
+    Args:
+        data: A pandas DataFrame, ordered by time within each group.
+        group_col: The column to group by.
+        alphas: A dictionary mapping each column to average to its EMA
+          parameter.
+        seeds: An optional dictionary mapping a column to the EMA of each
+          group before the first row of data, as returned by
+          get_group_ema_states.
+
+    Returns:
+        A DataFrame with a default index, containing group_col and the
+        running EMA of each column in alphas. If seeds is given, it starts
+        with one row for each seeded group holding the seed values, so that
+        the EMAs of data continue from them.
+    """
+    import numpy as np
+    import pandas as pd
+    cols = list(alphas)
+    frame = data[[group_col] + cols].astype({col: float for col in cols})
+    if seeds:
+        seed_groups = list(dict.fromkeys(
+            group for col_seeds in seeds.values() for group in col_seeds))
+        seed_frame = pd.DataFrame({group_col: seed_groups})
+        for col in cols:
+            col_seeds = seeds.get(col, {})
+            seed_frame[col] = [col_seeds.get(group, np.nan)
+                               for group in seed_groups]
+        frame = pd.concat([seed_frame, frame], ignore_index=True)
+    else:
+        frame = frame.reset_index(drop=True)
+    if frame.empty:
+        return frame
+    grouped = frame.groupby(group_col, sort=False)
+    cols_by_alpha = {}
+    for col, alpha in alphas.items():
+        cols_by_alpha.setdefault(alpha, []).append(col)
+    ewms = frame[[group_col]].copy()
+    for alpha, alpha_cols in cols_by_alpha.items():
+        ewm = grouped[alpha_cols].ewm(
+            alpha=alpha, ignore_na=True, adjust=False).mean()
+        ewm = ewm.reset_index(level=0, drop=True).reindex(frame.index)
+        for col in alpha_cols:
+            ewms[col] = ewm[col]
+    return ewms
+
+
+def get_group_emas(
+    data: pd.DataFrame,
+    group_col: str,
+    alphas: Dict[str, float],
+    seeds: Optional[Dict[str, Dict[Any, float]]] = None
+) -> pd.DataFrame:
+    """Computes shifted EMAs of several columns within each group.
+
+    This is a vectorized equivalent of calling get_ema on every group
+    separately: a single groupby is shared by all of the columns, and all
+    columns with the same alpha are averaged together.
+
+    Args:
+        data: A pandas DataFrame, ordered by time within each group.
+        group_col: The column to group by, such as "player_name".
+        alphas: A dictionary mapping each column to average to its EMA
+          parameter.
+        seeds: An optional dictionary mapping a column to the EMA of each
+          group before the first row of data, as returned by
+          get_group_ema_states. Seeded groups continue from their seed
+          rather than starting from nan.
+
+    Returns:
+        A DataFrame with the same index as data and a column avg_{col} for
+        each column in alphas, with exactly the semantics of get_ema within
+        each group. Rows whose group is null are left as nan.
+    """
+    import pandas as pd
+    avg_cols = {col: f"avg_{col}" for col in alphas}
+    ewms = _get_group_ewms(data, group_col, alphas, seeds)
+    if ewms.empty:
+        return pd.DataFrame(index=data.index, columns=list(avg_cols.values()),
+                            dtype=float)
+    emas = ewms.groupby(group_col, sort=False)[list(alphas)].shift(1).round(3)
+    emas = emas.iloc[len(emas) - len(data):].rename(columns=avg_cols)
+    emas.index = data.index
+    return emas
+
+
+def get_group_ema_states(
+    data: pd.DataFrame,
+    group_col: str,
+    alphas: Dict[str, float],
+    seeds: Optional[Dict[str, Dict[Any, float]]] = None
+) -> Dict[str, Dict[Any, float]]:
+    """Computes the EMA of several columns after the last row of each group.
+
+    Passing the result as the seeds of get_group_emas or of this function
+    continues the averages with new rows exactly as if they had been
+    appended to data.
+
+    Args:
+        data: A pandas DataFrame, ordered by time within each group.
+        group_col: The column to group by.
+        alphas: A dictionary mapping each column to average to its EMA
+          parameter.
+        seeds: An optional dictionary of EMAs before the first row of data,
+          in the same form as the return value.
+
+    Returns:
+        A dictionary mapping each column in alphas to a dictionary from each
+        group to its unrounded EMA. Groups whose EMA is still nan are omitted.
+    """
+    ewms = _get_group_ewms(data, group_col, alphas, seeds)
+    states = {}
+    for col in alphas:
+        if ewms.empty:
+            states[col] = {}
+            continue
+        last = ewms.groupby(group_col, sort=False)[col].last().dropna()
+        states[col] = last.to_dict()
+    return states
+
+
+def get_group_deadline_emas(
+    data: pd.DataFrame,
+    group_col: str,
+    alphas: Dict[str, float],
+    gw_col: str = "gameweek"
+) -> pd.DataFrame:
+    """Computes EMAs of several columns as they stood before each gameweek.
+
+    Unlike get_group_emas, which includes every earlier row of the group,
+    the average for a row only includes rows from earlier gameweeks. For
+    example, the second fixture of a double gameweek gets the same average
+    as the first.
+
+    Args:
+        data: A pandas DataFrame, ordered by time within each group.
+        group_col: The column to group by, such as "player_name".
+        alphas: A dictionary mapping each column to average to its EMA
+          parameter.
+        gw_col: The column holding each row's gameweek.
+
+    Returns:
+        A DataFrame with the same index as data and a column avg_{col} for
+        each column in alphas, rounded like get_ema.
+    """
+    import pandas as pd
+    cols = list(alphas)
+    ewms = _get_group_ewms(data, group_col, alphas)
+    if ewms.empty:
+        return pd.DataFrame(index=data.index, columns=[f"avg_{col}" for col in cols],
+                            dtype=float)
+    ewms[gw_col] = data[gw_col].to_numpy()
+    gw_emas = ewms.groupby([group_col, gw_col])[cols].last()
+    gw_emas = gw_emas.groupby(level=0).shift(1).round(3)
+    keys = pd.MultiIndex.from_arrays([data[group_col], data[gw_col]])
+    emas = gw_emas.reindex(keys)
+    emas.index = data.index
+    return emas.rename(columns={col: f"avg_{col}" for col in cols})
+
+
+def mapl(f: Callable[[Any], Any], lst: List[Any]) -> List[Any]:
     """Map helper function to avoid wrapping in list() call each time."""
     return list(map(f, lst))
 
@@ -156,3 +342,18 @@ def prepare_string(val: Any) -> str:
         val_escaped = val.replace("'", "''")
         return f"'{val_escaped}'"
     return str(val)
+
+
+def prepare_param(val: Any) -> Any:
+    """Converts a value into a parameter for a parameterized SQL query.
+
+    NaN values are converted to None (i.e. NULL), and numpy scalars are
+    converted to their Python equivalents, since the MySQL connector cannot
+    bind them directly. numpy scalars are recognized by their type's module,
+    so that numpy is not imported for every value.
+    """
+    if val is None or isnan(val):
+        return None
+    if type(val).__module__ == "numpy":
+        return val.item()
+    return val
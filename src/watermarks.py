@@ -0,0 +1,82 @@
+"""A module for recording how far each data source has been ingested.
+
+A source's data is split into numbered partitions, such as FPL gameweeks.
+For each one, a watermark records whether it is finalized, i.e. will not
+change again, and the ETag and hash of the response it was last written
+from, so that unchanged partitions are neither refetched nor rewritten.
+Watermarks of every source are saved to WATERMARKS_FILE.
+"""
+import json
+import os
+import threading
+from typing import Any, Dict, Optional
+from constants import WATERMARKS_FILE
+from httpcache import write_atomic
+
+_file_lock = threading.Lock()
+
+
+class Watermarks:
+    """The watermarks of a single source's partitions."""
+
+    def __init__(self, source: str, path: str = WATERMARKS_FILE):
+        """
+        Args:
+            source: The name of the source, e.g. "fpl_gameweeks".
+            path: The JSON file the watermarks of every source are saved to.
+        """
+        self.source = source
+        self.path = path
+        with _file_lock:
+            self.partitions: Dict[str, Dict[str, Any]] = \
+                self.load().get(source, {})
+
+    def load(self) -> Dict[str, Dict[str, dict]]:
+        """Returns the watermarks of every source saved on disk."""
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, encoding="utf-8") as json_file:
+            return json.load(json_file)
+
+    def get(self, partition: int) -> Optional[Dict[str, Any]]:
+        """Returns the watermark of a partition, or None if it has never been
+        ingested."""
+        return self.partitions.get(str(partition))
+
+    def set(
+        self,
+        partition: int,
+        finalized: bool,
+        etag: Optional[str],
+        digest: str
+    ) -> None:
+        """Records that a partition was ingested.
+
+        Args:
+            partition: The partition, e.g. a gameweek.
+            finalized: Whether the partition's data will not change again.
+            etag: The ETag of the response the partition was ingested from.
+            digest: The hash of the response's body.
+        """
+        self.partitions[str(partition)] = {
+            "finalized": finalized,
+            "etag": etag,
+            "hash": digest
+        }
+
+    def last_finalized(self) -> int:
+        """Returns the last partition n such that partitions 1 to n are all
+        finalized, or 0 if partition 1 is not."""
+        n = 0
+        while (self.get(n + 1) or {}).get("finalized", False):
+            n += 1
+        return n
+
+    def save(self) -> None:
+        """Saves the watermarks, leaving those of other sources as they are
+        on disk."""
+        with _file_lock:
+            sources = self.load()
+            sources[self.source] = self.partitions
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            write_atomic(self.path, json.dumps(sources, indent=4).encode())
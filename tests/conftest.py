@@ -0,0 +1,11 @@
+"""Test configuration.
+
+The modules under src import each other by bare name and resolve data files
+relative to src, so the tests run from that directory.
+"""
+import os
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "src")
+sys.path.insert(0, os.path.abspath(SRC_DIR))
+os.chdir(SRC_DIR)
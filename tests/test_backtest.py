@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+import pytest
+from backtest import backtest, get_error_curves
+from model import predict_all
+from preprocess import player_alphas
+
+
+def make_data():
+    """One midfielder over three gameweeks, the last of them a double."""
+    players = pd.DataFrame({
+        "player_name": ["Saka"] * 4,
+        "position": ["M"] * 4,
+        "team": ["Arsenal"] * 4,
+        "fixture_id": [1, 2, 3, 4],
+        "gameweek": [1, 2, 3, 3],
+        "completed": [1, 1, 1, 1],
+        "npxG": [0.5, 0.1, 0.3, 0.2],
+        "xA": [0.2, 0.4, 0.0, 0.1],
+        "bonus": [3, 0, 1, 0],
+        "minutes": [90, 60, 90, 90],
+        "total_points": [12, 2, 5, 3],
+        "proj_score": [1.8, 1.2, 2.0, 1.5],
+        "opponent_proj_score": [0.8, 1.4, 0.7, 1.1],
+        "avg_team_xG": [np.nan] * 4,
+    })
+    teams = pd.DataFrame({
+        "fixture_id": [1, 2, 3, 4],
+        "team": ["Arsenal"] * 4,
+        "gameweek": [1, 2, 3, 3],
+        "team_xG": [2.0, 1.0, 1.5, 1.2],
+    })
+    return {"players": players, "teams": teams}
+
+
+def test_backtest_only_uses_data_from_before_each_deadline():
+    rows = backtest(make_data())
+    # Nothing is known before the first gameweek, so it is not predicted.
+    assert rows["gameweek"].tolist() == [2, 3, 3]
+    assert rows["avg_npxG"].tolist()[0] == 0.5
+    alpha = player_alphas["npxG"]
+    # Both fixtures of the double gameweek use the averages at its deadline.
+    assert rows["avg_npxG"].tolist()[1:] == [
+        pytest.approx(alpha * 0.1 + (1 - alpha) * 0.5)] * 2
+    assert rows["avg_team_xG"].tolist()[0] == 2.0
+    np.testing.assert_array_equal(rows["xP"], predict_all(rows)[:, -1])
+
+    curves = get_error_curves(rows)
+    assert curves.index.tolist() == [2, 3]
+    assert curves["n"].tolist() == [1, 2]
+    assert curves["mse"].tolist() == curves["mse_M"].tolist()
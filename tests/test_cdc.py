@@ -0,0 +1,91 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from cdc import HASH_TABLE, ChangeWriter, WriteCounts
+
+
+class FakeManager:
+    """Keeps each table as a map from primary key to row."""
+
+    def __init__(self):
+        self.tables = {"player_gws": {}, "players": {}, HASH_TABLE: {}}
+        self.sent = []
+
+    def exec_query(self, query):
+        if HASH_TABLE in query:
+            return [(row["row_key"], row["row_hash"])
+                    for row in self.tables[HASH_TABLE].values()
+                    if f"col_set = '{row['col_set']}'" in query]
+        if "FROM players" in query:
+            return list(self.tables["players"])
+        return list(self.tables["player_gws"])
+
+    def insert_rows(self, table_name, rows, batch_size=1000):
+        for row in rows:
+            if table_name == HASH_TABLE:
+                key = (row["table_name"], row["col_set"], row["row_key"])
+            elif table_name == "players":
+                key = (row["fpl_id"],)
+            else:
+                key = (row["player_id"], row["fixture_id"])
+                self.sent.append(key)
+            self.tables[table_name].setdefault(key, {}).update(row)
+
+    def update_rows(self, table_name, key_cols, rows, batch_size=1000):
+        for row in rows:
+            key = (row["player_id"], row["fixture_id"])
+            if key in self.tables[table_name]:
+                self.sent.append(key)
+                self.tables[table_name][key].update(row)
+
+
+def test_change_writer_only_writes_changed_rows():
+    db = FakeManager()
+    rows = [{"player_id": 1, "fixture_id": f, "minutes": 90} for f in range(3)]
+    assert ChangeWriter(db).insert_rows("player_gws", rows) == WriteCounts(3, 0, 0)
+
+    # A new process reloads the hashes from the database.
+    writer = ChangeWriter(db)
+    db.sent = []
+    rows[1] = {"player_id": 1, "fixture_id": 1, "minutes": 45}
+    rows.append({"player_id": 2, "fixture_id": 0, "minutes": 0})
+    assert writer.insert_rows("player_gws", rows) == WriteCounts(1, 1, 2)
+    assert db.sent == [(1, 1), (2, 0)]
+
+    # Updates of other columns are tracked separately, and rows missing from
+    # the table are not hashed, so they are written once they exist.
+    updates = [{"player_id": 1, "fixture_id": 0, "npxG": 0.5},
+               {"player_id": 3, "fixture_id": 0, "npxG": 0.1}]
+    db.sent = []
+    assert writer.update_rows("player_gws", ["fixture_id", "player_id"],
+                              updates) == WriteCounts(0, 1, 1)
+    writer.insert_rows("player_gws", [
+        {"player_id": 3, "fixture_id": 0, "minutes": 10}])
+    db.sent = []
+    assert writer.update_rows("player_gws", ["fixture_id", "player_id"],
+                              updates) == WriteCounts(0, 1, 1)
+    assert db.sent == [(3, 0)]
+    assert db.tables["player_gws"][(1, 0)] == {
+        "player_id": 1, "fixture_id": 0, "minutes": 90, "npxG": 0.5}
+
+
+def test_change_writer_writes_to_different_tables_concurrently():
+    players_written = threading.Event()
+
+    class SlowManager(FakeManager):
+        def insert_rows(self, table_name, rows, batch_size=1000):
+            # player_gws is only written once players is, which would
+            # deadlock if every write held the same lock
+            if table_name == "player_gws":
+                assert players_written.wait(5)
+            super().insert_rows(table_name, rows, batch_size)
+            if table_name == "players":
+                players_written.set()
+
+    writer = ChangeWriter(SlowManager())
+    with ThreadPoolExecutor(2) as executor:
+        gws = executor.submit(writer.insert_rows, "player_gws",
+                              [{"player_id": 1, "fixture_id": 0, "minutes": 90}])
+        players = executor.submit(writer.insert_rows, "players",
+                                  [{"fpl_id": 1, "web_name": "Saka"}])
+        assert gws.result() == WriteCounts(1, 0, 0)
+        assert players.result() == WriteCounts(1, 0, 0)
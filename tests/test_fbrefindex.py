@@ -0,0 +1,39 @@
+import os
+from fbrefindex import FbrefIndex
+
+PREFIX_PAGE = b"""<html><body>
+<p><a href="/en/players/3f66e626/Aaron"><strong>Aar\xc3\xb3n</strong></a>
+<span class="f-i f-es">es</span>&nbsp;&#183; 2021-2022&nbsp;&#183; DF</p>
+<p><a href="/en/players/a857e282/Aldair-Aaron-Bravo">Aldair Aaron Bravo</a>
+&nbsp;&#183; 2016-2017&nbsp;&#183; MF</p>
+<p><strong>Site Last Updated:</strong> Thursday</p>
+</body></html>"""
+
+SQUAD_PAGE = b"""<html><body><table><tbody>
+<tr><th data-append-csv="bc7dc64d"><a href="/en/players/bc7dc64d/Bukayo-Saka">Bukayo Saka</a></th>
+<td data-stat="position">FW,MF</td></tr>
+</tbody></table></body></html>"""
+
+
+def test_index_parses_pages_and_rebuilds_changed_pages(tmp_path):
+    html_dir = tmp_path / "html"
+    html_dir.mkdir()
+    (html_dir / "aa.html").write_bytes(PREFIX_PAGE)
+    (html_dir / "squad-1-2021-2022.html").write_bytes(SQUAD_PAGE)
+    index_file = str(tmp_path / "index.json")
+
+    index = FbrefIndex(index_file, str(html_dir))
+    assert index.refresh() == 2
+    assert index.entries("aa") == [["aaron", "3f66e626", "DF"]]
+    assert index.entries("squad-1-2021-2022") == [
+        ["bukayo saka", "bc7dc64d", "FW,MF"]]
+    assert index.lookup("aa", ["Aarón", "Aldair Aaron Bravo"]) == "3f66e626"
+    assert index.lookup("squad-1-2021-2022", ["Saka"]) is None
+
+    index = FbrefIndex(index_file, str(html_dir))
+    assert index.refresh() == 0
+    squad_file = html_dir / "squad-1-2021-2022.html"
+    squad_file.write_bytes(SQUAD_PAGE.replace(b"Bukayo Saka", b"Saka"))
+    os.utime(squad_file, (0, 0))
+    assert index.refresh() == 1
+    assert index.lookup("squad-1-2021-2022", ["Saka"]) == "bc7dc64d"
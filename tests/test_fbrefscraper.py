@@ -0,0 +1,118 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import fbref
+import fbrefindex
+import fbrefscraper
+from fbrefindex import FbrefIndex
+from idstore import IdStore
+
+SQUAD_PAGE = b"""<html><body><table><tbody>
+<tr><th data-append-csv="bc7dc64d"><a href="/en/players/bc7dc64d/Bukayo-Saka">Bukayo Saka</a></th>
+<td data-stat="position">FW,MF</td></tr>
+<tr><th data-append-csv="35e413f1"><a href="/en/players/35e413f1/Ben-White">Ben White</a></th>
+<td data-stat="position">DF</td></tr>
+</tbody></table></body></html>"""
+
+PREFIX_PAGE = b"""<html><body>
+<p><a href="/en/players/bc7dc64d/Bukayo-Saka"><strong>Bukayo Saka</strong></a>
+&nbsp;&#183; 2021-2022&nbsp;&#183; FW</p>
+</body></html>"""
+
+
+class Response:
+    status_code = 200
+    ok = True
+    headers = {}
+    content = SQUAD_PAGE
+
+
+def make_player(fpl_id, first_name, second_name):
+    return {"id": fpl_id, "first_name": first_name, "second_name": second_name,
+            "web_name": second_name, "team": 1}
+
+
+def test_players_sharing_a_page_fetch_it_once(tmp_path, monkeypatch):
+    html_dir = tmp_path / "html"
+    html_dir.mkdir()
+    monkeypatch.setattr(fbrefscraper, "HTML_CACHE_DIR", str(html_dir))
+    monkeypatch.setattr(fbrefindex, "_index", FbrefIndex(
+        str(tmp_path / "index.json"), str(html_dir)))
+    monkeypatch.setattr(fbrefscraper.limiter, "acquire", lambda: None)
+    urls = []
+    lock = threading.Lock()
+
+    def get(url, timeout):
+        with lock:
+            urls.append(url)
+        # give the other thread time to find the page missing
+        time.sleep(0.1)
+        return Response()
+
+    monkeypatch.setattr(fbrefscraper.requests, "get", get)
+    players = [make_player(1001, "Bukayo", "Saka"), make_player(1002, "Ben", "White")]
+    with ThreadPoolExecutor(2) as executor:
+        fbref_ids = list(executor.map(fbrefscraper.get_id, players))
+    assert fbref_ids == ["bc7dc64d", "35e413f1"]
+    assert urls == ["https://fbref.com/en/squads/18bb7c10/2021-2022/"]
+    assert [path.name for path in html_dir.iterdir()] == ["squad-1-2021-2022.html"]
+
+
+def test_players_are_only_stored_once_their_pages_are_fetched(tmp_path, monkeypatch):
+    html_dir = tmp_path / "html"
+    html_dir.mkdir()
+    # Saka is not on the squad page, so is searched for on the "sa" page
+    (html_dir / "squad-1-2021-2022.html").write_bytes(
+        SQUAD_PAGE.replace(b"Bukayo Saka", b"Gabriel Martinelli"))
+    monkeypatch.setattr(fbrefscraper, "HTML_CACHE_DIR", str(html_dir))
+    monkeypatch.setattr(fbrefindex, "_index", FbrefIndex(
+        str(tmp_path / "index.json"), str(html_dir)))
+    store = IdStore(str(tmp_path / "ids.sqlite3"))
+    monkeypatch.setattr(fbref, "get_id_store", lambda: store)
+    monkeypatch.setattr(fbrefscraper, "download", lambda url, name: (None, False))
+    saka = make_player(1001, "Bukayo", "Saka")
+
+    assert fbref.get_id(saka) is None
+    assert store.get(1001) == (None, False)
+
+    def download(url, name):
+        fbrefscraper.write_cache(name, PREFIX_PAGE)
+        return PREFIX_PAGE, True
+
+    monkeypatch.setattr(fbrefscraper, "download", download)
+    assert fbref.get_id(saka) == "bc7dc64d"
+    assert store.get(1001) == ("bc7dc64d", True)
+
+    # A player that is on none of the fetched pages is stored as not found.
+    assert fbref.get_id(make_player(1002, "Nobody", "Sanchez")) is None
+    assert store.get(1002) == (None, True)
+    store.close()
+
+
+def test_players_without_an_fbref_id_have_no_seed_stats(tmp_path, monkeypatch):
+    monkeypatch.setattr(fbref, "FBREF_PROGRESS_FILE", str(tmp_path / "progress.json"))
+    progress = {"2021-2022": {"bc7dc64d": {"npxG": 0.3, "xA": 0.2}}}
+    (tmp_path / "progress.json").write_text(json.dumps(progress))
+    assert fbref.get_all_season_stats([None, "bc7dc64d"], "2021-2022") == {
+        None: None, "bc7dc64d": {"npxG": 0.3, "xA": 0.2}}
+
+
+def test_players_are_found_on_prefix_pages_if_their_squad_page_fails(tmp_path, monkeypatch):
+    html_dir = tmp_path / "html"
+    html_dir.mkdir()
+    monkeypatch.setattr(fbrefscraper, "HTML_CACHE_DIR", str(html_dir))
+    monkeypatch.setattr(fbrefindex, "_index", FbrefIndex(
+        str(tmp_path / "index.json"), str(html_dir)))
+
+    def download(url, name):
+        if name.startswith("squad-"):
+            return None, False
+        fbrefscraper.write_cache(name, PREFIX_PAGE)
+        return PREFIX_PAGE, True
+
+    monkeypatch.setattr(fbrefscraper, "download", download)
+    assert fbrefscraper.get_id(make_player(1001, "Bukayo", "Saka")) == "bc7dc64d"
+    with pytest.raises(fbrefscraper.PageNotFetchedError):
+        fbrefscraper.get_id(make_player(1002, "Nobody", "Sanchez"))
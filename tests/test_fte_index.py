@@ -0,0 +1,70 @@
+import pandas as pd
+import pytest
+import fixtures
+import fplapi
+from fixtures import FixtureNotFoundError
+
+TEAM_MAPS = {
+    ("fpl_name", "fte_name"): {"Arsenal": "Arsenal", "Spurs": "Tottenham Hotspur",
+                               "Man Utd": "Manchester United"},
+    ("fpl_id", "fpl_name"): {1: "Arsenal", 2: "Spurs", 3: "Man Utd"},
+}
+
+
+def make_fte_df():
+    return pd.DataFrame({
+        "date": ["2022-10-01", "2023-01-15"],
+        "team1": ["Arsenal", "Tottenham Hotspur"],
+        "team2": ["Tottenham Hotspur", "Arsenal"],
+        "proj_score1": [1.9, 1.4],
+        "proj_score2": [0.9, 1.3],
+        "score1": [3, None],
+        "score2": [1, None],
+        "xg1": [2.1, None],
+        "xg2": [0.8, None],
+    })
+
+
+def make_fixture(fpl_id, team_h, team_a):
+    return {"id": fpl_id, "team_h": team_h, "team_a": team_a, "event": 9,
+            "kickoff_time": "2022-10-01T11:30:00Z", "finished": True}
+
+
+@pytest.fixture
+def fte(monkeypatch):
+    loads = []
+
+    def get_fte_df():
+        loads.append(True)
+        return make_fte_df()
+
+    async def get_understat_fixtures():
+        return {"Arsenal": {"Spurs": 100, "Man Utd": 101},
+                "Spurs": {"Arsenal": 102}}
+
+    monkeypatch.setattr(fixtures, "_fte_index", None)
+    monkeypatch.setattr(fixtures, "get_fte_df", get_fte_df)
+    monkeypatch.setattr(fixtures, "get_team_map",
+                        lambda key_col, val_col: TEAM_MAPS[(key_col, val_col)])
+    monkeypatch.setattr(fixtures, "get_understat_fixtures", get_understat_fixtures)
+    return loads
+
+
+def test_fte_index_is_loaded_once_and_keyed_by_team_pair(fte):
+    assert fixtures.get_match_stats("Arsenal", "Spurs")["proj_score1"] == 1.9
+    assert fixtures.get_match_stats("Spurs", "Arsenal")["proj_score2"] == 1.3
+    assert fte == [True]
+
+
+def test_get_fixtures_reports_every_missing_fixture(fte, monkeypatch):
+    monkeypatch.setattr(fplapi, "get", lambda url: [
+        make_fixture(1, 1, 2), make_fixture(2, 1, 3), make_fixture(3, 3, 1)])
+    with pytest.raises(FixtureNotFoundError) as e:
+        fixtures.get_fixtures()
+    assert e.value.fixtures == [("Arsenal", "Man Utd"), ("Man Utd", "Arsenal")]
+
+    monkeypatch.setattr(fplapi, "get", lambda url: [make_fixture(1, 1, 2)])
+    [row] = fixtures.get_fixtures()
+    assert row["understat_id"] == 100
+    assert (row["home_score"], row["away_proj_score"]) == (3, 0.9)
+    assert fte == [True]
@@ -0,0 +1,64 @@
+import httpcache
+from httpcache import fetch_cached
+
+URL = "https://fantasy.premierleague.com/api/bootstrap-static/"
+
+
+class Response:
+
+    def __init__(self, status_code, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        assert self.status_code < 400
+
+
+class Session:
+    """Replies to each request with the next queued response."""
+
+    def __init__(self):
+        self.responses = []
+        self.requests = []
+
+    def get(self, url, headers, timeout):
+        self.requests.append((url, headers))
+        return self.responses.pop(0)
+
+
+def test_fetch_cached_serves_fresh_responses_and_revalidates_stale_ones(tmp_path, monkeypatch):
+    now = [1000.0]
+    session = Session()
+    monkeypatch.setattr(httpcache.time, "time", lambda: now[0])
+    monkeypatch.setattr(httpcache.requests, "get", session.get)
+    cache_file = str(tmp_path / "bootstrap.json")
+
+    session.responses.append(Response(200, b"v1", {
+        "ETag": '"abc"', "Last-Modified": "Sat, 01 Oct 2022 10:00:00 GMT"}))
+    assert fetch_cached(URL, cache_file, ttl=3600) == b"v1"
+    assert session.requests == [(URL, {})]
+
+    # A fresh response is served without any request.
+    now[0] += 3599
+    assert fetch_cached(URL, cache_file, ttl=3600) == b"v1"
+    assert len(session.requests) == 1
+
+    # A stale one is revalidated, and reused while it is not modified.
+    now[0] += 1
+    session.responses.append(Response(304))
+    assert fetch_cached(URL, cache_file, ttl=3600) == b"v1"
+    assert session.requests[-1] == (URL, {
+        "If-None-Match": '"abc"',
+        "If-Modified-Since": "Sat, 01 Oct 2022 10:00:00 GMT"})
+    now[0] += 60
+    assert fetch_cached(URL, cache_file, ttl=3600) == b"v1"
+    assert len(session.requests) == 2
+
+    now[0] += 3600
+    session.responses.append(Response(200, b"v2", {"ETag": '"def"'}))
+    assert fetch_cached(URL, cache_file, ttl=3600) == b"v2"
+    now[0] += 3600
+    session.responses.append(Response(304))
+    assert fetch_cached(URL, cache_file, ttl=3600) == b"v2"
+    assert session.requests[-1] == (URL, {"If-None-Match": '"def"'})
@@ -0,0 +1,45 @@
+from identity import Candidate, NameIndex, resolve
+
+
+def make_player(fpl_id, names, team, position):
+    return {
+        "fpl_id": fpl_id,
+        "names": names,
+        "teams": frozenset([team]),
+        "positions": frozenset([position])
+    }
+
+
+def test_resolve_matches_fuzzily_within_team_and_position():
+    index = NameIndex([
+        Candidate(1, "Cedric Soares", frozenset(["Arsenal"]), frozenset("D")),
+        Candidate(2, "Gabriel", frozenset(["Arsenal"]), frozenset("D")),
+        Candidate(3, "Gabriel Martinelli", frozenset(["Arsenal"]), frozenset("FM")),
+        Candidate(4, "Bernd Leno", frozenset(["Fulham"]), frozenset("G")),
+        Candidate(5, "Bernd Leno", frozenset(["Fulham"]), frozenset("D")),
+    ])
+    players = [
+        make_player(10, ["Cédric Alves Soares", "Cédric"], "Arsenal", "D"),
+        make_player(11, ["Gabriel dos Santos Magalhães", "Gabriel"], "Arsenal", "D"),
+        make_player(12, ["Gabriel Teodoro Martinelli Silva", "Martinelli"],
+                    "Arsenal", "M"),
+        make_player(13, ["Bernd Leno", "Leno"], "Fulham", "G"),
+        make_player(14, ["Bernd Leno"], "Arsenal", "G"),
+    ]
+    matches = resolve(players, [index], overrides={15: 6})
+    assert {fpl_id: match.id for fpl_id, match in matches.items()} == {
+        10: 1, 11: 2, 12: 3, 13: 4, 15: 6}
+    assert matches[11].score == 1.0
+
+
+def test_resolve_assigns_each_source_id_once():
+    index = NameIndex([Candidate(1, "Danny Ward")])
+    players = [make_player(10, ["Danny Ward"], "Leicester", "G"),
+               make_player(11, ["Daniel Ward"], "Leicester", "G")]
+    matches = resolve(players, [index])
+    assert list(matches) == [10]
+
+
+def test_single_names_are_skipped_when_min_tokens_is_two():
+    index = NameIndex([Candidate(1, "Jesus")], min_tokens=2)
+    assert index.search(["Jesus"]) == []
@@ -0,0 +1,25 @@
+import json
+from idstore import IdStore
+
+
+def test_id_store_imports_legacy_json_once(tmp_path):
+    legacy_file = tmp_path / "ids.json"
+    legacy_file.write_text(json.dumps({"7": "79300479", "244": None}))
+    path = str(tmp_path / "ids.sqlite3")
+
+    store = IdStore(path, legacy_files=[str(legacy_file)])
+    assert store.get(7) == ("79300479", True)
+    assert store.get(244) == (None, True)
+    assert store.get(1) == (None, False)
+
+    store.put(1, "839c14e1")
+    store.put(7, "other")
+    assert store.get(1) == ("839c14e1", True)
+    assert store.get(7) == ("79300479", True)
+    store.close()
+
+    legacy_file.write_text(json.dumps({"3": "abc"}))
+    store = IdStore(path, legacy_files=[str(legacy_file)])
+    assert store.get(3) == (None, False)
+    assert store.items() == {1: "839c14e1", 7: "79300479", 244: None}
+    store.close()
@@ -0,0 +1,24 @@
+import subprocess
+import sys
+
+HEAVY_MODULES = {"pandas", "numpy", "scipy", "sqlalchemy"}
+# The total time spent importing modules, in microseconds. It is well under
+# a fifth of this without the heavy modules, so the budget leaves room for a
+# loaded machine, while importing any of them would come close to using it.
+IMPORT_BUDGET_US = 500000
+
+
+def test_predict_help_is_fast_and_skips_heavy_imports():
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "predict.py", "--help"],
+        capture_output=True, text=True, check=True
+    )
+    # Each line is "import time: <self us> | <cumulative us> | <module>".
+    timings = [line[len("import time:"):].split("|")
+               for line in result.stderr.splitlines()
+               if line.startswith("import time:") and "self [us]" not in line]
+    imported = {module.strip().split(".")[0] for _, _, module in timings}
+    assert imported.isdisjoint(HEAVY_MODULES), imported & HEAVY_MODULES
+    assert "usage: predict.py" in result.stdout
+    import_time = sum(int(self_us) for self_us, _, _ in timings)
+    assert import_time < IMPORT_BUDGET_US, import_time
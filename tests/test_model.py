@@ -0,0 +1,11 @@
+import numpy as np
+import pandas as pd
+from constants import GW_HISTORY_FILE
+from model import predict, predict_all
+
+
+def test_predict_all_matches_predict():
+    gw_df = pd.read_csv(GW_HISTORY_FILE)
+    rows = gw_df[gw_df["avg_minutes"] > 0].sample(500, random_state=0)
+    expected = np.array([predict(row) for _, row in rows.iterrows()])
+    np.testing.assert_array_equal(predict_all(rows), expected)
@@ -0,0 +1,122 @@
+import mongomock
+from mongomock.collection import BulkOperationBuilder
+import pytest
+import fbref
+import fplapi
+import match
+from mongo import Handler
+
+
+def make_element(fpl_id):
+    return {"id": fpl_id, "first_name": "A", "second_name": f"B{fpl_id}",
+            "web_name": f"B{fpl_id}", "element_type": 3, "team": 1}
+
+
+def allow_sort(add_update):
+    """Drops the sort option, which pymongo 4.11+ passes to bulk updates but
+    older mongomock releases do not accept."""
+    def wrapper(self, *args, sort=None, **kwargs):
+        return add_update(self, *args, **kwargs)
+    return wrapper
+
+
+def test_update_players_seeds_in_batches_and_resumes(monkeypatch):
+    monkeypatch.setattr(BulkOperationBuilder, "add_update",
+                        allow_sort(BulkOperationBuilder.add_update))
+    failed = {"fb3"}
+    fetched = []
+
+    def get_all_season_stats(fbref_ids, season, concurrency):
+        fetched.extend(fbref_ids)
+        return {fbref_id: None if fbref_id in failed else {"npxG": 0.1, "xA": 0.2}
+                for fbref_id in fbref_ids}
+
+    monkeypatch.setattr(fplapi, "get_players",
+                        lambda: [make_element(i) for i in range(1, 6)])
+    monkeypatch.setattr(fbref, "get_id", lambda element: f"fb{element['id']}")
+    monkeypatch.setattr(fbref, "get_all_season_stats", get_all_season_stats)
+    handler = Handler(mongomock.MongoClient())
+
+    assert handler.update_players(batch_size=2, workers=2) == 5
+    players = handler.players_collection
+    assert players.count_documents({}) == 5
+    assert players.find_one({"fpl_id": 3})["seed_stats"] is None
+
+    # Only the player whose stats could not be fetched is seeded again, and
+    # their document is replaced rather than duplicated.
+    failed.clear()
+    fetched.clear()
+    assert handler.update_players(batch_size=2, workers=2) == 1
+    assert fetched == ["fb3"]
+    assert players.count_documents({}) == 5
+    assert players.find_one({"fpl_id": 3})["seed_stats"] == {"npxG": 0.1, "xA": 0.2}
+    assert players.find_one({"fpl_id": 3})["fbref_id"] == "fb3"
+
+
+def make_live_element(fpl_id, fixture_id, minutes, expected_goals):
+    return {
+        "id": fpl_id,
+        "stats": {"minutes": minutes, "expected_goals": expected_goals,
+                  "expected_assists": "0.00"},
+        "explain": [{"fixture": fixture_id, "stats": [
+            {"identifier": "minutes", "points": 2 if minutes else 0,
+             "value": minutes}]}]
+    }
+
+
+def test_update_matches_appends_new_gameweeks_incrementally(monkeypatch):
+    monkeypatch.setattr(BulkOperationBuilder, "add_update",
+                        allow_sort(BulkOperationBuilder.add_update))
+    finalized = {1, 2}
+    live = {
+        1: [make_live_element(1, 10, 90, "0.50"), make_live_element(2, 10, 0, "0.00")],
+        2: [make_live_element(1, 20, 60, "0.00"), make_live_element(2, 20, 0, "0.00")],
+        3: [make_live_element(1, 30, 90, "1.00"), make_live_element(2, 30, 0, "0.00")],
+    }
+    fetched = []
+
+    def get(url):
+        fetched.append(url)
+        if "live" in url:
+            return {"elements": live[int(url.split("/")[-3])]}
+        return [{"id": 40, "event": 4, "finished": False, "team_h": 1, "team_a": 2}]
+
+    monkeypatch.setattr(fplapi, "get", get)
+    monkeypatch.setattr(fplapi, "get_events", lambda: [
+        {"id": gw, "finished": gw in finalized, "data_checked": gw in finalized}
+        for gw in range(1, 5)])
+    monkeypatch.setattr(fplapi, "get_elements", lambda: [
+        {"id": 1, "team": 1}, {"id": 2, "team": 2}])
+    handler = Handler(mongomock.MongoClient())
+    handler.players_collection.insert_one(
+        {"fpl_id": 1, "seed_stats": {"npxG": 0.2, "xA": 0.1}})
+
+    assert handler.update_matches() == 2
+    player = handler.matches_collection.find_one({"fpl_id": 1})
+    assert [m["fixture_id"] for m in player["completed"]] == [10, 20]
+    assert player["emas"]["npxG"] == pytest.approx(0.85 * (0.15 * 0.5 + 0.85 * 0.2))
+    assert player["upcoming"] == [
+        {"gw": 4, "fixture_id": 40, "opponent_id": 2, "home": True}]
+    assert handler.metadata_collection.find_one({"_id": "matches"})[
+        "last_gw_updated"] == 2
+
+    # Nothing new is finalized, so no gameweek is fetched or written.
+    fetched.clear()
+    assert handler.update_matches() == 0
+    assert not any("live" in url for url in fetched)
+
+    # New alphas recompute the EMAs from the stored history.
+    monkeypatch.setitem(match.ema_alphas, "npxG", 0.5)
+    assert handler.update_matches() == 1
+    player = handler.matches_collection.find_one({"fpl_id": 1})
+    assert player["emas"]["npxG"] == pytest.approx(0.5 * (0.5 * 0.5 + 0.5 * 0.2))
+
+    finalized.add(3)
+    fetched.clear()
+    assert handler.update_matches() == 2
+    assert [url for url in fetched if "live" in url] == [
+        "https://fantasy.premierleague.com/api/event/3/live/"]
+    player = handler.matches_collection.find_one({"fpl_id": 1})
+    assert [m["fixture_id"] for m in player["completed"]] == [10, 20, 30]
+    assert player["completed"][1]["npxG"] == 0.0
+    assert handler.matches_collection.find_one({"fpl_id": 2})["completed"][0]["npxG"] is None
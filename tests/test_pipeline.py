@@ -0,0 +1,86 @@
+import json
+import threading
+import metrics
+import pipeline
+import preprocess
+from pipeline import BLOCKED, FAILED, SKIPPED, SUCCEEDED, Stage, run_pipeline
+
+
+def get_statuses(results):
+    return {result.stage: result.status for result in results}
+
+
+def test_pipeline_runs_independent_stages_concurrently_and_skips_reruns(tmp_path):
+    state_file = str(tmp_path / "state.json")
+    barrier = threading.Barrier(2, timeout=5)
+    runs = []
+
+    def make_run(name, wait=False):
+        def run():
+            if wait:
+                # Only returns if both stages run at the same time.
+                barrier.wait()
+            metrics.record_rows(2)
+            metrics.record_http_call()
+            runs.append(name)
+        return run
+
+    stages = [
+        Stage("a", make_run("a")),
+        Stage("b", make_run("b", wait=True), ("a",)),
+        Stage("c", make_run("c", wait=True), ("a",)),
+        Stage("d", make_run("d"), ("b", "c")),
+    ]
+    results = run_pipeline(stages, state_file=state_file)
+    assert get_statuses(results) == dict.fromkeys("abcd", SUCCEEDED)
+    assert runs[0] == "a" and runs[-1] == "d"
+    assert all(result.rows_written == 2 and result.http_calls == 1
+               for result in results)
+
+    results = run_pipeline(stages, state_file=state_file)
+    assert get_statuses(results) == dict.fromkeys("abcd", SKIPPED)
+    assert len(runs) == 4
+
+
+def test_pipeline_blocks_dependents_of_failed_stages(tmp_path):
+    state_file = str(tmp_path / "state.json")
+    inputs = {"a": 1}
+
+    def fail():
+        raise RuntimeError("boom")
+
+    stages = [
+        Stage("a", lambda: None, inputs=lambda: inputs["a"]),
+        Stage("b", fail, ("a",)),
+        Stage("c", lambda: None, ("b",)),
+        Stage("d", lambda: None, ("a",)),
+    ]
+    results = run_pipeline(stages, state_file=state_file)
+    assert get_statuses(results) == {
+        "a": SUCCEEDED, "b": FAILED, "c": BLOCKED, "d": SUCCEEDED}
+    errors = {result.stage: result.error for result in results}
+    assert errors["b"] == "RuntimeError: boom"
+
+    # Changed inputs rerun the stage and everything downstream of it.
+    inputs["a"] = 2
+    stages[1] = Stage("b", lambda: None, ("a",))
+    results = run_pipeline(stages, state_file=state_file)
+    assert get_statuses(results) == dict.fromkeys("abcd", SUCCEEDED)
+
+
+def test_model_inputs_change_with_the_alphas(monkeypatch):
+    inputs = json.dumps(pipeline.get_model_inputs())
+    monkeypatch.setitem(preprocess.player_alphas, "npxG", 0.5)
+    assert json.dumps(pipeline.get_model_inputs()) != inputs
+
+
+def test_expiring_inputs_change_once_the_ttl_passes(monkeypatch):
+    now = [3600.0]
+    monkeypatch.setattr(pipeline, "get_gameweek_inputs", lambda: [[1, True]])
+    monkeypatch.setattr(pipeline.time, "time", lambda: now[0])
+    get_inputs = pipeline.get_expiring_inputs(3600)
+    inputs = get_inputs()
+    now[0] += 3599
+    assert get_inputs() == inputs
+    now[0] += 1
+    assert get_inputs() != inputs
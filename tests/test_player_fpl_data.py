@@ -0,0 +1,80 @@
+import asyncio
+import json
+from aiohttp import web
+import player_fpl_data
+from player_fpl_data import GwWatermarks, ingest_gw_data
+from watermarks import Watermarks
+
+
+class FakeManager:
+    def __init__(self):
+        self.written = []
+
+    def insert_rows(self, table_name, rows):
+        if table_name == "player_gws":
+            self.written.extend(row["fixture_id"] for row in rows)
+        return len(rows)
+
+
+class FakeRegistry:
+    def get(self, fpl_id):
+        return {"team_name": "Arsenal"}
+
+
+def make_body(gw, points):
+    return json.dumps({"elements": [{
+        "id": 1,
+        "stats": {"minutes": 90},
+        "explain": [{"fixture": gw, "stats": [
+            {"identifier": "minutes", "points": points, "value": 90}]}]
+    }]})
+
+
+async def ingest(monkeypatch, db, bodies, watermarks, finalized_gws):
+    """Serves the gameweek bodies locally, with an ETag for gameweek 1
+    only, and ingests them."""
+    async def handle(request):
+        gw = int(request.match_info["gw"])
+        if gw == 1:
+            if request.headers.get("If-None-Match") == '"gw1"':
+                return web.Response(status=304)
+            return web.Response(text=bodies[gw], headers={"ETag": '"gw1"'})
+        return web.Response(text=bodies[gw])
+
+    app = web.Application()
+    app.router.add_get("/event/{gw}/live/", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    monkeypatch.setattr(player_fpl_data, "FPL_GAMEWEEK_URL",
+                        f"http://127.0.0.1:{port}/event/{{}}/live/")
+    try:
+        return await ingest_gw_data(
+            db, range(1, 4), {}, 2, GwWatermarks(watermarks, finalized_gws))
+    finally:
+        await runner.cleanup()
+
+
+def test_ingest_skips_unchanged_gameweeks(tmp_path, monkeypatch):
+    monkeypatch.setattr(player_fpl_data, "get_registry", FakeRegistry)
+    path = str(tmp_path / "watermarks.json")
+    bodies = {gw: make_body(gw, 2) for gw in range(1, 4)}
+
+    db = FakeManager()
+    watermarks = Watermarks("fpl_gameweeks", path)
+    assert asyncio.run(ingest(monkeypatch, db, bodies, watermarks, {1, 2})) == 0
+    assert sorted(db.written) == [1, 2, 3]
+    watermarks.save()
+
+    # Gameweek 1 is not modified, gameweek 2 is identical and gameweek 3,
+    # which is still in progress, has changed.
+    bodies[3] = make_body(3, 3)
+    db = FakeManager()
+    watermarks = Watermarks("fpl_gameweeks", path)
+    assert watermarks.last_finalized() == 2
+    assert asyncio.run(ingest(monkeypatch, db, bodies, watermarks, {1, 2})) == 2
+    assert db.written == [3]
+    assert watermarks.get(1)["etag"] == '"gw1"'
+    assert not watermarks.get(3)["finalized"]
@@ -0,0 +1,74 @@
+import json
+import os
+import subprocess
+import sys
+import players
+from players import PlayerRegistry
+
+PLAYERS = [
+    {"fpl_id": 1, "understat_id": 847, "fpl_name": "Cédric Alves Soares",
+     "team_name": "Arsenal", "position": "D"},
+    {"fpl_id": 2, "understat_id": None, "fpl_name": "Bernd Leno",
+     "team_name": "Fulham", "position": "G"},
+]
+
+
+def test_registry_loads_once_and_indexes_players(tmp_path, monkeypatch):
+    players_file = tmp_path / "players.json"
+    players_file.write_text(json.dumps(PLAYERS))
+    monkeypatch.setattr(players, "PLAYERS_FILE", str(players_file))
+    calls = []
+
+    def get_player_list(cache):
+        calls.append(cache)
+        return PLAYERS
+
+    monkeypatch.setattr(players, "get_player_list", get_player_list)
+    registry = PlayerRegistry(ttl=60)
+    assert registry.get(1)["team_name"] == "Arsenal"
+    assert registry.get_by_understat_id(847)["fpl_id"] == 1
+    assert registry.find("cedric alves-soares") == [PLAYERS[0]]
+    assert registry.get(2)["fpl_name"] == "Bernd Leno"
+    assert calls == [True]
+
+    registry.refresh()
+    assert calls == [True, False]
+
+    os.utime(players_file, (0, 0))
+    PlayerRegistry(ttl=60).players()
+    assert calls == [True, False, False]
+
+
+def test_registry_refreshes_once_for_a_missing_player(tmp_path, monkeypatch):
+    players_file = tmp_path / "players.json"
+    players_file.write_text(json.dumps(PLAYERS))
+    monkeypatch.setattr(players, "PLAYERS_FILE", str(players_file))
+    new_player = {"fpl_id": 3, "understat_id": None, "fpl_name": "Ben White",
+                  "team_name": "Arsenal", "position": "D"}
+    calls = []
+
+    def get_player_list(cache):
+        calls.append(cache)
+        return PLAYERS if cache else PLAYERS + [new_player]
+
+    monkeypatch.setattr(players, "get_player_list", get_player_list)
+    registry = PlayerRegistry(ttl=60)
+    assert registry.get(3) == new_player
+    assert calls == [True, False]
+
+    # A player that is still missing after a refresh does not refresh again.
+    assert registry.get(99) is None
+    assert registry.get(99) is None
+    assert calls == [True, False, False]
+
+
+def test_importing_player_fpl_data_makes_no_network_calls():
+    code = (
+        "import socket\n"
+        "def fail(*args, **kwargs):\n"
+        "    raise AssertionError('network call at import')\n"
+        "socket.socket.connect = fail\n"
+        "socket.getaddrinfo = fail\n"
+        "import player_fpl_data, managers\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+import preprocess
+from constants import GW_HISTORY_FILE
+from preprocess import compute_emas
+from utils import get_ema, get_group_ema_states
+
+alphas = {"npxG": 0.15, "xA": 0.15, "bonus": 0.2, "minutes": 0.4}
+
+
+def compute_emas_by_player(data, stats, alpha):
+    """The original per-player implementation of compute_emas."""
+    dfc = data.copy()
+    for stat in stats:
+        avg_stat = f"avg_{stat}"
+        for player in data["player_name"].unique():
+            is_player = data["player_name"] == player
+            row = data[is_player]
+            dfc.loc[is_player, avg_stat] = get_ema(row[stat], alpha)
+    return dfc
+
+
+def test_compute_emas_matches_per_player_ema():
+    gw_df = pd.read_csv(GW_HISTORY_FILE).drop(
+        columns=[f"avg_{stat}" for stat in alphas])
+    expected = gw_df
+    for stat, alpha in alphas.items():
+        expected = compute_emas_by_player(expected, [stat], alpha)
+    actual = compute_emas(gw_df, alphas)
+    for stat in alphas:
+        np.testing.assert_array_equal(
+            actual[f"avg_{stat}"].to_numpy(),
+            expected[f"avg_{stat}"].to_numpy()
+        )
+
+
+def test_update_player_emas_only_extends_new_gameweeks(monkeypatch, tmp_path):
+    gw_df = pd.read_csv(GW_HISTORY_FILE).drop(
+        columns=[f"avg_{stat}" for stat in alphas])
+    monkeypatch.setattr(preprocess, "GW_HISTORY_FILE", tmp_path / "gw.csv")
+    expected = compute_emas(gw_df, alphas)
+    state = preprocess.new_ema_state()
+    first_run = preprocess.update_player_emas(
+        gw_df[gw_df["gameweek"] <= 20], state, 20)
+    first_run.to_csv(preprocess.GW_HISTORY_FILE, index=False)
+    state["last_gw_updated"] = 20
+    actual = preprocess.update_player_emas(gw_df, state, 38)
+    for stat in alphas:
+        np.testing.assert_array_equal(
+            actual[f"avg_{stat}"].to_numpy(),
+            expected[f"avg_{stat}"].to_numpy()
+        )
+    assert state["emas"]["npxG"] == pytest.approx(
+        get_group_ema_states(gw_df, "player_name", {"npxG": 0.15})["npxG"])
@@ -0,0 +1,24 @@
+import pytest
+from ratelimit import TokenBucket, parse_retry_after
+
+
+def test_token_bucket_spaces_out_reservations():
+    bucket = TokenBucket(rate=10, capacity=2)
+    waits = [bucket.reserve() for _ in range(4)]
+    assert waits[:2] == [0.0, 0.0]
+    assert waits[2] == pytest.approx(0.1, abs=0.01)
+    assert waits[3] == pytest.approx(0.2, abs=0.01)
+
+
+def test_token_bucket_pause_delays_everyone():
+    bucket = TokenBucket(rate=10)
+    bucket.pause(5)
+    assert bucket.reserve() == pytest.approx(5.1, abs=0.01)
+    assert bucket.reserve() == pytest.approx(5.2, abs=0.01)
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("30", 60) == 30
+    assert parse_retry_after(None, 60) == 60
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT", 60) == 0
+    assert parse_retry_after("soon", 60) == 60
@@ -0,0 +1,21 @@
+import numpy as np
+import pandas as pd
+from constants import GW_HISTORY_FILE
+from model import predict_all
+from simulate import simulate
+
+
+def test_simulation_is_deterministic_for_a_seed():
+    gw_df = pd.read_csv(GW_HISTORY_FILE)
+    rows = gw_df[(gw_df["avg_minutes"] > 0) & (gw_df["position"] == "F")]
+    rows = rows.sample(50, random_state=0)
+    results = simulate(rows, draws=20000, seed=1)
+    pd.testing.assert_frame_equal(results, simulate(rows, draws=20000, seed=1))
+    assert not results.equals(simulate(rows, draws=20000, seed=2))
+
+    # Forwards score nothing for clean sheets or goals conceded, so their
+    # simulated mean matches the model's xP.
+    valid = rows.set_index(["player_id", "fixture_id"]).loc[
+        pd.MultiIndex.from_frame(results[["player_id", "fixture_id"]])]
+    xp = predict_all(valid)[:, -1]
+    np.testing.assert_allclose(results["mean_points"], xp, rtol=0.05, atol=0.05)